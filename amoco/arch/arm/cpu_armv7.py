@@ -10,17 +10,24 @@ uarch = dict(filter(lambda kv:kv[0].startswith('i_'),locals().iteritems()))
 
 from amoco.arch.core import instruction, disassembler
 
-instruction.set_uarch(uarch)
+# bind uarch and formatter to a dedicated instruction class so that importing
+# other cpu modules does not change the semantics of existing instructions:
+instruction_armv7 = type('instruction_armv7',(instruction,),{'__slots__':()})
+instruction_armv7.set_uarch(uarch)
 
 # define disassembler:
 from amoco.arch.arm.v7 import spec_armv7
 from amoco.arch.arm.v7 import spec_thumb
 
 from amoco.arch.arm.v7.formats import ARM_V7_full
-instruction.set_formatter(ARM_V7_full)
+instruction_armv7.set_formatter(ARM_V7_full)
 
 
-mode   = (lambda : internals['isetstate'])
-endian = (lambda : 1 if internals['endianstate']==0 else -1)
+# default decoding context is taken from internals, use the ctx keyword
+# argument of disassemble to decode with an explicit DecodeContext (programs
+# decode with the context of their CPUContext, see system.core).
+mode    = (lambda **kargs: internals['isetstate'])
+endian  = (lambda **kargs: 1 if internals['endianstate']==0 else -1)
+itstate = (lambda **kargs: internals['itstate'])
 
-disassemble = disassembler([spec_armv7,spec_thumb],mode,endian)
+disassemble = disassembler([spec_armv7,spec_thumb],mode,endian,itstate,iclass=instruction_armv7)
@@ -10,14 +10,17 @@ uarch = dict(filter(lambda kv:kv[0].startswith('i_'),locals().iteritems()))
 
 from amoco.arch.core import instruction, disassembler
 
-instruction.set_uarch(uarch)
+# bind uarch and formatter to a dedicated instruction class so that importing
+# other cpu modules does not change the semantics of existing instructions:
+instruction_armv8 = type('instruction_armv8',(instruction,),{'__slots__':()})
+instruction_armv8.set_uarch(uarch)
 
 # define disassembler:
 from amoco.arch.arm.v8 import spec_armv8
 from amoco.arch.arm.v8.formats import ARM_V8_full
 
-instruction.set_formatter(ARM_V8_full)
+instruction_armv8.set_formatter(ARM_V8_full)
 
-endian = (lambda : 1 if internals['endianstate']==0 else -1)
+endian = (lambda **kargs: 1 if internals['endianstate']==0 else -1)
 
-disassemble = disassembler([spec_armv8],endian=endian)
+disassemble = disassembler([spec_armv8],endian=endian,iclass=instruction_armv8)
@@ -19,17 +19,17 @@ logger = Log(__name__)
 #------------------------------------------------------------------------------
 # low level functions :
 
-def _switch_isetstate():
-    _s = internals['isetstate']
-    internals['isetstate'] = 0 if _s==1 else 1
-    logger.info('switch to %s instructions'%({0:'ARM',1:'Thumb'}[internals['isetstate']]))
+def _switch_isetstate(i):
+    _s = getstate(i,'isetstate')
+    setstate(i,'isetstate',0 if _s==1 else 1)
+    logger.info('switch to %s instructions'%({0:'ARM',1:'Thumb'}[getstate(i,'isetstate')]))
 
 def __check_state(i,fmap):
     address = fmap(pc)
     if address.bit(0)==1:
-        internals['isetstate'] = 1
+        setstate(i,'isetstate',1)
     elif address.bit(1)==0:
-        internals['isetstate'] = 0
+        setstate(i,'isetstate',0)
     else:
         if address._is_cst:
             raise InstructionError(i)
@@ -66,7 +66,7 @@ def i_B(i,fmap):
     fmap[pc] = fmap(pc+i.length)
     cond = CONDITION[i.cond][1]
     pcoffset = i.length
-    if internals['isetstate'] and pcoffset==4: pcoffset=0
+    if getstate(i,'isetstate') and pcoffset==4: pcoffset=0
     fmap[pc] = fmap(tst(cond,pc+i.imm32+pcoffset,pc))
     __check_state(i,fmap)
 
@@ -88,7 +88,7 @@ def i_BL(i,fmap):
     offset = i.operands[0]
     cond = CONDITION[i.cond][1]
     pcoffset = i.length
-    if internals['isetstate']==1 and pcoffset==4: pcoffset=0
+    if getstate(i,'isetstate')==1 and pcoffset==4: pcoffset=0
     fmap[pc] = fmap(tst(cond,pc+offset+pcoffset,pc))
     __check_state(i,fmap)
 
@@ -105,7 +105,7 @@ def i_BX(i,fmap):
     src = i.operands[0]
     cond = CONDITION[i.cond][1]
     fmap[pc] = fmap(tst(cond,src,pc))
-    _switch_isetstate()
+    _switch_isetstate(i)
 
 def i_BXJ(i,fmap):
     fmap[pc] = fmap(pc+i.length)
@@ -113,7 +113,7 @@ def i_BXJ(i,fmap):
     src = i.operands[0]
     cond = CONDITION[i.cond][1]
     fmap[pc] = fmap(tst(cond,src,pc))
-    internals['isetstate'] = 2
+    setstate(i,'isetstate',2)
     logger.error('switch to Jazelle instructions (unsupported)')
 
 # Data processing instructions (A4.4)
@@ -835,9 +835,9 @@ def i_ISB(i,fmap):
     fmap[pc] = fmap(pc+i.length)
 
 def i_IT(i,fmap):
-    assert internals['isetstate']==1
+    assert getstate(i,'isetstate')==1
     fmap[pc] = fmap(pc+i.length)
-    internals['itstate'] = 1
+    setstate(i,'itstate',1)
 
 def i_NOP(i,fmap):
     fmap[pc] = fmap(pc+i.length)
@@ -866,7 +866,7 @@ def i_PLI(i,fmap):
 # change endianess
 def i_SETEND(i,fmap):
     fmap[pc] = fmap(pc+i.length)
-    internals['endianstate'] = 1 if i.set_bigend else 0
+    setstate(i,'endianstate',1 if i.set_bigend else 0)
     exp.setendian(-1 if i.set_bigend else +1)
 
 # event hint
@@ -894,11 +894,11 @@ def i_SWPB(i,fmap):
 
 def i_ENTERX(i,fmap):
     fmap[pc] = fmap(pc+i.length)
-    internals['isetstate'] = 3
+    setstate(i,'isetstate',3)
 
 def i_LEAVEX(i,fmap):
     fmap[pc] = fmap(pc+i.length)
-    internals['isetstate'] = 1
+    setstate(i,'isetstate',1)
 
 def i_SMC(i,fmap):
     raise InstructionError(i)
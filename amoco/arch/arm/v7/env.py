@@ -88,6 +88,28 @@ internals = {    # states MUST be in a mutable object !
         'endianstate': 0, #0: LE, 1: BE
 }
 
+# internals are only the default states: states of a program are held by the
+# DecodeContext of its CPUContext, that instructions decoded for this program
+# refer to (see system.core.CPUContext). Semantics and formatters get/set the
+# states of instruction i with getstate/setstate (instructions decoded without
+# program context use internals):
+_ctxattr = {'isetstate':'iset', 'itstate':'itstate', 'endianstate':'endian'}
+
+def getstate(i,k):
+    ctx = getattr(i,'decoding',None)
+    if ctx is None: return internals[k]
+    v = getattr(ctx,_ctxattr[k])
+    if k=='endianstate': v = 0 if v==1 else 1
+    return v
+
+def setstate(i,k,v):
+    ctx = getattr(i,'decoding',None)
+    if ctx is None:
+        internals[k] = v
+        return
+    if k=='endianstate': v = 1 if v==0 else -1
+    setattr(ctx,_ctxattr[k],v)
+
 # SIMD and VFP (floating point) extensions:
 # NOT IMPLEMENTED
 
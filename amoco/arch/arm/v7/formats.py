@@ -42,7 +42,7 @@ def deref(i,pos=-2):
 def label(i,pos=0):
     _pc = i.address
     if _pc is None: _pc=pc
-    pcoffset = 4 if internals['isetstate']==0 else 2
+    pcoffset = 4 if getstate(i,'isetstate')==0 else 2
     _pc = _pc + 2*pcoffset
     offset = i.operands[pos]
     return '*'+str(_pc+offset)
@@ -28,8 +28,8 @@ ISPECS = []
 @ispec("16[ 010000 0111 Rm(3) Rdn(3) ]", mnemonic="ROR")
 @ispec("16[ 010000 1100 Rm(3) Rdn(3) ]", mnemonic="ORR")
 @ispec("16[ 010000 1110 Rm(3) Rdn(3) ]", mnemonic="BIC")
-def A_default(obj,Rm,Rdn):
-  obj.setflags = ~InITBlock(env.internals['itstate'])
+def A_default(obj,Rm,Rdn,ctx):
+  obj.setflags = ~InITBlock(ctx.itstate)
   obj.n = env.regs[Rdn]
   obj.d = obj.n
   obj.m = env.regs[Rm]
@@ -39,8 +39,8 @@ def A_default(obj,Rm,Rdn):
 
 @ispec("16[ 000 11 1 0 imm3(3) Rn(3) Rd(3) ]", mnemonic="ADD")
 @ispec("16[ 000 11 1 1 imm3(3) Rn(3) Rd(3) ]", mnemonic="SUB")
-def A_default(obj,imm3,Rn,Rd):
-  obj.setflags = ~InITBlock(env.internals['itstate'])
+def A_default(obj,imm3,Rn,Rd,ctx):
+  obj.setflags = ~InITBlock(ctx.itstate)
   obj.n = env.regs[Rn]
   obj.d = env.regs[Rd]
   obj.imm32 = env.cst(imm3,32)
@@ -50,8 +50,8 @@ def A_default(obj,imm3,Rn,Rd):
 
 @ispec("16[ 001 10 Rdn(3) imm8(8) ]", mnemonic="ADD")
 @ispec("16[ 001 11 Rdn(3) imm8(8) ]", mnemonic="SUB")
-def A_default(obj,Rdn,imm8):
-  obj.setflags = ~InITBlock(env.internals['itstate'])
+def A_default(obj,Rdn,imm8,ctx):
+  obj.setflags = ~InITBlock(ctx.itstate)
   obj.n = env.regs[Rdn]
   obj.d = obj.n
   obj.imm32 = env.cst(imm8,32)
@@ -61,8 +61,8 @@ def A_default(obj,Rdn,imm8):
 
 @ispec("16[ 000 11 0 0 Rm(3) Rn(3) Rd(3) ]", mnemonic="ADD")
 @ispec("16[ 000 11 0 1 Rm(3) Rn(3) Rd(3) ]", mnemonic="SUB")
-def A_default(obj,Rm,Rn,Rd):
-  obj.setflags = ~InITBlock(env.internals['itstate'])
+def A_default(obj,Rm,Rn,Rd,ctx):
+  obj.setflags = ~InITBlock(ctx.itstate)
   obj.n = env.regs[Rn]
   obj.d = env.regs[Rd]
   obj.m = env.regs[Rm]
@@ -128,8 +128,8 @@ def A_adr(obj,Rd,imm8):
 @ispec("16[ 000 10 imm5(5) Rm(3) Rd(3) ]", mnemonic="ASR")
 @ispec("16[ 000 00 imm5(5) Rm(3) Rd(3) ]", mnemonic="LSL")
 @ispec("16[ 000 01 imm5(5) Rm(3) Rd(3) ]", mnemonic="LSR")
-def A_default(obj,imm5,Rm,Rd):
-  obj.setflags = ~InITBlock(env.internals['itstate'])
+def A_default(obj,imm5,Rm,Rd,ctx):
+  obj.setflags = ~InITBlock(ctx.itstate)
   obj.d = env.regs[Rd]
   obj.m = env.regs[Rm]
   obj.imm5 = env.cst(imm5,5)
@@ -289,8 +289,8 @@ def A_deref(obj,Rm,Rn,Rt):
   obj.cond = env.CONDITION_AL
 
 @ispec("16[ 001 00 Rd(3) imm8(8) ]", mnemonic="MOV")
-def A_default(obj,Rd,imm8):
-  obj.setflags = ~InITBlock(env.internals['itstate'])
+def A_default(obj,Rd,imm8,ctx):
+  obj.setflags = ~InITBlock(ctx.itstate)
   obj.d = env.regs[Rd]
   obj.imm32 = env.cst(imm8,32)
   obj.operands = [obj.d, obj.imm32]
@@ -323,8 +323,8 @@ def A_default(obj,Rm,Rd):
   obj.cond = env.CONDITION_AL
 
 @ispec("16[ 010000 1101 Rn(3)  Rdm(3) ]", mnemonic="MUL")
-def A_default(obj,Rn,Rdm):
-  obj.setflags = ~InITBlock(env.internals['itstate'])
+def A_default(obj,Rn,Rdm,ctx):
+  obj.setflags = ~InITBlock(ctx.itstate)
   obj.d = env.regs[Rdm]
   obj.n = env.regs[Rn]
   obj.m = obj.d
@@ -333,8 +333,8 @@ def A_default(obj,Rn,Rdm):
   obj.cond = env.CONDITION_AL
 
 @ispec("16[ 010000 1111 Rm(3) Rd(3) ]", mnemonic="MVN")
-def A_default(obj,Rm,Rd):
-  obj.setflags = ~InITBlock(env.internals['itstate'])
+def A_default(obj,Rm,Rd,ctx):
+  obj.setflags = ~InITBlock(ctx.itstate)
   obj.d = env.regs[Rd]
   obj.m = env.regs[Rm]
   obj.operands = [obj.d, obj.m]
@@ -365,8 +365,8 @@ def A_reglist(obj,M,register_list):
   obj.cond = env.CONDITION_AL
 
 @ispec("16[ 010000 1001 Rn(3) Rd(3) ]", mnemonic="RSB")
-def A_default(obj,Rn,Rd):
-  obj.setflags = ~InITBlock(env.internals['itstate'])
+def A_default(obj,Rn,Rd,ctx):
+  obj.setflags = ~InITBlock(ctx.itstate)
   obj.d = env.regs[Rd]
   obj.n = env.regs[Rn]
   obj.imm32 = env.cst(0,32)
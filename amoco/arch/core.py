@@ -31,17 +31,110 @@ type_system            : "system",
 type_other             : "other",
 }
 
+# misc container of an instruction that has no misc infos: an empty (transient)
+# proxy that returns None for any key and that replaces itself in the
+# instruction by a new defaultdict on first write (copy on write). Once the
+# defaultdict is allocated, the proxy (if kept by the caller) refers to it.
+class _nomisc(object):
+    __slots__ = ['obj']
+
+    _empty = {}
+
+    def __init__(self,obj):
+        self.obj = obj
+
+    def _get(self):
+        m = self.obj._misc
+        return self._empty if m is None else m
+
+    def __getitem__(self,k):
+        return self._get().get(k)
+
+    def get(self,k,default=None):
+        return self._get().get(k,default)
+
+    def __contains__(self,k):
+        return k in self._get()
+
+    def __len__(self):
+        return len(self._get())
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def keys(self):
+        return self._get().keys()
+
+    def items(self):
+        return self._get().items()
+
+    def iteritems(self):
+        return self._get().iteritems()
+
+    # the defaultdict is allocated by the first write only:
+    def _copy(self):
+        m = self.obj._misc
+        if m is None:
+            m = self.obj._misc = defaultdict(lambda: None)
+        return m
+
+    def __setitem__(self,k,v):
+        self._copy()[k] = v
+
+    def update(self,*args,**kargs):
+        self._copy().update(*args,**kargs)
+
+    def setdefault(self,k,v=None):
+        return self._copy().setdefault(k,v)
+
 class icore(object):
+    # common attributes are slots, other attributes defined by spec hooks
+    # (cond, setflags, etc) go into the (lazily allocated) __dict__.
+    __slots__ = ['bytes','type','spec','_mnemonic','operands','_misc','__dict__']
 
     def __init__(self,istr=''):
         self.bytes    = istr
         self.type     = type_undefined
         self.spec     = None
-        self.mnemonic = None
+        self._mnemonic = None
         self.operands = []
-        # we add a misc defaultdict container.
+        # we add a misc defaultdict container (allocated on first write).
         # see x86 specs for example of misc usage.
-        self.misc = defaultdict(lambda: None)
+        self._misc = None
+
+    @property
+    def misc(self):
+        return self._misc if self._misc is not None else _nomisc(self)
+    @misc.setter
+    def misc(self,m):
+        self._misc = m
+
+    # mnemonic strings are interned so that all instructions share them:
+    @property
+    def mnemonic(self):
+        return self._mnemonic
+    @mnemonic.setter
+    def mnemonic(self,m):
+        self._mnemonic = intern(m) if isinstance(m,str) else m
+    @mnemonic.deleter
+    def mnemonic(self):
+        self._mnemonic = None
+
+    # cheap copy: slots and __dict__ attributes are copied, operands list
+    # and misc are new containers but operands expressions are shared.
+    def __copy__(self):
+        cls = self.__class__
+        i = cls.__new__(cls)
+        for c in cls.__mro__:
+            for a in c.__dict__.get('__slots__',()):
+                if a=='__dict__' or not hasattr(self,a): continue
+                setattr(i,a,getattr(self,a))
+        i.operands = list(self.operands)
+        if self._misc is not None:
+            i._misc = self._misc.copy()
+        if self.__dict__:
+            i.__dict__.update(self.__dict__)
+        return i
 
     @classmethod
     def set_uarch(cls,uarch):
@@ -72,6 +165,7 @@ class icore(object):
 # -----------------
 
 class instruction(icore):
+    __slots__ = ['address']
 
     def __init__(self,istr):
         icore.__init__(self,istr)
@@ -82,7 +176,7 @@ class instruction(icore):
         if self.address is not None: s += ' [%s] '%str(self.address)
         s += " %s ( "%self.mnemonic
         for k,v in inspect.getmembers(self):
-            if k in ('address','mnemonic','bytes','spec','operands','misc','formatter'): continue
+            if k in ('address','mnemonic','bytes','spec','operands','misc','formatter','decoding'): continue
             if k.startswith('_') or inspect.ismethod(v): continue
             s += '%s=%s '%(k,str(v))
         return '<%s)>'%s
@@ -108,6 +202,29 @@ class InstructionError(Exception):
 
 class DecodeError(Exception): pass
 
+# decoding context class
+# ----------------------
+# A DecodeContext holds every state needed by the disassembler while decoding
+# a single instruction: the instruction set selector (iset), the fetch endianess,
+# the (ARM) itstate and the pending prefix instruction (pfx) for archs like x86.
+# A new context is created for each call to the disassembler unless one is
+# provided with the ctx keyword argument, so that a single disassembler object
+# can be shared by several threads or interleaved analyses of distinct programs.
+class DecodeContext(object):
+    __slots__ = ['iset','endian','itstate','pfx']
+
+    def __init__(self,iset=0,endian=1,itstate=0):
+        self.iset    = iset
+        self.endian  = endian
+        self.itstate = itstate
+        self.pfx     = None
+
+    def copy(self):
+        return DecodeContext(self.iset,self.endian,self.itstate)
+
+    def __repr__(self):
+        return '<DecodeContext iset=%d endian=%d itstate=%d>'%(self.iset,self.endian,self.itstate)
+
 # disassembler core  class
 # ------------------------
 class disassembler(object):
@@ -115,15 +232,22 @@ class disassembler(object):
     # specmodules: list of python modules containing ispec decorated funcs
     # iset: lambda used to select module (ispec list)
     # endian: instruction fetch endianess (1: little, -1: big)
-    def __init__(self,specmodules,iset=(lambda *args,**kargs:0),endian=(lambda *args, **kargs:1)):
+    # itstate: lambda that provides the default itstate (ARM thumb IT blocks)
+    # These lambdas are only used to build the default DecodeContext of a call.
+    # iclass: the instruction class (bound to a uarch/formatter) of decoded objects.
+    def __init__(self,specmodules,iset=(lambda *args,**kargs:0),endian=(lambda *args, **kargs:1),
+                                  itstate=(lambda *args,**kargs:0),iclass=None):
         self.maxlen = max((s.mask.size/8 for s in sum((m.ISPECS for m in specmodules),[])))
         self.iset = iset
         self.endian = endian
+        self.itstate = itstate
+        self.iclass = iclass or instruction
         # build ispecs tree for each set:
         self.specs = [self.setup(m.ISPECS) for m in specmodules]
-        # some arch like x86 require a stateful decoding due to optional prefixes,
-        # so we keep an __i instruction for decoding until a non prefix ispec is used.
-        self.__i  = None
+        # keep the set index of every ispec:
+        self.isets = dict(((s,n) for n,m in enumerate(specmodules) for s in m.ISPECS))
+        # all ispecs in a stable order (definition order of sorted specs lists):
+        self.ispecs = sum((m.ISPECS for m in specmodules),[])
 
     # setup will (recursively) organize the provided ispecs list into an optimal tree so that
     # __call__ can efficiently find the matching ispec format for a given bytestring
@@ -149,33 +273,50 @@ class disassembler(object):
             l[x] = self.setup(S)
         return (f,l)
 
+    # returns the default decoding context for a call with given kargs:
+    def context(self,**kargs):
+        return DecodeContext(self.iset(**kargs),self.endian(**kargs),self.itstate(**kargs))
+
     def __call__(self,bytestring,**kargs):
-        e = self.endian(**kargs)
+        ctx = kargs.pop('ctx',None)
+        iclass = kargs.pop('iclass',self.iclass)
+        if ctx is None:
+            ctx = self.context(**kargs)
+        else:
+            # the provided context is never modified:
+            ctx = ctx.copy()
+        i = self.decode(bytestring,ctx,iclass)
+        if i is not None and 'address' in kargs:
+            i.address = kargs['address']
+        return i
+
+    # decode the bytestring according to the given context. Prefix ispecs
+    # are stacked into ctx.pfx until a non prefix ispec is found.
+    def decode(self,bytestring,ctx,iclass=None):
+        e = ctx.endian
         b = Bits(bytestring[::e],bitorder=1)
         # get organized/optimized tree of specs:
-        fl = self.specs[self.iset(**kargs)]
+        fl = self.specs[ctx.iset]
         while True:
             f,l = fl
             if f==0: # we are on a leaf...
                 for s in l: # lets search linearly over this branch
                     try:
-                        i = s.decode(bytestring,e,i=self.__i,ival=b.ival)
+                        i = s.decode(bytestring,e,i=ctx.pfx,ival=b.ival,ctx=ctx,iclass=iclass)
                     except (DecodeError,InstructionError):
                         logger.debug('exception raised by disassembler:'
                                      'decoding %s with spec %s'%(bytestring.encode('hex'),s.format))
                         continue
                     if i.spec.pfx is True:
-                        if self.__i is None: self.__i = i
-                        return self(bytestring[s.mask.size/8:],**kargs)
-                    self.__i = None
-                    if 'address' in kargs:
-                        i.address = kargs['address']
+                        if ctx.pfx is None: ctx.pfx = i
+                        return self.decode(bytestring[s.mask.size/8:],ctx,iclass)
+                    ctx.pfx = None
                     return i
                 break
             else: # go deeper in the tree according to submask value of b
                 fl = l.get(b.ival & f, None)
                 if fl is None: break
-        self.__i = None
+        ctx.pfx = None
         return None
 
 # ispec (parametrable) decorator
@@ -254,6 +395,8 @@ class disassembler(object):
 # are declared as attributes/values within the instruction instance *before* calling the
 # decorated function. In the previous example, the instruction has attribute mnemonic
 # with value 'BL' when the function is called.
+# If the decorated function has a 'ctx' argument, it receives the DecodeContext object
+# of the current disassembler call (see spec_thumb for example of ctx.itstate usage).
 # -----------------------------------------
 class ispec(object):
     __slots__ = ['format','iattr','fargs','ast','fix','mask','pfx','size','hook']
@@ -360,7 +503,7 @@ class ispec(object):
         return ast
 
     # decode always receive input bytes in ascending memory order
-    def decode(self,istr,endian=1,i=None,ival=None):
+    def decode(self,istr,endian=1,i=None,ival=None,ctx=None,iclass=None):
         # check spec :
         blen = self.fix.size/8
         if len(istr)<blen: raise DecodeError
@@ -374,8 +517,10 @@ class ispec(object):
             b = b//Bits(istr[blen:],bitorder=1)
         # create & update instruction object:
         if i is None:
-            i = instruction(bs)
+            i = (iclass or instruction)(bs)
+            n = 0
         else:
+            n = len(i.bytes)
             i.bytes += bs
         i.spec = self
         # set instruction attributes from directives, and then
@@ -388,12 +533,13 @@ class ispec(object):
         for k,v in self.fargs.iteritems():
             if type(v)==type(lambda:1): v=v(b)
             kargs[k] = v
+        if 'ctx' in kargs: kargs['ctx'] = ctx or DecodeContext(endian=endian)
         # and call hooks:
         try:
             self.hook(obj=i,**kargs)
         except InstructionError:
-            # clean up:
-            i.bytes = i.bytes[:-len(bs)]
+            # clean up (hooks may have added bytes as well):
+            i.bytes = i.bytes[:n]
             for k in self.iattr.iterkeys(): delattr(i,k)
             raise InstructionError(i)
         return i
@@ -406,6 +552,9 @@ class ispec(object):
         m = inspect.getmodule(handler)
         ispec_register(self,m)
         varnames = handler.func_code.co_varnames
+        # hooks that declare a ctx argument receive the current DecodeContext:
+        if 'ctx' in varnames[:handler.func_code.co_argcount]:
+            self.fargs['ctx'] = None
         for k in self.fargs.iterkeys():
             if k not in varnames:
                 logger.error('ispec symbol not found in decorated function %s'%handler.func_name)
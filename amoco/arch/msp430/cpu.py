@@ -7,13 +7,16 @@ uarch = dict(filter(lambda kv:kv[0].startswith('i_'),locals().iteritems()))
 #import specifications:
 from amoco.arch.core import instruction, disassembler
 
-instruction.set_uarch(uarch)
+# bind uarch and formatter to a dedicated instruction class so that importing
+# other cpu modules does not change the semantics of existing instructions:
+instruction_msp430 = type('instruction_msp430',(instruction,),{'__slots__':()})
+instruction_msp430.set_uarch(uarch)
 
 from amoco.arch.msp430.formats import MSP430_synthetic
-instruction.set_formatter(MSP430_synthetic)
+instruction_msp430.set_formatter(MSP430_synthetic)
 
 #define disassembler:
 from amoco.arch.msp430 import spec_msp430
 
-disassemble = disassembler([spec_msp430])
+disassemble = disassembler([spec_msp430],iclass=instruction_msp430)
 disassemble.maxlen = 6
@@ -7,12 +7,15 @@ uarch = dict(filter(lambda kv:kv[0].startswith('i_'),locals().iteritems()))
 #import specifications:
 from amoco.arch.core import instruction, disassembler
 
-instruction.set_uarch(uarch)
+# bind uarch and formatter to a dedicated instruction class so that importing
+# other cpu modules does not change the semantics of existing instructions:
+instruction_pic18 = type('instruction_pic18',(instruction,),{'__slots__':()})
+instruction_pic18.set_uarch(uarch)
 
 from amoco.arch.pic.F46K22.formats import PIC_full
-instruction.set_formatter(PIC_full)
+instruction_pic18.set_formatter(PIC_full)
 
 #define disassembler:
 from amoco.arch.pic.F46K22 import spec_pic18
 
-disassemble = disassembler([spec_pic18])
+disassemble = disassembler([spec_pic18],iclass=instruction_pic18)
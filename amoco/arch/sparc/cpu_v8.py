@@ -7,13 +7,16 @@ uarch = dict(filter(lambda kv:kv[0].startswith('i_'),locals().iteritems()))
 #import specifications:
 from amoco.arch.core import instruction, disassembler
 
-instruction.set_uarch(uarch)
+# bind uarch and formatter to a dedicated instruction class so that importing
+# other cpu modules does not change the semantics of existing instructions:
+instruction_sparc = type('instruction_sparc',(instruction,),{'__slots__':()})
+instruction_sparc.set_uarch(uarch)
 
 from amoco.arch.sparc.formats import SPARC_V8_full
 from amoco.arch.sparc.formats import SPARC_V8_synthetic
-instruction.set_formatter(SPARC_V8_synthetic)
+instruction_sparc.set_formatter(SPARC_V8_synthetic)
 
 #define disassembler:
 from amoco.arch.sparc import spec_v8
 
-disassemble = disassembler([spec_v8],endian=lambda:-1)
+disassemble = disassembler([spec_v8],endian=lambda **kargs:-1,iclass=instruction_sparc)
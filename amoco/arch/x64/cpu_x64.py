@@ -6,11 +6,18 @@ uarch = dict(filter(lambda kv:kv[0].startswith('i_'),locals().iteritems()))
 
 from amoco.arch.core import instruction, disassembler
 
-instruction.set_uarch(uarch)
+# bind uarch and formatter to a dedicated instruction class so that importing
+# other cpu modules does not change the semantics of existing instructions:
+instruction_x64 = type('instruction_x64',(instruction,),{'__slots__':()})
+instruction_x64.set_uarch(uarch)
 from amoco.arch.x64.formats import IA32e_Intel
-instruction.set_formatter(IA32e_Intel)
+instruction_x64.set_formatter(IA32e_Intel)
 
 from amoco.arch.x64 import spec_ia32e
 
-disassemble = disassembler([spec_ia32e])
+disassemble = disassembler([spec_ia32e],iclass=instruction_x64)
 disassemble.maxlen = 15
+
+# fast length-only decoder (sweeps, instruction boundaries discovery):
+from amoco.arch.x86.lengths import LengthDecoder
+lengths = LengthDecoder(disassemble,x64=True)
@@ -6,11 +6,18 @@ uarch = dict(filter(lambda kv:kv[0].startswith('i_'),locals().iteritems()))
 
 from amoco.arch.core import instruction, disassembler
 
-instruction.set_uarch(uarch)
+# bind uarch and formatter to a dedicated instruction class so that importing
+# other cpu modules does not change the semantics of existing instructions:
+instruction_x86 = type('instruction_x86',(instruction,),{'__slots__':()})
+instruction_x86.set_uarch(uarch)
 from amoco.arch.x86.formats import IA32_Intel
-instruction.set_formatter(IA32_Intel)
+instruction_x86.set_formatter(IA32_Intel)
 
 from amoco.arch.x86 import spec_ia32
 
-disassemble = disassembler([spec_ia32])
+disassemble = disassembler([spec_ia32],iclass=instruction_x86)
 disassemble.maxlen = 15
+
+# fast length-only decoder (sweeps, instruction boundaries discovery):
+from amoco.arch.x86.lengths import LengthDecoder
+lengths = LengthDecoder(disassemble)
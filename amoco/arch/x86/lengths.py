@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+# This code is part of Amoco
+# Copyright (C) 2014 Axel Tillequin (bdcht3@gmail.com)
+# published under GPLv2 license
+
+# LengthDecoder provides a fast "length and class only" decoder for ia32/ia32e
+# instructions. It is used by sweeps and instruction boundary discovery where
+# building full instruction objects (getModRM operands, registers, memory
+# expressions) is a waste of time.
+#
+# The decoder is table-driven: prefixes, opcode bytes and ModR/M+SIB+disp
+# lengths are parsed directly, while everything that depends on the spec
+# (presence of a ModR/M byte, immediate size, validity, type, mnemonic and
+# relative branch displacement) is derived from the existing spec_ia32 /
+# spec_ia32e ispecs by probing the full disassembler once per
+# (prefix state, opcode, ModR/M class) and memoizing the result in the tables.
+# Hence lengths always agree with the full disassembler.
+
+from amoco.logger import Log
+logger = Log(__name__)
+
+from amoco.arch.core import type_control_flow
+
+# legacy prefixes groups (as in spec_ia32 setpfx):
+_PFX = {0xf0:0, 0xf2:0, 0xf3:0,
+        0x26:1, 0x2e:1, 0x36:1, 0x3e:1, 0x64:1, 0x65:1,
+        0x66:2,
+        0x67:3}
+
+# group 1 prefixes bits (set of group 1 prefixes in the decoding mode):
+_G1 = {0xf0:1, 0xf2:2, 0xf3:4}
+
+#------------------------------------------------------------------------------
+class LengthDecoder(object):
+    __slots__ = ['disassemble','x64','maxlen','modrm','escapes','ops']
+
+    # disassemble: the full disassembler of cpu_x86 or cpu_x64,
+    # x64: True for the ia32e (REX prefixes, 64 bits addressing) decoder.
+    def __init__(self,disassemble,x64=False):
+        self.disassemble = disassemble
+        self.x64 = x64
+        self.maxlen = disassemble.maxlen
+        self.modrm = self.getmodrm()
+        self.escapes = self.getescapes()
+        # tables: (mode,opcode) -> [hasmodrm, {key: entry}]
+        self.ops = {}
+
+    def __call__(self,bytestring):
+        return self.decode(bytestring,0)
+
+    # decode the instruction located at offset off of the buffer and return
+    # a tuple (length, type, mnemonic, disp) where disp is the signed
+    # displacement of relative branches (None otherwise), or None if bytes
+    # at offset do not decode as a valid instruction.
+    def decode(self,buf,off=0):
+        n = min(len(buf),off+self.maxlen)
+        k = off
+        pfx = False
+        g1 = opd = adr = False
+        g1s = 0
+        rex = None
+        # prefixes:
+        while k<n:
+            c = ord(buf[k])
+            g = _PFX.get(c,None)
+            if g is not None:
+                # legacy prefixes are not allowed after REX:
+                if rex is not None: return None
+                pfx = True
+                if   g==0:
+                    g1 = c
+                    g1s |= _G1[c]
+                elif g==2: opd = True
+                elif g==3: adr = True
+            elif self.x64 and (c&0xf0)==0x40:
+                if rex is not None: return None
+                rex = c
+            else:
+                break
+            k += 1
+        rexw = None if rex is None else (rex&8)==8
+        # opcode bytes:
+        o = k
+        if k>=n: return None
+        if buf[k:k+2] in self.escapes:
+            k += 1
+        elif buf[k]=='\x0f':
+            k += 1
+            if k<n and buf[k] in ('\x38','\x3a'): k += 1
+        k += 1
+        if k>n: return None
+        op = buf[o:k]
+        mode = (pfx,g1,g1s,opd,adr,rexw)
+        t = self.ops.get((mode,op),None)
+        if t is None:
+            t = self.ops[(mode,op)] = [self.hasmodrm(mode,op),{}]
+        # ModR/M, SIB and displacement:
+        if t[0]:
+            if k>=n: return None
+            m = ord(buf[k])
+            k += 1
+            km = k
+            mod = m>>6
+            if mod==3 or t[0]==2:
+                key = m
+            else:
+                key = m&0xf8
+                rm  = m&7
+                if adr and not self.x64:
+                    if mod==0: k += 2 if rm==6 else 0
+                    else: k += mod
+                else:
+                    # (as in x64 getModRM, the [disp32] forms only exist
+                    # with 64 bits addressing.)
+                    d32 = (mod==0) and not (adr and self.x64)
+                    if rm==4:
+                        if k>=n: return None
+                        if d32 and (ord(buf[k])&7)==5: k += 4
+                        k += 1
+                    elif d32 and rm==5: k += 4
+                    if   mod==1: k += 1
+                    elif mod==2: k += 4
+        else:
+            key = None
+            km = k
+        e = t[1].get(key,False)
+        if e is False:
+            e = t[1][key] = self.entry(mode,op,t[0],key)
+        if e is None: return None
+        immsz,itype,mnemo,rel = e
+        # the instruction may end before the ModR/M byte (ie. 9b without
+        # a matching {9b}{d9} /7 spec is a WAIT):
+        if immsz<0: k = km
+        k += immsz
+        if k>n: return None
+        disp = None
+        if rel:
+            disp = 0
+            for c in reversed(buf[k-immsz:k]): disp = (disp<<8)|ord(c)
+            if disp>>(immsz*8-1): disp -= 1<<(immsz*8)
+        return (k-off,itype,mnemo,disp)
+
+    # linear sweep of the buffer: yields (offset,entry) for every decoded
+    # instruction from offset off until end or an invalid instruction.
+    def sweep(self,buf,off=0,end=None):
+        if end is None: end = len(buf)
+        while off<end:
+            e = self.decode(buf,off)
+            if e is None: break
+            yield (off,e)
+            off += e[0]
+
+    # tables derivation from the full disassembler:
+    #--------------------------------------------------------------------------
+
+    # opcodes formats of ispecs with a ModR/M byte, as a list of
+    # (fix,mask) bytes that precede the ModR/M byte:
+    def getmodrm(self):
+        M = []
+        for s in self.disassemble.isets:
+            if s.pfx is True or 'Mod(2)' not in s.format: continue
+            # ModR/M is the last byte before the ~data(*) directive:
+            nb = s.mask.size/8-1
+            M.append(tuple((s.fix[8*j:8*j+8].int(),s.mask[8*j:8*j+8].int())
+                           for j in range(nb)))
+        return M
+
+    # opcodes with more than one byte before their ModR/M (besides the 0f
+    # escapes) like {9b}{d9} /7:
+    def getescapes(self):
+        E = set()
+        for fm in self.modrm:
+            if len(fm)==2 and fm[0][0]!=0x0f and fm[0][1]==fm[1][1]==0xff:
+                E.add(chr(fm[0][0])+chr(fm[1][0]))
+        return E
+
+    # prefix bytes that put the full disassembler in the given mode:
+    def prefix(self,mode):
+        pfx,g1,g1s,opd,adr,rexw = mode
+        s = ''
+        # every group 1 prefix seen sets its misc flag (rep, lock...) while
+        # the last one is misc['pfx'][0]:
+        for c in (0xf0,0xf2,0xf3):
+            if g1s&_G1[c] and c!=g1: s += chr(c)
+        if g1 : s += chr(g1)
+        if opd: s += '\x66'
+        if adr: s += '\x67'
+        if pfx and not s: s = '\x3e'
+        if rexw is not None: s += '\x48' if rexw else '\x40'
+        return s
+
+    def probe(self,bytestring):
+        try:
+            i = self.disassemble(bytestring+'\0'*self.maxlen)
+        except Exception:
+            i = None
+        return i
+
+    # returns 0 if opcode has no ModR/M byte, 1 if it has a ModR/M byte, and
+    # 2 if it has a ModR/M byte that only encodes registers (the Mod field is
+    # ignored, as in MOV to/from control registers.) The presence of a ModR/M
+    # byte is given by the ispecs formats, and we detect register-only forms
+    # by checking that a disp8 (mod=01) does not increase the length.
+    def hasmodrm(self,mode,op):
+        O = [ord(c) for c in op]
+        for fm in self.modrm:
+            if len(fm)!=len(O): continue
+            if all(((o&m)==f for o,(f,m) in zip(O,fm))): break
+        else:
+            return 0
+        p = self.prefix(mode)+op
+        for m0 in (0x00,0xc0):
+            for r in range(8):
+                i0 = self.probe(p+chr(m0|r<<3))
+                i1 = self.probe(p+chr(0x40|r<<3))
+                if i0 is not None and i1 is not None:
+                    if i0.length<=len(p): break
+                    return 1 if (i1.length-i0.length)==1 else 2
+        return 1
+
+    # table entry (immsz, type, mnemonic, rel) for the given ModR/M key
+    # (the ModR/M byte for register forms, the Mod and REG fields for memory
+    # forms) or None if the encoding is invalid:
+    def entry(self,mode,op,hasmodrm,key):
+        pfx = self.prefix(mode)
+        p = pfx+op
+        if hasmodrm:
+            p += chr(key)
+        i = self.probe(p)
+        if i is None: return None
+        immsz = i.length-len(p)
+        # remove the displacement of the probed memory form ([r/m+disp]):
+        if hasmodrm==1 and key<0xc0 and immsz>=0:
+            mod = key>>6
+            if mod==2 and mode[4] and not self.x64: mod = 4
+            immsz -= (0,1,4,0,2)[mod]
+        if i.length<=len(pfx): return None
+        rel = (i.type==type_control_flow and len(i.operands)>0 and
+               i.operands[0]._is_cst and not i.misc['absolute'] and immsz>0)
+        return (immsz,i.type,i.mnemonic,rel)
+
+    def __len__(self):
+        return sum((len(t[1]) for t in self.ops.itervalues()))
+
+    def __repr__(self):
+        return '<LengthDecoder %s (%d entries)>'%('x64' if self.x64 else 'x86',len(self))
@@ -7,12 +7,15 @@ uarch = dict(filter(lambda kv:kv[0].startswith('i_'),locals().iteritems()))
 #import specifications:
 from amoco.arch.core import instruction, disassembler
 
-instruction.set_uarch(uarch)
+# bind uarch and formatter to a dedicated instruction class so that importing
+# other cpu modules does not change the semantics of existing instructions:
+instruction_gb = type('instruction_gb',(instruction,),{'__slots__':()})
+instruction_gb.set_uarch(uarch)
 
 from amoco.arch.z80.formats import GB_full
-instruction.set_formatter(GB_full)
+instruction_gb.set_formatter(GB_full)
 
 #define disassembler:
 from amoco.arch.z80 import spec_gb
 
-disassemble = disassembler([spec_gb])
+disassemble = disassembler([spec_gb],iclass=instruction_gb)
@@ -7,12 +7,15 @@ uarch = dict(filter(lambda kv:kv[0].startswith('i_'),locals().iteritems()))
 #import specifications:
 from amoco.arch.core import instruction, disassembler
 
-instruction.set_uarch(uarch)
+# bind uarch and formatter to a dedicated instruction class so that importing
+# other cpu modules does not change the semantics of existing instructions:
+instruction_z80 = type('instruction_z80',(instruction,),{'__slots__':()})
+instruction_z80.set_uarch(uarch)
 
 from amoco.arch.z80.formats import Mostek_full
-instruction.set_formatter(Mostek_full)
+instruction_z80.set_formatter(Mostek_full)
 
 #define disassembler:
 from amoco.arch.z80 import spec_mostek
 
-disassemble = disassembler([spec_mostek])
+disassemble = disassembler([spec_mostek],iclass=instruction_z80)
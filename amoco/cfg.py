@@ -62,11 +62,15 @@ class link(Edge):
 
 #------------------------------------------------------------------------------
 # graph is a Graph that represents a set of functions as individual components
+# Nodes are indexed by name (the block address by default) so that get_node
+# is O(1), and blocks are indexed by address in the support (or overlay)
+# MemoryZone. Both indexes are updated by add_vertex, remove_vertex and cuts.
 class graph(Graph):
 
     def __init__(self,*args,**kargs):
         self.support = MemoryZone()
         self.overlay = None
+        self._index = {}
         Graph.__init__(self,*args,**kargs)
 
     def spool(self,n=None):
@@ -75,9 +79,14 @@ class graph(Graph):
             if len(v.e_out())==0: L.append(v)
         return L
 
+    def __add(self,v):
+        v = Graph.add_vertex(self,v) or v
+        self._index[v.name] = v
+        return v
+
     def __cut_add_vertex(self,v,mz,vaddr,mo):
         oldnode = mo.data.val
-        if oldnode==v: return 0
+        if oldnode==v: return oldnode
         # so v cuts an existing node/block:
         # repair oldblock and fix self
         childs = oldnode.N(+1)
@@ -88,22 +97,26 @@ class graph(Graph):
         if not cutdone:
             if mz is self.overlay:
                 logger.warning("double overlay block at %s"%vaddr)
-                Graph.add_vertex(self,v)
+                v = self.__add(v)
                 v.data.misc['double-overlay'] = 1
-                return 1
+                return v
             overlay = self.overlay or MemoryZone()
             return self.add_vertex(v,support=overlay)
         else:
-            Graph.add_vertex(self,v) # ! avoid recursion for add_edge
+            v = self.__add(v) # ! avoid recursion for add_edge
             mz.write(vaddr,v)
             self.add_edge(link(oldnode,v))
             for n in childs:
                 self.add_edge(link(v,n))
                 self.remove_edge(oldnode.e_to(n))
-        return 1
+        return v
 
+    # returns the vertex of the graph (v or the node with the same name
+    # that was already added):
     def add_vertex(self,v,support=None):
-        if len(v)==0: return Graph.add_vertex(self,v)
+        w = self._index.get(v.name,None)
+        if w is not None: return w
+        if len(v)==0: return self.__add(v)
         vaddr=v.data.address
         if support is None:
             support=self.support
@@ -128,16 +141,24 @@ class graph(Graph):
                         if not cutdone:
                             if support is self.overlay:
                                 logger.warning("double overlay block at %s"%vaddr)
-                                Graph.add_vertex(self,v)
+                                v = self.__add(v)
                                 v.data.misc['double-overlay'] = 1
-                                return 1
+                                return v
                             support = self.overlay or MemoryZone()
-        Graph.add_vertex(self,v) # before support write !!
+        v = self.__add(v) # before support write !!
         support.write(vaddr,v)
-        return 1
+        return v
+
+    def remove_vertex(self,v):
+        Graph.remove_vertex(self,v)
+        if self._index.get(v.name,None) is v: del self._index[v.name]
+        if len(v)==0: return
+        for mz in (self.support,self.overlay):
+            if mz is None: continue
+            i = mz.locate(v.data.address)
+            if i is not None and mz._map[i].data.val is v:
+                mz.remove(i)
 
     def get_node(self,name):
-        for v in self.V():
-            if v.name==name: return v
-        return None
+        return self._index.get(name,None)
 
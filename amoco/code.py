@@ -187,3 +187,252 @@ class tag:
     LOOP_END     = 'loop_end'
     LOOP_COND    = 'loop_cond'
 
+
+#------------------------------------------------------------------------------
+# InstructionTable is a compact columnar store of decoded instructions. Each
+# instruction is a row of the columns (address, length, type, mnemonic id,
+# spec id, flags, offset) stored in array objects (numpy views are provided
+# by the column method if numpy is installed) and its bytes are stored in a
+# single bytearray. Full instruction objects are materialized (decoded again)
+# only when a row is accessed. A table is filled by CoreExec.disassemble_range
+# and is used by lsweep to build blocks without materializing instructions.
+#------------------------------------------------------------------------------
+from array import array
+from bisect import bisect_left
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from amoco.arch.core import DecodeContext, type_control_flow
+
+# flags column bits:
+ITABLE_DELAYED = 0x1   # branch with delay slot (see sparc)
+ITABLE_PREFIX  = 0x2   # prefixed instruction (see x86)
+ITABLE_ISET    = 8     # shift for the iset (decoder ispecs set index)
+
+class InstructionTable(object):
+    __slots__ = ['cpu','address','length','type','mnemo','spec','flags',
+                 'offset','code','mnemonics','specs','asize','_mids','_sids',
+                 '_views']
+
+    _columns = {'address':'L','length':'B','type':'b','mnemo':'H',
+                'spec':'I','flags':'I','offset':'L'}
+
+    def __init__(self,cpu):
+        self.cpu = cpu
+        for c,t in self._columns.iteritems():
+            setattr(self,c,array(t))
+        self.code = bytearray()
+        self.mnemonics = []
+        self.specs = []
+        self.asize = None
+        # indices of mnemonics and specs in their lists:
+        self._mids = {}
+        self._sids = {}
+        self._views = {}
+
+    def __len__(self):
+        return len(self.address)
+
+    # returns the index of x in list L (x is appended if needed), D is the
+    # index dict of L:
+    def _intern(self,L,D,x):
+        try:
+            return D[x]
+        except KeyError:
+            L.append(x)
+            return D.setdefault(x,len(L)-1)
+
+    def append(self,i):
+        a = i.address
+        if self.asize is None and hasattr(a,'size'): self.asize = a.size
+        if self._views: self._views = {}
+        flags = 0
+        if i.misc['delayed']: flags |= ITABLE_DELAYED
+        if i.misc['pfx'] is not None: flags |= ITABLE_PREFIX
+        if i.spec is not None:
+            flags |= self.cpu.disassemble.isets.get(i.spec,0)<<ITABLE_ISET
+        self.address.append(int(a))
+        self.length.append(i.length)
+        self.type.append(i.type)
+        self.mnemo.append(self._intern(self.mnemonics,self._mids,i.mnemonic))
+        self.spec.append(self._intern(self.specs,self._sids,i.spec))
+        self.flags.append(flags)
+        self.offset.append(len(self.code))
+        self.code.extend(i.bytes)
+
+    def extend(self,I):
+        for i in I: self.append(i)
+
+    # returns the column as a read-only numpy array if numpy is available.
+    # The array is a snapshot of the column that is computed once and shared
+    # by all calls until the table is modified (a view of the array.array
+    # would point to freed memory once the table grows or is truncated).
+    # Use copy=True to get a new writable array (or if numpy is not available,
+    # a copy of the array.array column):
+    def column(self,name,copy=False):
+        c = getattr(self,name)
+        if numpy is None: return array(c.typecode,c)
+        if copy: return numpy.frombuffer(c,dtype=c.typecode).copy()
+        v = self._views.get(name)
+        if v is None:
+            v = numpy.frombuffer(c,dtype=c.typecode).copy()
+            v.flags.writeable = False
+            self._views[name] = v
+        return v
+
+    # returns the row index of the instruction at address vaddr (or None):
+    def locate(self,vaddr):
+        try:
+            vaddr = int(vaddr)
+        except (TypeError,AttributeError):
+            return None
+        k = bisect_left(self.address,vaddr)
+        if k<len(self) and self.address[k]==vaddr: return k
+        return None
+
+    def bytes(self,k):
+        o = self.offset[k]
+        return str(self.code[o:o+self.length[k]])
+
+    # materialize the instruction object of row k:
+    def materialize(self,k):
+        d = self.cpu.disassemble
+        ctx = d.context()
+        ctx.iset = self.flags[k]>>ITABLE_ISET
+        i = d(self.bytes(k),ctx=ctx)
+        if i is None:
+            # some specs need more bytes than the instruction length:
+            o = self.offset[k]
+            i = d(str(self.code[o:o+d.maxlen]),ctx=ctx)
+        a = self.address[k]
+        i.address = a if self.asize is None else self.cpu.cst(a,self.asize)
+        return i
+
+    def __getitem__(self,k):
+        if isinstance(k,slice):
+            sta,sto,stp = k.indices(len(self))
+            assert stp==1
+            return InstructionView(self,sta,sto)
+        if k<0: k += len(self)
+        return self.materialize(k)
+
+    def __iter__(self):
+        for k in xrange(len(self)):
+            yield self.materialize(k)
+
+    # iterator over the row index (sta,sto) ranges of basic blocks starting
+    # at row k, using only the type, flags, address and length columns
+    # (a block also ends before a gap between two rows):
+    def iterbounds(self,k=0):
+        n = len(self)
+        T,F,A,L = self.type,self.flags,self.address,self.length
+        sta = k
+        while k<n:
+            if T[k]==type_control_flow:
+                k += 1
+                if F[k-1]&ITABLE_DELAYED and k<n: k += 1
+                yield (sta,k)
+                sta = k
+            else:
+                k += 1
+                if k<n and A[k-1]+L[k-1]!=A[k]:
+                    yield (sta,k)
+                    sta = k
+        if sta<n: yield (sta,n)
+
+    def iterblocks(self,k=0):
+        for sta,sto in self.iterbounds(k):
+            yield block(InstructionView(self,sta,sto))
+
+    # remove all rows from row k:
+    def truncate(self,k):
+        if k>=len(self): return
+        self._views = {}
+        o = self.offset[k]
+        for c in self._columns: del getattr(self,c)[k:]
+        del self.code[o:]
+
+    # append rows [sta,sto[ of table T:
+    def addrows(self,T,sta=0,sto=None):
+        if sto is None: sto = len(T)
+        if sta>=sto: return
+        self._views = {}
+        mids = [self._intern(self.mnemonics,self._mids,x) for x in T.mnemonics]
+        sids = [self._intern(self.specs,self._sids,x) for x in T.specs]
+        o = len(self.code)-T.offset[sta]
+        self.address.extend(T.address[sta:sto])
+        self.length.extend(T.length[sta:sto])
+        self.type.extend(T.type[sta:sto])
+        self.flags.extend(T.flags[sta:sto])
+        self.mnemo.extend(array('H',(mids[x] for x in T.mnemo[sta:sto])))
+        self.spec.extend(array('I',(sids[x] for x in T.spec[sta:sto])))
+        self.offset.extend(array('L',(x+o for x in T.offset[sta:sto])))
+        end = T.offset[sto] if sto<len(T) else len(T.code)
+        self.code.extend(T.code[T.offset[sta]:end])
+
+    # tables are exported as a picklable state (without the cpu) so that
+    # they can be built by worker processes (see main.lsweep.psweep):
+    def export(self):
+        L = self.cpu.disassemble.ispecs
+        ids = dict(((id(s),k) for k,s in enumerate(L)))
+        specs = [ids.get(id(s),-1) for s in self.specs]
+        cols = dict(((c,getattr(self,c)) for c in self._columns))
+        return (cols,str(self.code),list(self.mnemonics),specs,self.asize)
+
+    @classmethod
+    def fromstate(cls,cpu,state):
+        cols,bs,mnemonics,specs,asize = state
+        T = cls(cpu)
+        for c,a in cols.iteritems(): setattr(T,c,a)
+        T.code = bytearray(bs)
+        L = cpu.disassemble.ispecs
+        T.mnemonics = list(mnemonics)
+        T.specs = [(L[k] if k>=0 else None) for k in specs]
+        T._mids = dict(((x,k) for k,x in enumerate(T.mnemonics)))
+        T._sids = dict(((x,k) for k,x in enumerate(T.specs)))
+        T.asize = asize
+        return T
+
+    def nbytes(self):
+        return sum((c.itemsize*len(c) for c in (getattr(self,x) for x in self._columns)),
+                   len(self.code))
+
+    def __repr__(self):
+        return '<%s object (%d rows) at 0x%08x>'%(self.__class__.__name__,len(self),id(self))
+
+#------------------------------------------------------------------------------
+# InstructionView is a (read-only) sequence of rows of an InstructionTable
+# that can be used as the instruction list of a block. Rows are materialized
+# on first access and kept until the view is deleted.
+class InstructionView(object):
+    __slots__ = ['table','sta','sto','_instr']
+
+    def __init__(self,table,sta,sto):
+        self.table = table
+        self.sta = sta
+        self.sto = sto
+        self._instr = None
+
+    def __len__(self):
+        return self.sto-self.sta
+
+    def __getitem__(self,k):
+        if isinstance(k,slice):
+            sta,sto,stp = k.indices(len(self))
+            assert stp==1
+            v = InstructionView(self.table,self.sta+sta,self.sta+sto)
+            if self._instr is not None: v._instr = self._instr[sta:sto]
+            return v
+        if k<0: k += len(self)
+        if not 0<=k<len(self): raise IndexError(k)
+        if self._instr is None: self._instr = [None]*len(self)
+        i = self._instr[k]
+        if i is None:
+            i = self._instr[k] = self.table.materialize(self.sta+k)
+        return i
+
+    def __iter__(self):
+        for k in xrange(len(self)):
+            yield self[k]
@@ -18,6 +18,11 @@ if cp:
     conf.set('block', 'padding', '4')
     conf.add_section('log')
     conf.set('log', 'level', 'ERROR')
+    conf.add_section('linker')
+    conf.set('linker', 'sysroot', '')
+    # the library cache is not written unless a directory is set
+    # (ie. cache = ~/.amoco/libcache):
+    conf.set('linker', 'cache', '')
     conf.read([os.path.expanduser('~/.amocorc')])
 else:
     conf = None
@@ -61,5 +66,7 @@ else:
             self.mset('block', bytecode=True)
             self.mset('block', padding=4)
             self.mset('log', level='ERROR')
+            self.mset('linker', sysroot='')
+            self.mset('linker', cache='')
 
     conf = DefaultConf()
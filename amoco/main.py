@@ -10,17 +10,129 @@ logger = Log(__name__)
 from amoco import cfg
 from amoco import code
 from amoco import system
+from amoco.system import elf,pe
+from amoco.system.core import rawview
+from amoco.cas.expressions import reg
 
-from amoco.arch.core import INSTRUCTION_TYPES
+from amoco.arch.core import INSTRUCTION_TYPES, type_control_flow
+
+import mmap
+import multiprocessing
+import cPickle
+from cStringIO import StringIO
+from bisect import bisect_left
+from collections import defaultdict,deque
+import Queue
+
+try:
+    import numpy
+except ImportError:
+    logger.info('numpy package not found => superset analysis is not implemented')
+    numpy = None
 
 # linear sweep based analysis:
 # fast & dumb way of disassembling prog,
 # but provides iterblocks() for all parent classes.
 class lsweep(object):
-    __slots__ = ['prog','G']
-    def __init__(self,prog):
+    __slots__ = ['prog','G','table']
+    def __init__(self,prog,table=None):
         self.prog = prog
         self.G = cfg.graph()
+        # optional code.InstructionTable used by iterblocks (see maketable):
+        self.table = table
+
+    # decode all instructions in [start,end[ into a compact InstructionTable.
+    # Blocks starting inside this table are then found from its columns only.
+    def maketable(self,start,end):
+        T = code.InstructionTable(self.prog.cpu)
+        self.table = self.prog.disassemble_range(start,end,store=T)
+        return self.table
+
+    # parallel linear sweep of code regions (list of (start,end) addresses).
+    # Regions bytes are copied once into a shared mmap and split into chunks
+    # that are decoded by a pool of worker processes (undecodable bytes are
+    # skipped). Chunks start at arbitrary offsets and are decoded a bit beyond
+    # their end (overlap) so that the parent can merge them at the first
+    # instruction address where consecutive chunks resynchronize. The merged
+    # table is thus identical to a sequential sweep of each region, and its
+    # blocks are added to the graph in address order.
+    def psweep(self,regions,workers=None,chunksize=0x100000,overlap=0x1000):
+        p = self.prog
+        maxlen = p.cpu.disassemble.maxlen
+        # regions are written directly in the mmap from the raw parts of the
+        # memory map (rawviews of the program file are not copied before).
+        # A region stops at its first unmapped (or not concrete) byte:
+        m = mmap.mmap(-1,max(sum((int(end-start) for start,end in regions)),1))
+        R = []
+        for start,end in regions:
+            moff = m.tell()
+            for data in p.mmap.read(start,int(end-start),view=True):
+                if isinstance(data,rawview): data.writeto(m)
+                elif isinstance(data,(str,bytearray)): m.write(buffer(data))
+                else: break
+            R.append((moff,m.tell()-moff,int(start)))
+        tasks = []
+        for n,(moff,size,base) in enumerate(R):
+            for lo in xrange(moff,moff+size,chunksize):
+                hi = min(lo+chunksize,moff+size)
+                tasks.append((n,lo,hi,min(hi+overlap,moff+size),moff+size,base-moff))
+        if workers is None: workers = multiprocessing.cpu_count()
+        _psweep.update(cpu=p.cpu,shm=m)
+        try:
+            if workers>1 and len(tasks)>1:
+                pool = multiprocessing.Pool(workers)
+                try:
+                    res = pool.map(_psweep_chunk,tasks,1)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                res = map(_psweep_chunk,tasks)
+            # merge chunks tables:
+            T = code.InstructionTable(p.cpu)
+            T.asize = p.PC().size
+            cur = None
+            for (n,lo,hi,stop,end,delta),(state,off) in zip(tasks,res):
+                Tc = code.InstructionTable.fromstate(p.cpu,state)
+                if cur is None or cur[0]!=n:
+                    T.addrows(Tc)
+                    cur = (n,off)
+                    continue
+                # find the first row of T (overflow of previous chunk) that
+                # is also a row of this chunk:
+                k = bisect_left(T.address,lo+delta)
+                while k<len(T) and Tc.locate(T.address[k]) is None: k += 1
+                if k<len(T):
+                    a = T.address[k]
+                    T.truncate(k)
+                    T.addrows(Tc,Tc.locate(a))
+                    cur = (n,off)
+                    continue
+                # no resync in the overlap: continue sequentially until resync
+                synced = (lambda o:Tc.locate(o+delta) is not None)
+                o = _sweep(p.cpu.disassemble,m,cur[1],end,end,delta,T,synced)
+                if o<end:
+                    T.addrows(Tc,Tc.locate(o+delta))
+                    cur = (n,off)
+                else:
+                    cur = (n,o)
+        finally:
+            _psweep.clear()
+            m.close()
+        self.table = T
+        # add blocks to the graph (a gap also starts a new component):
+        nprev = None
+        A,L = T.address,T.length
+        for sta,sto in T.iterbounds(0):
+            b = p.codehelper(block=code.block(code.InstructionView(T,sta,sto)))
+            # the graph may already hold a node for this block:
+            n = self.G.add_vertex(cfg.node(b))
+            if b.misc[code.tag.FUNC_START] or (sta>0 and A[sta-1]+L[sta-1]!=A[sta]):
+                nprev = None
+            if nprev is not None:
+                self.G.add_edge(cfg.link(nprev,n))
+            nprev = n
+        return T
 
     # iterator over linearly sweeped instructions
     # starting at address loc (defaults to entrypoint).
@@ -42,7 +154,15 @@ class lsweep(object):
     # iterator over basic blocks using the instruction.type attribute
     # to detect the end of block (type_control_flow). The returned block
     # object is enhanced with plateform-specific infos (see block.misc).
+    # If loc is an instruction of the table, blocks are taken from the table
+    # (up to its last instruction).
     def iterblocks(self,loc=None):
+        T = self.table
+        k = T.locate(loc) if (T is not None and loc is not None) else None
+        if k is not None:
+            for b in T.iterblocks(k):
+                yield self.prog.codehelper(block=b)
+            return
         inblock = (lambda i: INSTRUCTION_TYPES[i.type]!='control_flow')
         l = []
         seq = self.sequence(loc)
@@ -80,15 +200,232 @@ class lsweep(object):
     def getcfg(self,loc=None):
         nprev = None
         for b in self.iterblocks(loc):
-            n = cfg.node(b)
+            n = self.G.add_vertex(cfg.node(b))
             if b.misc[code.tag.FUNC_START]:
                 nprev = None
-            if nprev is None:
-                self.G.add_vertex(n)
-            else:
+            if nprev is not None:
                 self.G.add_edge(cfg.link(nprev,n))
             nprev = n
 
+# psweep workers globals (set before the pool is forked):
+_psweep = {}
+
+# decode instructions of the buffer from offset off (skipping undecodable
+# bytes) until offset stop (or until(off) is True), without reading bytes
+# beyond end. Instructions are appended to table T with address off+delta.
+# The offset reached is returned.
+def _sweep(d,buf,off,stop,end,delta,T,until=None):
+    maxlen = d.maxlen
+    while off<stop:
+        if until is not None and until(off): break
+        i = d(buf[off:min(off+maxlen,end)])
+        if i is None:
+            off += 1
+            continue
+        i.address = off+delta
+        T.append(i)
+        off += i.length
+    return off
+
+def _psweep_chunk(task):
+    n,lo,hi,stop,end,delta = task
+    cpu,buf = _psweep['cpu'],_psweep['shm']
+    T = code.InstructionTable(cpu)
+    off = _sweep(cpu.disassemble,buf,lo,hi,end,delta,T)
+    # decode the overlap:
+    off = _sweep(cpu.disassemble,buf,off,stop,end,delta,T)
+    return (T.export(),off)
+
+# -----------------------------------------------------------------------------
+# entryset is the base class of analyses that only provide a sorted list of
+# function entries from which a fforward-like analysis object recovers the cfg.
+# Subclasses (superset, seeds) define the prog attribute and the entries method
+# that returns the list of entry addresses (Python ints):
+class entryset(object):
+    __slots__ = []
+
+    # seed the entries into a fforward-like analysis object and return its cfg:
+    def getcfg(self,analysis=None):
+        p = self.prog
+        if analysis is None: analysis = fforward(p)
+        sz = p.PC().size
+        return analysis.getcfg([p.cpu.cst(v,sz) for v in self.entries()])
+
+    # same with the parallel cfg recovery of the analysis object:
+    def pgetcfg(self,analysis=None,workers=None):
+        if analysis is None: analysis = fforward(self.prog)
+        return analysis.pgetcfg(self.entries(),workers)
+
+# -----------------------------------------------------------------------------
+# superset disassembly:
+# an instruction is decoded at every byte offset of [start,end[ (using the
+# cpu length-only decoder if available, see arch.x86.lengths) and candidates
+# are stored in numpy arrays:
+#   next   : offset of the fall-through successor (-1 if offset is invalid),
+#   branch : True for control flow instructions,
+#   target : offset of the relative branch target (-1 if unknown),
+#   stop   : True for instructions without fall-through (jmp, ret, hlt),
+#   call   : True for call instructions.
+# Candidates are then pruned by propagating invalid marks from successors to
+# their predecessors until a fixed point is reached. Surviving call targets are
+# the seeds of a (high-recall) recursive traversal with fforward.getcfg.
+class superset(entryset):
+    __slots__ = ['prog','start','size','next','branch','target','stop','call','valid']
+
+    # mnemonics of control flow instructions that do not fall-through:
+    STOP = ('JMP','JMPF','RET','RETN','RETF','HLT')
+    CALL = ('CALL',)
+
+    def __init__(self,prog,start,end):
+        if numpy is None:
+            raise ImportError('superset analysis needs the numpy package')
+        self.prog = prog
+        self.start = start
+        self.size = size = int(end-start)
+        self.next   = numpy.full(size,-1,dtype=numpy.int64)
+        self.branch = numpy.zeros(size,dtype=numpy.bool_)
+        self.target = numpy.full(size,-1,dtype=numpy.int64)
+        self.stop   = numpy.zeros(size,dtype=numpy.bool_)
+        self.call   = numpy.zeros(size,dtype=numpy.bool_)
+        self.decode()
+        self.valid = self.prune()
+
+    # fill the candidates arrays:
+    def decode(self):
+        cpu = self.prog.cpu
+        maxlen = cpu.disassemble.maxlen
+        buf = self.prog.read_buffer(self.start,self.size+maxlen-1)
+        decode = getattr(cpu,'lengths',None)
+        if decode is not None:
+            decode = decode.decode
+        else:
+            logger.verbose('no length decoder for %s (using disassembler)'%cpu.__name__)
+            def decode(buf,off,_d=cpu.disassemble):
+                i = _d(buf[off:off+maxlen])
+                if i is None: return None
+                return (i.length,i.type,i.mnemonic,None)
+        nxt,br,tgt,stop,call = self.next,self.branch,self.target,self.stop,self.call
+        for k in xrange(min(self.size,len(buf))):
+            e = decode(buf,k)
+            if e is None: continue
+            l,t,m,d = e
+            nxt[k] = k+l
+            if t==type_control_flow:
+                br[k] = True
+                if d is not None: tgt[k] = k+l+d
+                if m in self.STOP: stop[k] = True
+                elif m in self.CALL: call[k] = True
+
+    # returns the boolean array of valid offsets: an offset is valid if its
+    # instruction is decoded, ends within the range and has no invalid
+    # successor (fall-through or branch target inside the range).
+    def prune(self):
+        size = self.size
+        nxt = numpy.clip(self.next,0,size)
+        ft = ~self.stop
+        tgt = self.target
+        intgt = (tgt>=0)&(tgt<size)
+        tgt = numpy.where(intgt,tgt,size)
+        valid = (self.next>=0)&(self.next<=size)
+        # the (virtual) offset 'size' is always valid:
+        ext = numpy.ones(size+1,dtype=numpy.bool_)
+        count = 0
+        while True:
+            ext[:size] = valid
+            v = valid & (~ft | ext[nxt]) & (~intgt | ext[tgt])
+            count += 1
+            if (v==valid).all(): break
+            valid = v
+        logger.verbose('superset pruning: fixed point reached in %d steps'%count)
+        return valid
+
+    def __len__(self):
+        return int(self.valid.sum())
+
+    # returns valid offsets as addresses (Python ints):
+    def candidates(self):
+        start = int(self.start)
+        return [start+int(k) for k in numpy.flatnonzero(self.valid)]
+
+    # returns the sorted list of targets (Python ints) of valid call
+    # instructions that are valid offsets:
+    def entries(self):
+        m = self.valid & self.call & (self.target>=0) & (self.target<self.size)
+        T = numpy.unique(self.target[m])
+        T = T[self.valid[T]]
+        start = int(self.start)
+        return [start+int(k) for k in T]
+
+# -----------------------------------------------------------------------------
+# function starts seeding:
+# function entries are gathered from the program headers and tables only
+# (no disassembly), by source:
+#   entrypoints : program entrypoints (including PE TLS callbacks),
+#   symbols     : defined ELF function symbols (.symtab and .dynsym),
+#   unwind      : initial locations of ELF .eh_frame FDEs, or begin addresses
+#                 of x64 PE .pdata entries (chained entries excluded),
+#   exports     : PE exported functions (forwarders excluded).
+# Addresses outside of executable segments/sections are dropped. All entries
+# are pushed at once in the spool of getcfg, or are the first round of tasks
+# of pgetcfg.
+class seeds(entryset):
+    __slots__ = ['prog','sources']
+
+    def __init__(self,prog):
+        self.prog = prog
+        # source name -> sorted list of addresses:
+        self.sources = {}
+        self.collect()
+
+    def collect(self):
+        p = self.prog.bin
+        S = self.sources
+        S['entrypoints'] = list(getattr(p,'entrypoints',[]))
+        F = getattr(p,'functions',{})
+        # ELF functions dict also holds dynamic slots (name strings):
+        S['symbols'] = [a for a,v in F.iteritems() if isinstance(v,tuple)]
+        if isinstance(p,(elf.Elf32,elf.Elf64)):
+            S['symbols'].extend(p.exports.itervalues())
+            S['unwind'] = list(p.fdes)
+            X = [(s.p_vaddr,s.p_vaddr+s.p_memsz) for s in p.Phdr
+                 if s.p_type==elf.PT_LOAD and s.p_flags&elf.PF_X]
+        elif isinstance(p,pe.PE):
+            base = p.basemap
+            U = []
+            for b,e,u in p.pdata:
+                try:
+                    flags = ord(p.getdata(u,1))>>3
+                except ValueError:
+                    continue
+                if not flags&pe.UNW_FLAG_CHAININFO: U.append(base+b)
+            S['unwind'] = U
+            S['exports'] = [base+v for v in p.exports.itervalues()
+                            if not isinstance(v,str)]
+            xflags = pe.IMAGE_SCN_MEM_EXECUTE|pe.IMAGE_SCN_CNT_CODE
+            X = [(base+s.RVA,base+s.RVA+s.VirtualSize) for s in p.sections
+                 if s.Characteristics&xflags]
+        else:
+            X = None
+        # addresses are link-time addresses (see CoreExec.relocate):
+        delta = 0
+        if getattr(self.prog,'_imagebase',None) is not None:
+            from amoco.system.reloc import extent
+            delta = self.prog._imagebase-extent(p)[0]
+        for k,L in S.iteritems():
+            L = set((int(a)+delta for a in L if a))
+            if X is not None:
+                L = [a for a in L if any((lo+delta<=a<hi+delta for lo,hi in X))]
+            S[k] = sorted(L)
+        logger.verbose('seeds: %s'%(', '.join(('%d %s'%(len(L),k)
+                                               for k,L in sorted(S.iteritems())))))
+
+    def __len__(self):
+        return len(self.entries())
+
+    # returns the sorted list of all entries (Python ints):
+    def entries(self):
+        return sorted(set((a for L in self.sources.itervalues() for a in L)))
+
 # -----------------------------------------------------------------------------
 class _target(object):
     def __init__(self,cst,parent,econd=None):
@@ -122,7 +459,14 @@ class _target(object):
 class fforward(lsweep):
     policy = {'depth-first': True, 'branch-lazy': True}
 
+    # calls is the list of call targets that are not followed when the
+    # 'follow-calls' policy is False (see pgetcfg):
+    calls = None
+
+    # loc can also be a list of entry points (see superset.getcfg):
     def init_spool(self,loc):
+        if isinstance(loc,list):
+            return [_target(l,None) for l in reversed(loc)]
         return [_target(loc,None)]
 
     def update_spool(self,spool,vtx,parent):
@@ -195,6 +539,10 @@ class fforward(lsweep):
             parent = t.parent
             econd  = t.econd
             if self.check_ext_target(t,spool): continue
+            if (parent is not None and parent.data.misc[code.tag.FUNC_CALL]
+                and not self.policy.get('follow-calls',True)):
+                self.calls.append(t)
+                continue
             for b in self.iterblocks(loc=t.cst):
                 vtx = G.get_node(b.name) or cfg.node(b)
                 b = vtx.data
@@ -218,6 +566,189 @@ class fforward(lsweep):
                 econd  = None
         return G
 
+    # parallel cfg recovery: every function entry is a task of a pool of
+    # worker processes. A worker explores its function with the same analysis
+    # (class and policy) but does not follow calls, and returns the blocks
+    # (address,length,rows), edges (with their conditions) and call targets
+    # it found along with the exported InstructionTable of its blocks (see
+    # _pcfg_task).
+    # Call targets are queued as new tasks as soon as the result of their
+    # caller is received (workers never wait for a whole round to complete).
+    # Results are merged into the graph at the end in entry address order
+    # (using graph.add_vertex cut/overlay logic) so that the resulting graph
+    # does not depend on the scheduling.
+    # Returns the graph; functions summaries are kept in self.functions.
+    def pgetcfg(self,loc=None,workers=None):
+        p = self.prog
+        G = self.G
+        if loc is None:
+            m = p.initenv()
+            loc = m(p.PC())
+        if not isinstance(loc,list): loc = [loc]
+        sz = p.PC().size
+        if workers is None: workers = multiprocessing.cpu_count()
+        self.functions = {}
+        todo = sorted(set((int(l) for l in loc)))
+        seen = set(todo)
+        results = {}
+        _pcfg.update(prog=p,cls=self.__class__,policy=self.policy)
+        pool = multiprocessing.Pool(workers) if workers>1 else None
+        Q = Queue.Queue()
+        def tasks():
+            while True:
+                e = Q.get()
+                if e is None: return
+                yield e
+        try:
+            if pool is not None:
+                for e in todo: Q.put(e)
+                pending = len(todo)
+                if pending==0: Q.put(None)
+                for r in pool.imap_unordered(_pcfg_task,tasks(),1):
+                    results[r['summary']['entry']] = r
+                    pending -= 1
+                    for c in sorted(set((c for _,c in r['calls']))-seen):
+                        seen.add(c)
+                        Q.put(c)
+                        pending += 1
+                    if pending==0: Q.put(None)
+            else:
+                todo = deque(todo)
+                while len(todo)>0:
+                    r = _pcfg_task(todo.popleft())
+                    results[r['summary']['entry']] = r
+                    for c in sorted(set((c for _,c in r['calls']))-seen):
+                        seen.add(c)
+                        todo.append(c)
+        finally:
+            _pcfg.clear()
+            if pool is not None:
+                # release the tasks generator if we leave on error:
+                Q.put(None)
+                pool.close()
+                pool.join()
+        callers = defaultdict(list)
+        for entry in sorted(results):
+            r = results.pop(entry)
+            self.functions[entry] = r['summary']
+            self.__pcfg_merge(r,callers)
+        # tag entries and set their callers:
+        for entry in self.functions:
+            v = G.get_node(str(p.cpu.cst(entry,sz)))
+            if v is None: continue
+            v.data.misc[code.tag.FUNC_START] = 1+len(callers[entry])
+            v.data.misc['callers'] = [G.get_node(n) for n in callers[entry]]
+        return G
+
+    # blocks that are not already in the graph are built from views of the
+    # table exported by the worker (instructions are not decoded again):
+    def __pcfg_merge(self,r,callers):
+        p = self.prog
+        G = self.G
+        sz = p.PC().size
+        T = code.InstructionTable.fromstate(p.cpu,r['table'])
+        nodes = {}
+        for a,l,tbc,sta,sto in r['blocks']:
+            v = G.get_node(str(p.cpu.cst(a,sz)))
+            if v is None:
+                b = code.block(code.InstructionView(T,sta,sto))
+                v = G.add_vertex(cfg.node(p.codehelper(block=b)))
+            if tbc: v.data.misc['tbc'] = 1
+            nodes[a] = v
+        for ref,size in r['xfuncs']:
+            nodes[ref] = cfg.node(code.xfunc(p.cpu.ext(ref,size=size)))
+        for a,b,c in r['edges']:
+            # nodes may have been cut by the cut/overlay logic:
+            n0 = G.get_node(nodes[a].name) or nodes[a]
+            n1 = G.get_node(nodes[b].name) or nodes[b]
+            # edges found by several workers are added once (as in getcfg):
+            if any((e.v[1].name==n1.name for e in n0.e_out())): continue
+            G.add_edge(cfg.link(n0,n1,data=_pcfg_loads(p.cpu,c)))
+        for a,c in r['calls']:
+            callers[c].append(nodes[a].name)
+
+# pgetcfg workers globals (set before the pool is forked):
+_pcfg = {}
+
+# edges conditions are expressions that are pickled with the registers of the
+# cpu module and ext symbols replaced by their names, so that the parent gets
+# its own objects back (registers are compared by identity):
+def _pcfg_regs(cpu):
+    R = {}
+    for v in vars(cpu.module).itervalues():
+        if isinstance(v,reg) and not v._is_ext: R[v.ref] = v
+    return R
+
+def _pcfg_dumps(cpu,x):
+    if x is None: return None
+    R = _pcfg_regs(cpu)
+    def persid(o):
+        if isinstance(o,reg):
+            if o._is_ext: return ('ext',o.ref,o.size)
+            if R.get(o.ref) is o: return ('reg',o.ref)
+        return None
+    f = StringIO()
+    P = cPickle.Pickler(f,2)
+    P.persistent_id = persid
+    P.dump(x)
+    return f.getvalue()
+
+def _pcfg_loads(cpu,s):
+    if s is None: return None
+    R = _pcfg_regs(cpu)
+    def persload(pid):
+        if pid[0]=='ext': return cpu.ext(pid[1],size=pid[2])
+        return R[pid[1]]
+    U = cPickle.Unpickler(StringIO(s))
+    U.persistent_load = persload
+    return U.load()
+
+# explore the function at entry and return its serialized blocks, edges and
+# call targets as a dict of Python objects:
+def _pcfg_task(entry):
+    p = _pcfg['prog']
+    a = _pcfg['cls'](p)
+    a.policy = dict(_pcfg['policy'])
+    a.policy['follow-calls'] = False
+    a.calls = []
+    sz = p.PC().size
+    blocks,xfuncs,edges = [],[],[]
+    error = None
+    try:
+        G = a.getcfg(p.cpu.cst(entry,sz))
+    except Exception,e:
+        logger.warning('pgetcfg: function %x: %s'%(entry,e))
+        error = str(e)
+        G = a.G
+    key = {}
+    for v in G.V():
+        b = v.data
+        if isinstance(b,code.xfunc):
+            key[v] = b.address.ref
+            xfuncs.append((b.address.ref,b.address.size))
+        else:
+            key[v] = int(b.address)
+            blocks.append((int(b.address),b.length,b.misc['tbc'],b))
+    for e in G.E():
+        edges.append((key[e.v[0]],key[e.v[1]],_pcfg_dumps(p.cpu,e.data)))
+    calls = []
+    for t in a.calls:
+        if t.cst is not None and t.cst._is_cst:
+            calls.append((int(t.parent.data.address),int(t.cst)))
+    blocks.sort(key=lambda x: x[0])
+    xfuncs.sort(); edges.sort(); calls.sort()
+    # instructions of the blocks are exported as table rows [sta,sto[:
+    T = code.InstructionTable(p.cpu)
+    for k,(a,l,tbc,b) in enumerate(blocks):
+        sta = len(T)
+        T.extend(b.instr)
+        blocks[k] = (a,l,tbc,sta,len(T))
+    summary = {'entry':entry, 'blocks':len(blocks), 'size':sum((x[1] for x in blocks)),
+               'calls':sorted(set((c for _,c in calls))),
+               'xcalls':[x for x,_ in xfuncs], 'error':error}
+    return {'blocks':blocks, 'xfuncs':xfuncs, 'edges':edges, 'calls':calls,
+            'table':T.export(), 'summary':summary}
+
 # -----------------------------------------------------------------------------
 # link forward based analysis:
 # follows PC expression evaluated with parent block mapping.
@@ -8,14 +8,22 @@
 from amoco.logger import Log
 logger = Log(__name__)
 
-from bisect import bisect_left
+from random import random
+from collections import OrderedDict
+from copy import copy
 
-from amoco.cas.expressions import top
+from amoco.cas.expressions import top, ext
+
+# raw values up to PAGESIZE bytes are copied when a shared obj is modified,
+# larger ones are kept shared through a rawview (see mo.copy):
+PAGESIZE = 4096
 
 #------------------------------------------------------------------------------
 # datadiv provides the API for manipulating data values extracted from memory.
 # These values are either considered as 'raw' (byte strings) or can be any
-# abstractions (or symbolic expressions)
+# abstractions (or symbolic expressions). Raw values are str, rawview or
+# bytearray objects: a str value is turned into a bytearray when it is
+# overwritten or extended so that raw writes are done in place.
 # The datadiv.val required API is:
 #   .__len__ => byte length
 #   .size => bit length
@@ -36,17 +44,24 @@ class datadiv(object):
         return len(self.val)
 
     def __repr__(self):
-        s = repr(self.val)
+        v = self.val
+        if isinstance(v,bytearray): v = str(v)
+        s = repr(v)
         if len(s)>32:
             s=s[:32]+"..."
-            if isinstance(self.val,str): s+="'"
+            if isinstance(v,str): s+="'"
         return '<datadiv:%s>'%s
 
     def __str__(self):
+        if isinstance(self.val,bytearray): return repr(str(self.val))
         return repr(self.val) if self._is_raw else str(self.val)
 
     def cut(self,l):
-        if self._is_raw:
+        if isinstance(self.val,rawview):
+            self.val = self.val.view(l)
+        elif isinstance(self.val,bytearray):
+            del self.val[:l]
+        elif self._is_raw:
             self.val = self.val[l:]
         else:
             self.val = self.val.bytes(l)
@@ -64,41 +79,145 @@ class datadiv(object):
             logger.error("invalid fetch (o=%s,l=%s) in %s"%(o,l,repr(self)))
             raise ValueError
         lv = len(self)
-        if o==0 and l==lv: return (self.val,0)
+        if o==0 and l==lv and not isinstance(self.val,(rawview,bytearray)):
+            return (self.val,0)
         if self._is_raw:
             res = self.val[o:o+l]
+            if isinstance(res,bytearray): res = str(res)
             return (res,l-len(res))
         if o>=lv: return (None,l)
         res = self.val.bytes(o,o+l)
         return (res,l-res.length)
 
+    # returns the part of val of length l located at offset o. Unlike getpart,
+    # a rawview val is not copied.
+    def getview(self,o,l):
+        if isinstance(self.val,rawview):
+            return self.val.view(o,o+l)
+        return self.getpart(o,l)[0]
+
     # returns a list of (contiguous) datadiv objects resulting from
     # overwriting self with data at offset o, possibly extending self.
     def setpart(self,o,data):
         assert 0<=o<=len(self)
+        # raw data over raw bytes is written in place:
+        if isinstance(self.val,(str,bytearray)) and isinstance(data,(str,bytearray)):
+            if isinstance(self.val,str): self.val = bytearray(self.val)
+            self.val[o:o+len(data)] = data
+            return [self]
+        # raw data over a rawview is written in a copy of the page(s) where
+        # it is located, other pages are still viewed:
+        if isinstance(self.val,rawview) and isinstance(data,(str,bytearray)):
+            ps = (o//PAGESIZE)*PAGESIZE
+            pe = min(len(self),ps+PAGESIZE)
+            page = bytearray(self.val[ps:pe])
+            page[o-ps:o-ps+len(data)] = data
+            P = [datadiv(page)]
+            if ps>0: P.insert(0,datadiv(self.val.view(0,ps)))
+            if ps+len(page)<len(self):
+                P.append(datadiv(self.val.view(ps+len(page))))
+            return P
         P = [datadiv(data)]
         olv = o+len(data)
         endl = len(self)-olv
         if endl>0:
-            P.append(datadiv(self.getpart(olv,endl)[0]))
+            P.append(datadiv(self.getview(olv,endl)))
         if o>0:
-            P.insert(0,datadiv(self.getpart(0,o)[0]))
+            P.insert(0,datadiv(self.getview(0,o)))
         # now merge contiguous parts if they have same type:
         return mergeparts(P)
 
+    # append raw value v to self.val (in place if possible). Raises TypeError
+    # if both values can't be concatenated (ie. rawview and str.)
+    def extend(self,v):
+        if isinstance(self.val,str) and isinstance(v,(str,bytearray)):
+            self.val = bytearray(self.val)
+        self.val += v
+
 def mergeparts(P):
     parts = [P.pop(0)]
     while len(P)>0:
         p = P.pop(0)
         if parts[-1]._is_raw and p._is_raw:
             try:
-                parts[-1].val += p.val
+                parts[-1].extend(p.val)
             except TypeError:
                 parts.append(p)
         else:
             parts.append(p)
     return parts
 
+#------------------------------------------------------------------------------
+# rawview is a zero-copy raw value for datadiv: it represents the l bytes
+# located at offset o of a buffer-like src (str, mmap, etc) followed by z
+# virtual null bytes (ie. a bss area is a rawview with l=0.) Slicing returns
+# the selected bytes as a str, while view returns a (sub)rawview without
+# copying anything from src.
+class rawview(object):
+    __slots__ = ['src','o','l','z']
+
+    def __init__(self,src,o=0,l=None,z=0):
+        if src is None: src=''
+        avail = max(0,len(src)-o)
+        if l is None: l = avail
+        self.src = src
+        self.o = o
+        self.l = min(l,avail)
+        self.z = z
+
+    def __len__(self):
+        return self.l+self.z
+
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            sta,sto,_ = i.indices(len(self))
+        else:
+            if i<0: i += len(self)
+            if not 0<=i<len(self): raise IndexError(i)
+            sta,sto = i,i+1
+        if sto<=sta: return ''
+        s = ''
+        if sta<self.l:
+            s = self.src[self.o+sta:self.o+min(sto,self.l)]
+            if not isinstance(s,str): s = str(s)
+        if sto>self.l:
+            s += '\0'*(sto-max(sta,self.l))
+        return s
+
+    def view(self,sta,sto=None):
+        sta,sto,_ = slice(sta,sto).indices(len(self))
+        sto = max(sta,sto)
+        if sta>=self.l:
+            return rawview(None,0,0,sto-sta)
+        l = min(sto,self.l)-sta
+        return rawview(self.src,self.o+sta,l,sto-sta-l)
+
+    def __str__(self):
+        return self[:]
+
+    # write the bytes of the view into file-like object f (ie. a mmap) without
+    # an intermediate copy if src supports the buffer interface:
+    def writeto(self,f):
+        try:
+            b = buffer(self.src,self.o,self.l)
+        except TypeError:
+            b = self.src[self.o:self.o+self.l]
+        f.write(b)
+        if self.z>0: f.write('\0'*self.z)
+
+    # contiguous views of the same src are merged, otherwise a TypeError is
+    # raised (as for str+expression) so that merging callers keep both parts.
+    def __add__(self,v):
+        if isinstance(v,rawview):
+            if self.z==0 and v.src is self.src and v.o==self.o+self.l:
+                return rawview(self.src,self.o,self.l+v.l,v.z)
+            if self.z>0 and v.l==0:
+                return rawview(self.src,self.o,self.l,self.z+v.z)
+        return NotImplemented
+
+    def __repr__(self):
+        return '<rawview [%d:%d]+%d>'%(self.o,self.o+self.l,self.z)
+
 #------------------------------------------------------------------------------
 # mo are abstractions for 'memory objects'. Such obj is located at a virtual
 # address in Memory. Data contained in the obj is stored as datadiv object.
@@ -123,6 +242,16 @@ class mo(object):
             if self.data._is_raw: data+="'"
         return '<mo [%08x,%08x] data:%s>'%(self.vaddr,self.end,data)
 
+    # returns a copy of self that can be modified without changing self. Raw
+    # values of self are not copied if they are larger than PAGESIZE: the copy
+    # then holds a rawview of it (and self must not be modified anymore.)
+    def copy(self):
+        v = self.data.val
+        if isinstance(v,(str,bytearray)):
+            if len(v)>PAGESIZE: v = rawview(v)
+            elif isinstance(v,bytearray): v = bytearray(v)
+        return mo(self.vaddr,v)
+
     # change current obj to start at provided vaddr
     def trim(self,vaddr):
         if vaddr in self:
@@ -131,9 +260,14 @@ class mo(object):
             self.vaddr = vaddr
 
     # provide list of datadivs resulting from reading l bytes starting at vaddr
-    def read(self,vaddr,l):
+    # (with view=True, a rawview part is returned as a rawview, not copied).
+    def read(self,vaddr,l,view=False):
         if vaddr in self:
-            return self.data.getpart(vaddr-self.vaddr,l)
+            o = vaddr-self.vaddr
+            if view and isinstance(self.data.val,rawview):
+                v = self.data.val.view(o,o+l)
+                return (v,l-len(v))
+            return self.data.getpart(o,l)
         else:
             logger.debug('%s read out of bound (vaddr=%08x, l=%d)',repr(self),vaddr,l)
             return (None,l)
@@ -154,14 +288,214 @@ class mo(object):
             logger.debug('%s write out of bound (vaddr=%08x,data=%.32s)',repr(self),vaddr,repr(data))
             return [mo(vaddr,data)]
 
+#------------------------------------------------------------------------------
+# ZoneMap is the ordered sequence of mo objects of a MemoryZone. It is an
+# implicit treap (a randomized balanced tree ordered by position and augmented
+# with subtree sizes) so that locating an address, indexing, inserting and
+# deleting a slice of objs are O(log n) instead of O(n) for a python list.
+# Objects are ordered by vaddr but vaddrs are not stored in the tree: shifting
+# every obj by the same offset (see RawExec.relocate) keeps the map valid.
+#
+# ZoneMaps are persistent: fork returns a new map that shares all nodes and
+# objs with self. Each map has its own tag and only modifies nodes (and objs)
+# that are tagged with it, other nodes are copied first along the modified
+# path (and objs are copied by mutable) so that a fork costs O(1) and each
+# map only pays for what is modified afterwards.
+class _znode(object):
+    __slots__ = ['z','prio','size','left','right','tag','ztag']
+
+    def __init__(self,z,tag=None):
+        self.z = z
+        self.prio = random()
+        self.size = 1
+        self.left = self.right = None
+        self.tag = self.ztag = tag
+
+    def update(self):
+        self.size = 1
+        if self.left is not None: self.size += self.left.size
+        if self.right is not None: self.size += self.right.size
+
+def _zsize(t):
+    return 0 if t is None else t.size
+
+# returns t if it is owned by tag or a copy of t owned by tag (the obj is still
+# shared with t until the node's ztag is set to tag):
+def _zown(t,tag):
+    if t is None or t.tag is tag: return t
+    n = _znode.__new__(_znode)
+    n.z,n.prio,n.size = t.z,t.prio,t.size
+    n.left,n.right = t.left,t.right
+    n.tag,n.ztag = tag,t.ztag
+    return n
+
+# split tree t into trees with the first k objs and the remaining objs:
+def _zsplit(t,k,tag):
+    if t is None: return (None,None)
+    t = _zown(t,tag)
+    ls = _zsize(t.left)
+    if k<=ls:
+        a,t.left = _zsplit(t.left,k,tag)
+        t.update()
+        return (a,t)
+    t.right,b = _zsplit(t.right,k-ls-1,tag)
+    t.update()
+    return (t,b)
+
+# merge trees a and b (all objs of a are located before objs of b):
+def _zmerge(a,b,tag):
+    if a is None: return b
+    if b is None: return a
+    if a.prio>b.prio:
+        a = _zown(a,tag)
+        a.right = _zmerge(a.right,b,tag)
+        a.update()
+        return a
+    b = _zown(b,tag)
+    b.left = _zmerge(a,b.left,tag)
+    b.update()
+    return b
+
+class ZoneMap(object):
+    __slots__ = ['root','tag']
+
+    def __init__(self,Z=None):
+        self.root = None
+        self.tag = object()
+        if Z: self.root = self.__build(Z)
+
+    # build the treap from an ordered sequence in linear time:
+    def __build(self,Z):
+        stack = []
+        for z in Z:
+            n = _znode(z,self.tag)
+            last = None
+            while stack and stack[-1].prio<n.prio:
+                last = stack.pop()
+                last.update()
+            n.left = last
+            if stack: stack[-1].right = n
+            stack.append(n)
+        while stack:
+            root = stack.pop()
+            root.update()
+        return root
+
+    def fork(self):
+        m = ZoneMap()
+        m.root = self.root
+        self.tag = object()
+        return m
+
+    def __len__(self):
+        return _zsize(self.root)
+
+    def __nodes(self):
+        stack = []
+        t = self.root
+        while stack or t is not None:
+            if t is not None:
+                stack.append(t)
+                t = t.left
+            else:
+                t = stack.pop()
+                yield t
+                t = t.right
+
+    def __iter__(self):
+        for t in self.__nodes(): yield t.z
+
+    # yields (obj, owned) where owned is False if obj is shared with a fork:
+    def owned(self):
+        for t in self.__nodes(): yield (t.z, t.ztag is self.tag)
+
+    def __getitem__(self,i):
+        n = len(self)
+        if i<0: i += n
+        if not 0<=i<n: raise IndexError(i)
+        t = self.root
+        while True:
+            ls = _zsize(t.left)
+            if i<ls:
+                t = t.left
+            elif i==ls:
+                return t.z
+            else:
+                i -= ls+1
+                t = t.right
+
+    # returns obj at index i that can be modified without affecting forks:
+    def mutable(self,i):
+        n = len(self)
+        if i<0: i += n
+        if not 0<=i<n: raise IndexError(i)
+        tag = self.tag
+        t = self.root = _zown(self.root,tag)
+        while True:
+            ls = _zsize(t.left)
+            if i<ls:
+                t.left = _zown(t.left,tag)
+                t = t.left
+            elif i==ls:
+                if t.ztag is not tag:
+                    t.z = t.z.copy()
+                    t.ztag = tag
+                return t.z
+            else:
+                i -= ls+1
+                t.right = _zown(t.right,tag)
+                t = t.right
+
+    def __delitem__(self,i):
+        if isinstance(i,slice):
+            i,j,_ = i.indices(len(self))
+        else:
+            if i<0: i += len(self)
+            j = i+1
+        if j<=i: return
+        a,b = _zsplit(self.root,i,self.tag)
+        _,c = _zsplit(b,j-i,self.tag)
+        self.root = _zmerge(a,c,self.tag)
+
+    def insert(self,i,z):
+        if i<0: i = max(0,i+len(self))
+        a,b = _zsplit(self.root,i,self.tag)
+        n = _znode(z,self.tag)
+        self.root = _zmerge(_zmerge(a,n,self.tag),b,self.tag)
+
+    def append(self,z):
+        self.root = _zmerge(self.root,_znode(z,self.tag),self.tag)
+
+    def pop(self,i=-1):
+        z = self[i]
+        del self[i]
+        return z
+
+    # returns the index of the last obj with vaddr<=given vaddr (or None):
+    def locate(self,vaddr):
+        t = self.root
+        i = None
+        k = 0
+        while t is not None:
+            if t.z.vaddr<=vaddr:
+                k += _zsize(t.left)
+                i = k
+                k += 1
+                t = t.right
+            else:
+                t = t.left
+        return i
+
+    def __repr__(self):
+        return '<ZoneMap of %d objs>'%len(self)
+
 #------------------------------------------------------------------------------
 class MemoryZone(object):
-    __slot__ = ['rel','_map','__cache']
+    __slot__ = ['rel','_map']
 
     def __init__(self,rel=None,D=None):
         self.rel = rel
-        self._map = []
-        self.__cache = [] # speedup locate method
+        self._map = ZoneMap()
         if D != None and isinstance(D,dict):
             for vaddr,data in D.iteritems():
                 self.addtomap(mo(vaddr,data))
@@ -176,21 +510,24 @@ class MemoryZone(object):
             l.append("\t %s"%str(z))
         return '\n'.join(l)+'>'
 
-    def __update_cache(self):
-        self.__cache = [z.vaddr for z in self._map]
+    # returns a copy of self that shares all objs until they are modified:
+    def fork(self):
+        z = MemoryZone(self.rel)
+        z._map = self._map.fork()
+        return z
 
     # locate the index that contains the given address in the mmap:
     def locate(self,vaddr):
-        p = self.__cache
-        if vaddr in p: return p.index(vaddr)
-        i = bisect_left(p,vaddr)
-        if i==0: return None
-        else: return i-1
+        return self._map.locate(vaddr)
+
+    # remove the zone at index i:
+    def remove(self,i):
+        return self._map.pop(i)
 
     # read l bytes starting at vaddr.
     # return value is a list of datadiv values, unmapped areas
-    # are returned as 'top' expressions.
-    def read(self,vaddr,l):
+    # are returned as 'top' expressions (see mo.read for view).
+    def read(self,vaddr,l,view=False):
         res = []
         i = self.locate(vaddr)
         if i is None:
@@ -204,13 +541,14 @@ class MemoryZone(object):
         ll = l
         while ll>0:
             try:
-                data,ll = self._map[i].read(vaddr,ll)
+                z = self._map[i]
             except IndexError:
                 res.append(top(ll*8))
                 ll=0
                 break
+            data,ll = z.read(vaddr,ll,view)
             if data is None:
-                vi = self.__cache[i]
+                vi = z.vaddr
                 if vaddr < vi:
                     l = min(vaddr+ll,vi)-vaddr
                     data = top(l*8)
@@ -225,6 +563,8 @@ class MemoryZone(object):
 
     # write data at address vaddr in map
     def write(self,vaddr,data,res=False):
+        # raw bytearrays are modified in place, never keep the caller's one:
+        if isinstance(data,bytearray): data = str(data)
         self.addtomap(mo(vaddr,data))
         if res is True: self.restruct()
 
@@ -236,21 +576,19 @@ class MemoryZone(object):
         if j is None:
             assert i is None
             self._map.insert(0,z)
-            self.__update_cache()
             return
         if j==i:
-            Z = self._map[i].write(z.vaddr,z.data.val)
+            Z = self._map.mutable(i).write(z.vaddr,z.data.val)
             i += 1
             for newz in Z:
                 self._map.insert(i,newz)
                 i+=1
-            self.__update_cache()
             return
         # i!=j cases:
         # delete & update every overwritten zones
         # by adjusting [i,j]:
         if z.end in self._map[j]:
-            self._map[j].trim(z.end)
+            self._map.mutable(j).trim(z.end)
         else:
             j += 1
         Z = [z]
@@ -258,29 +596,29 @@ class MemoryZone(object):
             i=-1
         elif z.vaddr <= self._map[i].end:
             # overright data:
-            Z = self._map[i].write(z.vaddr,z.data.val)
+            Z = self._map.mutable(i).write(z.vaddr,z.data.val)
         i += 1
         del self._map[i:j]
         # insert new zones:
         for newz in Z:
             self._map.insert(i,newz)
             i+=1
-        self.__update_cache()
 
     def restruct(self):
         if len(self._map)==0: return
-        m = [self._map.pop(0)]
-        for z in self._map:
-            rawtype = (z.data._is_raw & m[-1].data._is_raw)
-            if rawtype and (z.vaddr==m[-1].end):
-                try:
-                    m[-1].data.val += z.data.val
-                except TypeError:
-                    m.append(z)
-            else:
-                m.append(z)
-        self._map = m
-        self.__update_cache()
+        m = []
+        for z,owned in self._map.owned():
+            if not owned: z = z.copy()
+            if len(m)>0:
+                rawtype = (z.data._is_raw & m[-1].data._is_raw)
+                if rawtype and (z.vaddr==m[-1].end):
+                    try:
+                        m[-1].data.extend(z.data.val)
+                    except TypeError:
+                        m.append(z)
+                    continue
+            m.append(z)
+        self._map = ZoneMap(m)
 
 #------------------------------------------------------------------------------
 class MemoryMap(object):
@@ -332,10 +670,10 @@ class MemoryMap(object):
         item = self._zones[r].read(o,l)[0]
         return item
 
-    def read(self,address,l):
+    def read(self,address,l,view=False):
         r,o = self.reference(address)
         if r in self._zones:
-            return self._zones[r].read(o,l)
+            return self._zones[r].read(o,l,view)
         else:
             raise MemoryError(address)
 
@@ -348,17 +686,155 @@ class MemoryMap(object):
     def restruct(self):
         for z in self._zones.itervalues(): z.restruct()
 
+    # fork returns a copy of the map in O(number of zones). Zones are shared
+    # until modified (see ZoneMap) so that the memory used by each fork is
+    # proportional to what it writes.
+    def fork(self):
+        m = MemoryMap()
+        m._zones = dict(((r,z.fork()) for (r,z) in self._zones.iteritems()))
+        m.perms = dict(self.perms)
+        return m
+
+    # snapshot returns the current state of the map, that can be restored
+    # later (possibly several times) with restore:
+    def snapshot(self):
+        return self.fork()
+
+    def restore(self,snapshot):
+        m = snapshot.fork()
+        self._zones = m._zones
+        self.perms = m.perms
+
+#------------------------------------------------------------------------------
+# ContextDisassembler wraps the disassembler of a cpu module so that it decodes
+# with the DecodeContext of a program (unless a ctx is provided) and returns
+# instances of the instruction class of this program (see CPUContext). Other
+# attributes are taken from the wrapped disassembler.
+# The default contexts of cpu modules do not depend on kargs, they are
+# ignored here.
+class ContextDisassembler(object):
+
+    def __init__(self,disassemble,ctx,iclass):
+        self.disassemble = disassemble
+        self.ctx = ctx
+        self.iclass = iclass
+
+    # returns a copy of the program context:
+    def context(self,**kargs):
+        return self.ctx.copy()
+
+    def __call__(self,bytestring,**kargs):
+        kargs.setdefault('ctx',self.ctx)
+        kargs.setdefault('iclass',self.iclass)
+        return self.disassemble(bytestring,**kargs)
+
+    def __getattr__(self,attr):
+        return getattr(self.disassemble,attr)
+
+#------------------------------------------------------------------------------
+# CPUContext binds a cpu module (its instruction class with uarch/formatter,
+# its disassembler and its registers env) with the ext stubs of a given system,
+# so that each program owns its context and programs of distinct arch/systems
+# can be analysed in the same process. Other attributes are taken from the cpu
+# module (ie. p.cpu.eip, p.cpu.cst, etc.)
+# The decoding state of the program (ARM/Thumb, IT and endian states of ARM
+# for example) is the DecodeContext self.decoding: it starts from the cpu
+# module defaults and is updated by the semantics of instructions decoded with
+# this context (they refer to it with their decoding class attribute).
+class CPUContext(object):
+
+    def __init__(self,cpu,*stubslist):
+        self.module = cpu
+        self.stubs = defaultdict(lambda :default_hook)
+        for S in stubslist:
+            self.stubs.update(S)
+            if S.default_factory() is not default_hook:
+                self.stubs.default_factory = S.default_factory
+        # ext expressions created by this context use its own stubs:
+        self.ext = type('ext',(cpu.ext,),{'stubs':self.stubs})
+        d = cpu.disassemble
+        self.decoding = d.context()
+        iclass = type(d.iclass.__name__,(d.iclass,),
+                      {'__slots__':(),'decoding':self.decoding})
+        self.disassemble = ContextDisassembler(d,self.decoding,iclass)
+
+    @property
+    def instruction(self):
+        return self.disassemble.iclass
+
+    @property
+    def uarch(self):
+        return self.instruction._uarch
+
+    @property
+    def formatter(self):
+        return self.instruction.formatter
+
+    def __getattr__(self,attr):
+        return getattr(self.module,attr)
+
+    def __repr__(self):
+        return '<CPUContext %s>'%self.module.__name__
+
+#------------------------------------------------------------------------------
+# DecodeCache is a LRU cache of decoded instructions used by read_instruction.
+# Keys are (address, bytes, decode mode) and values are instruction objects
+# that are never returned directly (read_instruction returns copies).
+class DecodeCache(object):
+    __slots__ = ['maxsize','hits','misses','_cache']
+
+    def __init__(self,maxsize=16384):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def get(self,key):
+        try:
+            i = self._cache.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._cache[key] = i
+        self.hits += 1
+        return i
+
+    def put(self,key,i):
+        self._cache[key] = i
+        if len(self._cache)>self.maxsize:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __repr__(self):
+        return '<DecodeCache %d/%d (hits=%d misses=%d)>'%(len(self),self.maxsize,
+                                                          self.hits,self.misses)
+
 #------------------------------------------------------------------------------
 class CoreExec(object):
-    __slots__ = ['bin','cpu','mmap']
+    __slots__ = ['bin','cpu','mmap','icache']
+    # Linker used by load_shlib to map needed libraries (see system.linker):
+    linker = None
 
     def __init__(self,p,cpu=None):
         self.bin = p
-        self.cpu = cpu
+        self.cpu = None
+        if cpu is not None:
+            self.cpu = self.newcontext(cpu)
         self.mmap = MemoryMap()
+        self.icache = DecodeCache()
         self.load_binary()
-        if cpu is not None:
-            cpu.ext.stubs = stubs
+
+    # returns a new CPUContext for cpu module with stubs defined
+    # in the system modules of the class hierarchy:
+    def newcontext(self,cpu):
+        S = [getstubs(c.__module__) for c in reversed(self.__class__.__mro__)]
+        return CPUContext(cpu,*S)
 
     def initenv(self):
         return None
@@ -369,6 +845,22 @@ class CoreExec(object):
     def read_data(self,vaddr,size):
         return self.mmap.read(vaddr,size)
 
+    # move the program image at vaddr and apply its relocations:
+    def relocate(self,vaddr):
+        from amoco.system.reloc import relocate
+        relocate(self,vaddr)
+
+    # save the loaded program (memory map and symbols) in an image file:
+    def save_image(self,path):
+        from amoco.system.image import save_image
+        save_image(self,path)
+
+    # returns the CoreExec saved in image file path (see system.image):
+    @staticmethod
+    def load_image(path):
+        from amoco.system.image import load_image
+        return load_image(path)
+
     def read_instruction(self,vaddr,**kargs):
         if self.cpu is None:
             logger.error('no cpu imported')
@@ -380,16 +872,83 @@ class CoreExec(object):
             logger.verbose("vaddr %s is not mapped"%vaddr)
             raise MemoryError(e)
         else:
-            if len(istr)>1 or not isinstance(istr[0],str):
+            # raw bytes may be split in several objs (ie. a page written
+            # over a rawview, see datadiv.setpart):
+            if not all((isinstance(x,str) for x in istr)):
                 logger.verbose("failed to read instruction at %s"%vaddr)
                 return None
-        i = self.cpu.disassemble(istr[0],**kargs)
+            istr = ''.join(istr)
+        # lookup decoded instruction in cache:
+        ctx = kargs.pop('ctx',None) or self.cpu.disassemble.context(**kargs)
+        try:
+            key = (int(vaddr),istr,ctx.iset,ctx.endian,ctx.itstate)
+        except (TypeError,AttributeError):
+            key = None
+        i = self.icache.get(key) if key is not None else None
         if i is None:
-            logger.warning("disassemble failed at vaddr %s"%vaddr)
-            return None
+            i = self.cpu.disassemble(istr,ctx=ctx,**kargs)
+            if i is None:
+                logger.warning("disassemble failed at vaddr %s"%vaddr)
+                return None
+            if key is not None: self.icache.put(key,copy(i))
         else:
+            i = copy(i)
+        i.address = vaddr
+        return i
+
+    # read_buffer returns the str of contiguous raw bytes mapped from vaddr
+    # start (up to size bytes.) The buffer is shorter if some byte is not
+    # mapped or is not concrete.
+    def read_buffer(self,start,size):
+        try:
+            parts = self.mmap.read(start,size)
+        except MemoryError,e:
+            logger.verbose("vaddr %s is not mapped"%start)
+            raise MemoryError(e)
+        # contiguous raw parts form the buffer (no copy if only one part):
+        raw = []
+        for data in parts:
+            if not isinstance(data,str): break
+            raw.append(data)
+        return ''.join(raw)
+
+    # disassemble_range decodes every instruction located in [start,end[ by
+    # reading raw bytes from mmap only once and then decoding sequentially
+    # from this buffer (read_instruction does a mmap read for each instruction).
+    # Undecodable bytes are skipped (as in main._sweep) and decoding stops at
+    # the first unmapped address. Decoded instructions are appended to the
+    # store object (a list by default, see also code.InstructionTable) which
+    # is returned.
+    def disassemble_range(self,start,end,store=None,**kargs):
+        if self.cpu is None:
+            logger.error('no cpu imported')
+            raise ValueError
+        if store is None: store = []
+        maxlen = self.cpu.disassemble.maxlen
+        size = int(end-start)
+        if size<=0: return store
+        # read enough bytes to decode an instruction starting at end-1:
+        buf = self.read_buffer(start,size+maxlen-1)
+        if len(buf)<size:
+            logger.verbose("disassemble_range stops at unmapped vaddr %s"%(start+len(buf)))
+            size = len(buf)
+        decode = self.cpu.disassemble
+        vaddr = start
+        off = 0
+        skipped = 0
+        while off<size:
+            i = decode(buf[off:off+maxlen],**kargs)
+            if i is None:
+                skipped += 1
+                off += 1
+                vaddr += 1
+                continue
             i.address = vaddr
-            return i
+            store.append(i)
+            off += i.length
+            vaddr += i.length
+        if skipped: logger.verbose("disassemble_range skipped %d bytes"%skipped)
+        return store
 
     # mandatory method PC (needs to be overloaded by each arch-dependent child class)
     def PC(self):
@@ -412,33 +971,71 @@ from collections import defaultdict
 def default_hook(m,**kargs):
     pass
 
+# stubs collects every stub definition and is the fallback used by ext
+# expressions that are not bound to a CPUContext. Each system module also
+# has its own stubs registry (see getstubs) used by CPUContext.
 stubs = defaultdict(lambda :default_hook)
+_modstubs = {}
+ext.stubs = stubs
+
+# returns the stubs registry of the given system module name:
+def getstubs(modname):
+    try:
+        return _modstubs[modname]
+    except KeyError:
+        return _modstubs.setdefault(modname,defaultdict(lambda :default_hook))
 
 # decorators for ext() stub definition:
 
 # decorator to define a stub:
 def stub(f):
     stubs[f.__name__] = f
+    getstubs(f.__module__)[f.__name__] = f
     return f
 
 # decorator to (re)define the default stub:
 def stub_default(f):
     stubs.default_factory = lambda :f
+    getstubs(f.__module__).default_factory = lambda :f
     return f
 
 #------------------------------------------------------------------------------
 from cStringIO import StringIO
+import mmap
 
 class DataIO(object):
 
     def __init__(self, f):
+        self._buffer = None
         if isinstance(f,file):
             self.f=f
         elif isinstance(f,str):
             self.f=StringIO(f)
+            self._buffer = f
         else:
             raise TypeError
 
+    # buffer is the whole data as a read-only mmap of the file (or the
+    # data str itself) so that views can be taken without copying.
+    @property
+    def buffer(self):
+        if self._buffer is None:
+            try:
+                self._buffer = mmap.mmap(self.f.fileno(),0,access=mmap.ACCESS_READ)
+            except (ValueError,EnvironmentError):
+                pos = self.f.tell()
+                self.f.seek(0,0)
+                self._buffer = self.f.read()
+                self.f.seek(pos,0)
+        return self._buffer
+
+    # returns a rawview of size bytes (or up to the end of data) located at
+    # offset, extended with null bytes up to memsize.
+    def view(self,offset=0,size=None,memsize=0):
+        v = rawview(self.buffer,offset,size)
+        if memsize>len(v): v.z += memsize-len(v)
+        return v
+
     def __getitem__(self,i):
         self.f.seek(i.start,0)
         return self.f.read(i.stop-i.start)
@@ -5,6 +5,8 @@
 # published under GPLv2 license
 
 import struct
+from bisect import bisect_right
+from heapq import heappush,heappop
 from amoco.logger import *
 
 logger = Log(__name__)
@@ -25,8 +27,9 @@ class ElfError(Exception):
 class Elfcore(object):
     order = '=' #native order
     pfx = ''
-    def set(self,data):
-        S = struct.unpack(self.order+self.fmt,data)
+    # unpack fields from data buffer at given offset (data is not copied):
+    def set(self,data,offset=0):
+        S = struct.unpack_from(self.order+self.fmt,data,offset)
         self.__dict__.update(zip(self.keys,S))
     def pack(self):
         return struct.pack(self.order+self.fmt,*(getattr(self,k) for k in self.keys))
@@ -232,8 +235,8 @@ class Elf32_Shdr(Elfcore):
         'sh_info',
         'sh_addralign',
         'sh_entsize')
-    def __init__(self,data):
-        self.set(data[:40])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
     def __str__(self):
         if hasattr(self,'name'):
             self.pfx = '%-20s| '% ('<%s>'%self.name)
@@ -270,7 +273,8 @@ SHT_FINI_ARRAY=15
 SHT_PREINIT_ARRAY=16
 SHT_GROUP=17
 SHT_SYMTAB_SHNDX=18
-SHT_NUM=19
+SHT_RELR=19
+SHT_NUM=20
 SHT_LOOS=0x60000000
 SHT_GNU_HASH=0x6ffffff6
 SHT_GNU_LIBLIST=0x6ffffff7
@@ -285,6 +289,7 @@ SHT_GNU_versym=0x6fffffff
 SHT_HISUNW=0x6fffffff
 SHT_HIOS=0x6fffffff
 SHT_LOPROC=0x70000000
+SHT_X86_64_UNWIND=0x70000001
 SHT_HIPROC=0x7fffffff
 SHT_LOUSER=0x80000000
 SHT_HIUSER=0x8fffffff
@@ -320,8 +325,8 @@ class Elf32_Sym(Elfcore):
         'st_info',
         'st_other',
         'st_shndx')
-    def __init__(self,data):
-        self.set(data[:16])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
     def ELF32_ST_BIND(self):
         return self.st_info>>4
     def ELF32_ST_TYPE(self):
@@ -366,8 +371,8 @@ STV_PROTECTED=3
 class Elf32_Rel(Elfcore):
     fmt = 'II'
     keys = ('r_offset','r_info')
-    def __init__(self,data):
-        self.set(data[:8])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
     def ELF32_R_SYM(self):
         return self.r_info>>8
     def ELF32_R_TYPE(self):
@@ -378,8 +383,8 @@ class Elf32_Rel(Elfcore):
 class Elf32_Rela(Elf32_Rel):
     fmt = 'III'
     keys = ('r_offset','r_info','r_addend')
-    def __init__(self,data):
-        self.set(data[:12])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
 
 #Intel 80386 specific definitions. #i386 relocs.
 
@@ -421,6 +426,21 @@ R_386_TLS_DTPOFF32=36
 R_386_TLS_TPOFF32=37
 R_386_NUM=38
 
+#AMD x86-64 relocs.
+
+R_X86_64_NONE=0
+R_X86_64_64=1
+R_X86_64_PC32=2
+R_X86_64_GOT32=3
+R_X86_64_PLT32=4
+R_X86_64_COPY=5
+R_X86_64_GLOB_DAT=6
+R_X86_64_JUMP_SLOT=7
+R_X86_64_RELATIVE=8
+R_X86_64_GOTPCREL=9
+R_X86_64_32=10
+R_X86_64_32S=11
+
 # Program Segment header:
 #------------------------------------------------------------------------------
 class Elf32_Phdr(Elfcore):
@@ -435,8 +455,8 @@ class Elf32_Phdr(Elfcore):
         'p_flags',
         'p_align')
 
-    def __init__(self, data):
-        self.set(data[:32])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
 
 # legal values for p_type (segment type):
 PT_NULL=0
@@ -472,12 +492,13 @@ PF_MASKPROC=0xf0000000
 class Elf32_Note(Elfcore):
     fmt = 'III'
     keys = ('namesz','descsz','type')
-    def __init__(self, data):
-        self.set(data[:12])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
+        # name and desc are aligned relative to the note header:
         p = 12+self.namesz
-        self.name = data[12:p]
+        self.name = data[offset+12:offset+p]
         if p%4<>0: p = ((p+4)/4)*4
-        self.desc = data[p:p+self.descsz]
+        self.desc = data[offset+p:offset+p+self.descsz]
 
 # legal values for note segment descriptor types for core files:
 NT_PRSTATUS=1
@@ -504,8 +525,8 @@ NT_VERSION=1
 class Elf32_Dyn(Elfcore):
     fmt = 'II'
     keys = ('d_tag','d_un')
-    def __init__(self,data):
-        self.set(data[:8])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
     def DT_VALTAGIDX(self,tag) :
         self.d_un = DT_VALRNGHI - tag
     def DT_ADDRTAGIDX(self,tag):
@@ -590,30 +611,245 @@ DT_legal=[eval(v) for v in filter( (lambda s: s.startswith('DT_')), dir())]
 ##
 #------------------------------------------------------------------------------
 
+# DWARF exception handling pointer encodings (.eh_frame, .eh_frame_hdr):
+DW_EH_PE_absptr=0x00
+DW_EH_PE_uleb128=0x01
+DW_EH_PE_udata2=0x02
+DW_EH_PE_udata4=0x03
+DW_EH_PE_udata8=0x04
+DW_EH_PE_sleb128=0x09
+DW_EH_PE_sdata2=0x0a
+DW_EH_PE_sdata4=0x0b
+DW_EH_PE_sdata8=0x0c
+DW_EH_PE_pcrel=0x10
+DW_EH_PE_textrel=0x20
+DW_EH_PE_datarel=0x30
+DW_EH_PE_funcrel=0x40
+DW_EH_PE_aligned=0x50
+DW_EH_PE_indirect=0x80
+DW_EH_PE_omit=0xff
+
+def _uleb128(data,o):
+    v,s = 0,0
+    while True:
+        b = ord(data[o]); o += 1
+        v |= (b&0x7f)<<s
+        s += 7
+        if b<0x80: return (v,o)
+
+def _sleb128(data,o):
+    v,o2 = _uleb128(data,o)
+    s = 7*(o2-o)
+    if v&(1<<(s-1)): v -= (1<<s)
+    return (v,o2)
+
+_EH_FMT = {DW_EH_PE_udata2:'H', DW_EH_PE_udata4:'I', DW_EH_PE_udata8:'Q',
+           DW_EH_PE_sdata2:'h', DW_EH_PE_sdata4:'i', DW_EH_PE_sdata8:'q'}
+
+# returns (value,next offset) of the pointer with encoding enc located at
+# offset o of data, where data is mapped at address addr. Pointers relative
+# to data (datarel) are relative to the .eh_frame_hdr address (drel).
+# Indirect pointers are not dereferenced.
+def _eh_pointer(data,o,enc,addr,wsize,order,drel=0):
+    fmt = enc&0x0f
+    if fmt==DW_EH_PE_uleb128:
+        v,n = _uleb128(data,o)
+    elif fmt==DW_EH_PE_sleb128:
+        v,n = _sleb128(data,o)
+    else:
+        if fmt==DW_EH_PE_absptr: f = 'Q' if wsize==64 else 'I'
+        else                   : f = _EH_FMT.get(fmt,None)
+        if f is None: raise ValueError('invalid pointer encoding %#x'%enc)
+        f = order+f
+        v = struct.unpack_from(f,data,o)[0]
+        n = o+struct.calcsize(f)
+    app = enc&0x70
+    if   app==DW_EH_PE_pcrel  : v += addr+o
+    elif app==DW_EH_PE_datarel: v += drel
+    return (v&((1<<wsize)-1),n)
+
+# returns the pointer encoding of FDEs described by the CIE at offset o:
+def _eh_cie(data,o,wsize,order):
+    l = struct.unpack_from(order+'I',data,o)[0]
+    o += 4
+    if l==0xffffffff: o += 8+8
+    else            : o += 4
+    version = ord(data[o]); o += 1
+    aug = data[o:data.index('\0',o)]
+    o += len(aug)+1
+    if 'eh' in aug: o += wsize/8
+    _,o = _uleb128(data,o) # code alignment
+    _,o = _sleb128(data,o) # data alignment
+    if version==1: o += 1  # return address register
+    else         : _,o = _uleb128(data,o)
+    enc = DW_EH_PE_absptr
+    if aug.startswith('z'):
+        _,o = _uleb128(data,o)
+        for c in aug[1:]:
+            if c=='R':
+                enc = ord(data[o]); o += 1
+            elif c=='P':
+                penc = ord(data[o]); o += 1
+                _,o = _eh_pointer(data,o,penc&0x7f,0,wsize,order)
+            elif c=='L':
+                o += 1
+            elif c not in 'SB':
+                break
+    return enc
+
+# returns the sorted list of initial locations of all FDEs found in the
+# .eh_frame section, using the binary search table of .eh_frame_hdr if
+# present or by walking all .eh_frame entries otherwise.
+def _fdes(elf,wsize):
+    order = elf.Ehdr.order
+    S = dict(((s.name,s) for s in elf.Shdr if s.sh_type!=SHT_NOBITS))
+    if '.eh_frame_hdr' in S:
+        s = S['.eh_frame_hdr']
+        data = elf.sectionview(s)[:]
+        if len(data)>=4 and ord(data[0])==1:
+            fenc,cenc,tenc = ord(data[1]),ord(data[2]),ord(data[3])
+            try:
+                o = 4
+                if fenc!=DW_EH_PE_omit:
+                    _,o = _eh_pointer(data,o,fenc,s.sh_addr,wsize,order)
+                if cenc!=DW_EH_PE_omit and tenc!=DW_EH_PE_omit:
+                    n,o = _eh_pointer(data,o,cenc,s.sh_addr,wsize,order)
+                    if tenc==DW_EH_PE_datarel|DW_EH_PE_sdata4:
+                        T = struct.unpack_from(order+'%di'%(2*n),data,o)
+                        mask = (1<<wsize)-1
+                        return sorted(set(((s.sh_addr+v)&mask for v in T[0::2])))
+                    L = []
+                    for _ in xrange(n):
+                        v,o = _eh_pointer(data,o,tenc,s.sh_addr,wsize,order,s.sh_addr)
+                        _,o = _eh_pointer(data,o,tenc,s.sh_addr,wsize,order,s.sh_addr)
+                        L.append(v)
+                    return sorted(set(L))
+            except (struct.error,IndexError,ValueError):
+                logger.verbose('invalid .eh_frame_hdr table')
+    L = []
+    if '.eh_frame' in S:
+        s = S['.eh_frame']
+        data = elf.sectionview(s)[:]
+        cies = {}
+        o = 0
+        try:
+            while o+4<=len(data):
+                l = struct.unpack_from(order+'I',data,o)[0]
+                if l==0: break
+                if l==0xffffffff:
+                    l = struct.unpack_from(order+'Q',data,o+4)[0]
+                    i = o+12
+                    cid = struct.unpack_from(order+'Q',data,i)[0]
+                    p = i+8
+                else:
+                    i = o+4
+                    cid = struct.unpack_from(order+'I',data,i)[0]
+                    p = i+4
+                if cid!=0:
+                    c = i-cid
+                    if c not in cies: cies[c] = _eh_cie(data,c,wsize,order)
+                    v,_ = _eh_pointer(data,p,cies[c]&0x7f,s.sh_addr,wsize,order)
+                    if v: L.append(v)
+                o = i+l
+        except (struct.error,IndexError,ValueError):
+            logger.verbose('invalid .eh_frame entry at offset %d'%o)
+    return sorted(set(L))
+
+# returns sorted start addresses and associated objects of the disjoint
+# intervals covered by the given (start,end,obj) list of intervals. When
+# several intervals overlap, the last one in the list wins. Gaps are
+# associated with None. Boundaries are swept in order with a heap of the
+# intervals started so far (ended ones are popped when they reach the top.)
+def _intervals(L):
+    B = sorted(set([x[0] for x in L]+[x[1] for x in L]))
+    S = sorted(xrange(len(L)),key=lambda i:L[i][0])
+    starts,objs = [],[]
+    H = []
+    j = 0
+    for b in B:
+        while j<len(S) and L[S[j]][0]<=b:
+            heappush(H,-S[j])
+            j += 1
+        while H and L[-H[0]][1]<=b: heappop(H)
+        w = L[-H[0]][2] if H else None
+        if len(objs)>0 and objs[-1] is w: continue
+        starts.append(b)
+        objs.append(w)
+    return (starts,objs)
+
 class Elf32(object):
 
     basemap   = None
     symtab    = None
     strtab    = None
     reltab    = None
-    functions = None
-    variables = None
 
     @property
     def entrypoints(self):
         return [self.Ehdr.e_entry]
 
+    # section headers, functions and variables are parsed on first access:
+    @property
+    def Shdr(self):
+        if self._Shdr is None:
+            self._Shdr = self.__read_shdr()
+        return self._Shdr
+
+    @property
+    def functions(self):
+        if self._functions is None:
+            self._functions = self.__functions()
+        return self._functions
+
+    @property
+    def variables(self):
+        if self._variables is None:
+            self._variables = self.__variables()
+        return self._variables
+
+    # names of needed libraries and defined dynamic symbols (name -> value)
+    # are parsed on first access:
+    @property
+    def needed(self):
+        if self._needed is None:
+            self._needed = self.__needed()
+        return self._needed
+
+    @property
+    def exports(self):
+        if self._exports is None:
+            self._exports = self.__exports()
+        return self._exports
+
+    # initial locations of .eh_frame FDEs (sorted addresses):
+    @property
+    def fdes(self):
+        if self._fdes is None:
+            self._fdes = _fdes(self,32)
+        return self._fdes
+
     def __init__(self,filename):
+        from amoco.system.core import DataIO
         try:
-            self.__file = file(filename,'rb')
+            self.__file = DataIO(file(filename,'rb'))
         except (TypeError,IOError):
-            from amoco.system.core import DataIO
             self.__file = DataIO(filename)
         data = self.__file.read(52)
         if len(data)<52: data = data.ljust(52,'\x00')
         self.Ehdr   = Elf32_Ehdr(data)
 
         self.dynamic = False
+        self._Shdr = None
+        self._functions = None
+        self._variables = None
+        self._addrindex = None
+        self._names = None
+        self._symindex = None
+        self._needed = None
+        self._exports = None
+        self._fdes = None
+        # parsed tables (symbols, strings, relocs, dynamic) by section:
+        self.__tables = {}
 
         # read program header table: should not raise any errors
         self.Phdr = []
@@ -622,7 +858,7 @@ class Elf32(object):
             n,l = self.Ehdr.e_phnum,self.Ehdr.e_phentsize
             data = self.__file.read(n*l)
             for pht in range(n):
-                self.Phdr.append(Elf32_Phdr(data[pht*l:]))
+                self.Phdr.append(Elf32_Phdr(data,pht*l))
                 if self.Phdr[-1].p_type == PT_LOAD:
                     if not self.basemap: self.basemap = self.Phdr[-1].p_vaddr
                 elif self.Phdr[-1].p_type == PT_DYNAMIC:
@@ -630,40 +866,41 @@ class Elf32(object):
                 elif not self.Phdr[-1].p_type in PT_legal:
                     logger.verbose('invalid segment detected (removed)')
                     self.Phdr.pop()
+    ##
 
-        # read section header table: unused by loader, can raise error
-        self.Shdr = []
+    # read section header table: unused by loader, can raise error
+    def __read_shdr(self):
+        Shdr = []
         if self.Ehdr.e_shoff:
             try:
                 self.__file.seek(self.Ehdr.e_shoff)
                 n,l = self.Ehdr.e_shnum,self.Ehdr.e_shentsize
                 data = self.__file.read(n*l)
                 for sht in range(n):
-                    S = Elf32_Shdr(data[sht*l:])
+                    S = Elf32_Shdr(data,sht*l)
                     if S.sh_type in SHT_legal:
-                        self.Shdr.append(S)
+                        Shdr.append(S)
                     else:
                         raise StandardError
             except :
                 logger.verbose('invalid section detected (all Shdr removed)')
-                self.Shdr = []
+                Shdr = []
 
         # read section's name string table:
         n = self.Ehdr.e_shstrndx
-        if n!=SHN_UNDEF and n in range(len(self.Shdr)):
-            S = self.Shdr[self.Ehdr.e_shstrndx]
+        if n!=SHN_UNDEF and n in range(len(Shdr)):
+            S = Shdr[self.Ehdr.e_shstrndx]
             self.__file.seek(S.sh_offset)
             data = self.__file.read(S.sh_size)
             if S.sh_type!=SHT_STRTAB:
                 logger.verbose('section names not a string table')
-                for s in self.Shdr:
+                for s in Shdr:
                     s.name = ''
             else:
-                for s in self.Shdr:
-                    s.name = data[s.sh_name:].split('\0')[0]
-
-        self.functions = self.__functions()
-        self.variables = self.__variables()
+                for s in Shdr:
+                    e = data.find('\0',s.sh_name)
+                    s.name = data[s.sh_name:e] if e>=0 else data[s.sh_name:]
+        return Shdr
     ##
 
     def getsize(self):
@@ -675,15 +912,14 @@ class Elf32(object):
     # - offset into section  (idem)
     # - base virtual address (0 for dynamic calls)
     # target can be a virtual address in hex string format or integer,
-    # or a symbol string searched in the functions dictionary.
+    # or a symbol string searched in the functions/variables names.
     def getinfo(self,target):
         addr = None
         if isinstance(target,str):
             try:
                 addr = int(target,16)
             except ValueError:
-                for a,f in self.functions.iteritems():
-                    if f[0]==target: addr = int(a,16); break
+                addr = self.names.get(target,None)
         elif type(target) in [int,long]:
             addr = target
         if addr is None:
@@ -694,20 +930,52 @@ class Elf32(object):
         # sections are smaller than segments so we try first with Shdr
         # but this may lead to errors because what really matters are segments
         # loaded by the kernel binfmt_elf.c loader.
-        if self.Shdr:
-            for s in self.Shdr[::-1]:
-                if s.sh_type == SHT_NULL: continue
-                if s.sh_addr <= addr < s.sh_addr+s.sh_size :
-                    return s,addr-s.sh_addr,s.sh_addr
-            ##
-        elif self.Phdr:
-            for s in self.Phdr[::-1]:
-                if s.p_type != PT_LOAD: continue
-                if s.p_vaddr <= addr < s.p_vaddr+s.p_filesz:
-                    return s,addr-s.p_vaddr,s.p_vaddr
+        starts,objs = self.__addrindex()
+        i = bisect_right(starts,addr)-1
+        if i>=0 and objs[i] is not None:
+            s = objs[i]
+            base = s.sh_addr if self.Shdr else s.p_vaddr
+            return s,addr-base,base
         return None,0,0
     ##
 
+    # sorted index of section (or PT_LOAD segment if no section) intervals:
+    def __addrindex(self):
+        if self._addrindex is None:
+            if self.Shdr:
+                L = [(s.sh_addr,s.sh_addr+s.sh_size,s) for s in self.Shdr
+                        if s.sh_type != SHT_NULL]
+            else:
+                L = [(s.p_vaddr,s.p_vaddr+s.p_filesz,s) for s in self.Phdr
+                        if s.p_type == PT_LOAD]
+            self._addrindex = _intervals(L)
+        return self._addrindex
+
+    # names maps function/variable names to their address:
+    @property
+    def names(self):
+        if self._names is None:
+            D = {}
+            for a,x in self.variables.iteritems(): D[x[0]] = a
+            for a,x in self.functions.iteritems():
+                D[x if isinstance(x,str) else x[0]] = a
+            self._names = D
+        return self._names
+
+    # returns (name,offset) of the function/variable located at or just
+    # before address addr, or None if there is no such symbol.
+    def getsymbol(self,addr):
+        if self._symindex is None:
+            D = dict(self.variables)
+            D.update(self.functions)
+            A = sorted(D.iterkeys())
+            self._symindex = (A,[D[a] for a in A])
+        A,X = self._symindex
+        i = bisect_right(A,addr)-1
+        if i<0: return None
+        x = X[i]
+        return (x if isinstance(x,str) else x[0], addr-A[i])
+
     def data(self,target,size):
         return self.readcode(target,size)[0]
 
@@ -730,25 +998,26 @@ class Elf32(object):
     def readsegment(self,S):
         if S:
             if S.p_type==PT_LOAD:
-                self.__file.seek(S.p_offset)
-                return self.__file.read(S.p_filesz).ljust(S.p_memsz,'\x00')
+                return self.__file.view(S.p_offset,S.p_filesz,S.p_memsz)
         return None
     ##
     def loadsegment(self,S,pagesize=None):
         if S:
             if S.p_type==PT_LOAD:
-                self.__file.seek( S.p_offset )
                 if S.p_offset != (S.p_vaddr%S.p_align):
                     logger.verbose('wrong p_vaddr/p_align [%08x/%0d]'%(S.p_vaddr,S.p_align))
                 base = S.p_vaddr
-                bytes = self.__file.read( S.p_filesz ).ljust(S.p_memsz,'\x00')
-                if pagesize:
-                    # note: bytes are not truncated, only extended if needed...
-                    bytes = bytes.ljust(pagesize,'\x00')
+                # note: bytes are not truncated, only extended if needed...
+                bytes = self.__file.view(S.p_offset,S.p_filesz,
+                                         max(S.p_memsz,pagesize or 0))
                 return {base:bytes}
         return None
     ##
 
+    # returns a (zero-copy) rawview of the file data of section S:
+    def sectionview(self,S):
+        return self.__file.view(S.sh_offset,S.sh_size)
+
     def readsection(self,sect):
         S = None
         if type(sect)==str:
@@ -775,18 +1044,19 @@ class Elf32(object):
         if section.sh_type!=SHT_SYMTAB and section.sh_type!=SHT_DYNSYM :
             logger.warning('not a symbol table section')
             return None
-        # read the section:
-        self.__file.seek(section.sh_offset)
-        data = self.__file.read(section.sh_size)
-        # and parse it into Elf32_Sym objects:
-        l = section.sh_entsize
-        if (section.sh_size%l)!=0:
-            raise ElfError('symbol table size mismatch')
-        else:
-            n = section.sh_size/l
-        symtab = []
-        for i in range(n):
-            symtab.append( Elf32_Sym(data[i*l:]) )
+        symtab = self.__tables.get(section,None)
+        if symtab is None:
+            # entries are unpacked directly from the file buffer:
+            data = self.__file.buffer
+            o = section.sh_offset
+            # and parse it into Elf32_Sym objects:
+            l = section.sh_entsize
+            if (section.sh_size%l)!=0:
+                raise ElfError('symbol table size mismatch')
+            else:
+                n = section.sh_size/l
+            symtab = [Elf32_Sym(data,o+i*l) for i in xrange(n)]
+            self.__tables[section] = symtab
         self.symtab = symtab
         return symtab
     ##
@@ -794,9 +1064,12 @@ class Elf32(object):
     def __read_strtab(self,section):
         if section.sh_type!=SHT_STRTAB:
             raise ElfError('not a string table section')
-        self.__file.seek(section.sh_offset)
-        data = self.__file.read(section.sh_size)
-        strtab = Elf32_Str(data)
+        strtab = self.__tables.get(section,None)
+        if strtab is None:
+            self.__file.seek(section.sh_offset)
+            data = self.__file.read(section.sh_size)
+            strtab = Elf32_Str(data)
+            self.__tables[section] = strtab
         self.strtab = strtab
         return strtab
     ##
@@ -806,20 +1079,19 @@ class Elf32(object):
         and section.sh_type!=SHT_RELA :
             logger.warning('not a relocation table section')
             return None
-        self.__file.seek(section.sh_offset)
-        data = self.__file.read(section.sh_size)
-        l = section.sh_entsize
-        if (section.sh_size%l)!=0:
-            raise ElfError('relocation table size mismatch')
-        else:
-            n = section.sh_size/l
-        reltab = []
-        if   section.sh_type==SHT_REL:
-            for i in range(n):
-                reltab.append( Elf32_Rel(data[i*l:]) )
-        elif section.sh_type==SHT_RELA:
-            for i in range(n):
-                reltab.append( Elf32_Rela(data[i*l:]) )
+        reltab = self.__tables.get(section,None)
+        if reltab is None:
+            data = self.__file.buffer
+            o = section.sh_offset
+            l = section.sh_entsize
+            if (section.sh_size%l)!=0:
+                raise ElfError('relocation table size mismatch')
+            else:
+                n = section.sh_size/l
+            if section.sh_type==SHT_REL: E = Elf32_Rel
+            else                       : E = Elf32_Rela
+            reltab = [E(data,o+i*l) for i in xrange(n)]
+            self.__tables[section] = reltab
         self.reltab = reltab
         return reltab
 
@@ -827,18 +1099,19 @@ class Elf32(object):
         if section.sh_type!=SHT_DYNAMIC :
             logger.warning('not a dynamic linking section')
             return None
-        # read the section:
-        self.__file.seek(section.sh_offset)
-        data = self.__file.read(section.sh_size)
-        # and parse it into Elf32_Dyn objects:
-        l = section.sh_entsize
-        if (section.sh_size%l)!=0:
-            raise ElfError('dynamic linking size mismatch')
-        else:
-            n = section.sh_size/l
-        dyntab = []
-        for i in range(n):
-            dyntab.append( Elf32_Dyn(data[i*l:]) )
+        dyntab = self.__tables.get(section,None)
+        if dyntab is None:
+            # entries are unpacked directly from the file buffer:
+            data = self.__file.buffer
+            o = section.sh_offset
+            # and parse it into Elf32_Dyn objects:
+            l = section.sh_entsize
+            if (section.sh_size%l)!=0:
+                raise ElfError('dynamic linking size mismatch')
+            else:
+                n = section.sh_size/l
+            dyntab = [Elf32_Dyn(data,o+i*l) for i in xrange(n)]
+            self.__tables[section] = dyntab
         self.dyntab = dyntab
         return dyntab
     ##
@@ -896,7 +1169,9 @@ class Elf32(object):
                 or s.sh_type == SHT_RELA :
                     if self.readsection(i):
                         for r in self.reltab:
-                            if r.r_offset:
+                            # relocations without symbol (RELATIVE) are
+                            # not slots, they are left raw (see reloc):
+                            if r.r_offset and r.ELF32_R_SYM():
                                 sym = self.symtab[ r.ELF32_R_SYM() ]
                                 D[r.r_offset] = self.strtab[sym.st_name]
         else:
@@ -904,6 +1179,30 @@ class Elf32(object):
             pass #TODO
         return D
 
+    def __needed(self):
+        L = []
+        for s in self.Shdr:
+            if s.sh_type==SHT_DYNAMIC:
+                dyntab = self.readsection(s)
+                strtab = self.readsection(s.sh_link)
+                if dyntab and strtab:
+                    for d in dyntab:
+                        if d.d_tag==DT_NEEDED: L.append(strtab[d.d_un])
+        return L
+
+    def __exports(self):
+        D = {}
+        for s in self.Shdr:
+            if s.sh_type==SHT_DYNSYM:
+                symtab = self.readsection(s)
+                strtab = self.readsection(s.sh_link)
+                if symtab and strtab:
+                    for sym in symtab:
+                        if sym.st_shndx!=SHN_UNDEF and sym.st_value and \
+                           sym.ELF32_ST_BIND()!=STB_LOCAL:
+                            D.setdefault(strtab[sym.st_name],sym.st_value)
+        return D
+
     def __str__(self):
         ss = ['ELF header:']
         tmp = self.Ehdr.pfx
@@ -936,8 +1235,8 @@ class Elf32_Str:
         self.data = data
 
     def __getitem__(self,i):
-        z = self.data[i:].index('\0')
-        return self.data[i:i+z]
+        z = self.data.index('\0',i)
+        return self.data[i:z]
 
     def as_dict(self):
         D = {}
@@ -1017,8 +1316,8 @@ class Elf64_Shdr(Elfcore):
         'sh_info',
         'sh_addralign',
         'sh_entsize')
-    def __init__(self,data):
-        self.set(data[:struct.calcsize(self.fmt)])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
     def __str__(self):
         if hasattr(self,'name'):
             self.pfx = '%-20s| '% ('<%s>'%self.name)
@@ -1035,8 +1334,8 @@ class Elf64_Sym(Elfcore):
         'st_shndx',
         'st_value',
         'st_size')
-    def __init__(self,data):
-        self.set(data[:struct.calcsize(self.fmt)])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
     def ELF64_ST_BIND(self):
         return self.st_info>>4
     def ELF64_ST_TYPE(self):
@@ -1051,8 +1350,8 @@ class Elf64_Sym(Elfcore):
 class Elf64_Rel(Elfcore):
     fmt = 'QQ'
     keys = ('r_offset','r_info')
-    def __init__(self,data):
-        self.set(data[:struct.calcsize(self.fmt)])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
     def ELF64_R_SYM(self):
         return self.r_info>>32
     def ELF64_R_TYPE(self):
@@ -1063,8 +1362,8 @@ class Elf64_Rel(Elfcore):
 class Elf64_Rela(Elf64_Rel):
     fmt = 'QQQ'
     keys = ('r_offset','r_info','r_addend')
-    def __init__(self,data):
-        self.set(data[:struct.calcsize(self.fmt)])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
 
 # Program Segment header:
 #------------------------------------------------------------------------------
@@ -1080,29 +1379,30 @@ class Elf64_Phdr(Elfcore):
         'p_memsz',
         'p_align')
 
-    def __init__(self, data):
-        self.set(data[:struct.calcsize(self.fmt)])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
 
 # Note Sections :
 #------------------------------------------------------------------------------
 class Elf64_Note(Elfcore):
     fmt = 'QQQ'
     keys = ('namesz','descsz','type')
-    def __init__(self, data):
+    def __init__(self,data,offset=0):
         l = struct.calcsize(self.fmt)
-        self.set(data[:l])
+        self.set(data,offset)
+        # name and desc are aligned relative to the note header:
         p = l+self.namesz
-        self.name = data[l:p]
+        self.name = data[offset+l:offset+p]
         if p%8: p = ((p+8)/8)*8
-        self.desc = data[p:p+self.descsz]
+        self.desc = data[offset+p:offset+p+self.descsz]
 
 # Dynamic Section:
 #------------------------------------------------------------------------------
 class Elf64_Dyn(Elfcore):
     fmt = 'QQ'
     keys = ('d_tag','d_un')
-    def __init__(self,data):
-        self.set(data[:struct.calcsize(self.fmt)])
+    def __init__(self,data,offset=0):
+        self.set(data,offset)
     def DT_VALTAGIDX(self,tag) :
         self.d_un = DT_VALRNGHI - tag
     def DT_ADDRTAGIDX(self,tag):
@@ -1120,24 +1420,73 @@ class Elf64(object):
     symtab    = None
     strtab    = None
     reltab    = None
-    functions = None
-    variables = None
 
     @property
     def entrypoints(self):
         return [self.Ehdr.e_entry]
 
+    # section headers, functions and variables are parsed on first access:
+    @property
+    def Shdr(self):
+        if self._Shdr is None:
+            self._Shdr = self.__read_shdr()
+        return self._Shdr
+
+    @property
+    def functions(self):
+        if self._functions is None:
+            self._functions = self.__functions()
+        return self._functions
+
+    @property
+    def variables(self):
+        if self._variables is None:
+            self._variables = self.__variables()
+        return self._variables
+
+    # names of needed libraries and defined dynamic symbols (name -> value)
+    # are parsed on first access:
+    @property
+    def needed(self):
+        if self._needed is None:
+            self._needed = self.__needed()
+        return self._needed
+
+    @property
+    def exports(self):
+        if self._exports is None:
+            self._exports = self.__exports()
+        return self._exports
+
+    # initial locations of .eh_frame FDEs (sorted addresses):
+    @property
+    def fdes(self):
+        if self._fdes is None:
+            self._fdes = _fdes(self,64)
+        return self._fdes
+
     def __init__(self,filename):
+        from amoco.system.core import DataIO
         try:
-            self.__file = file(filename,'rb')
+            self.__file = DataIO(file(filename,'rb'))
         except (TypeError,IOError):
-            from amoco.system.core import DataIO
             self.__file = DataIO(filename)
         data = self.__file.read(64)
         if len(data)<64: data = data.ljust(64,'\x00')
         self.Ehdr   = Elf64_Ehdr(data)
 
         self.dynamic = False
+        self._Shdr = None
+        self._functions = None
+        self._variables = None
+        self._addrindex = None
+        self._names = None
+        self._symindex = None
+        self._needed = None
+        self._exports = None
+        self._fdes = None
+        # parsed tables (symbols, strings, relocs, dynamic) by section:
+        self.__tables = {}
 
         # read program header table: should not raise any errors
         self.Phdr = []
@@ -1146,7 +1495,7 @@ class Elf64(object):
             n,l = self.Ehdr.e_phnum,self.Ehdr.e_phentsize
             data = self.__file.read(n*l)
             for pht in range(n):
-                self.Phdr.append(Elf64_Phdr(data[pht*l:]))
+                self.Phdr.append(Elf64_Phdr(data,pht*l))
                 if self.Phdr[-1].p_type == PT_LOAD:
                     if not self.basemap: self.basemap = self.Phdr[-1].p_vaddr
                 elif self.Phdr[-1].p_type == PT_DYNAMIC:
@@ -1154,40 +1503,41 @@ class Elf64(object):
                 elif not self.Phdr[-1].p_type in PT_legal:
                     logger.verbose('invalid segment detected (removed)')
                     self.Phdr.pop()
+    ##
 
-        # read section header table: unused by loader, can raise error
-        self.Shdr = []
+    # read section header table: unused by loader, can raise error
+    def __read_shdr(self):
+        Shdr = []
         if self.Ehdr.e_shoff:
             try:
                 self.__file.seek(self.Ehdr.e_shoff)
                 n,l = self.Ehdr.e_shnum,self.Ehdr.e_shentsize
                 data = self.__file.read(n*l)
                 for sht in range(n):
-                    S = Elf64_Shdr(data[sht*l:])
+                    S = Elf64_Shdr(data,sht*l)
                     if S.sh_type in SHT_legal:
-                        self.Shdr.append(S)
+                        Shdr.append(S)
                     else:
                         raise StandardError
             except :
                 logger.verbose('invalid section detected (all Shdr removed)')
-                self.Shdr = []
+                Shdr = []
 
         # read section's name string table:
         n = self.Ehdr.e_shstrndx
-        if n!=SHN_UNDEF and n in range(len(self.Shdr)):
-            S = self.Shdr[self.Ehdr.e_shstrndx]
+        if n!=SHN_UNDEF and n in range(len(Shdr)):
+            S = Shdr[self.Ehdr.e_shstrndx]
             self.__file.seek(S.sh_offset)
             data = self.__file.read(S.sh_size)
             if S.sh_type!=SHT_STRTAB:
                 logger.verbose('section names not a string table')
-                for s in self.Shdr:
+                for s in Shdr:
                     s.name = ''
             else:
-                for s in self.Shdr:
-                    s.name = data[s.sh_name:].split('\0')[0]
-
-        self.functions = self.__functions()
-        self.variables = self.__variables()
+                for s in Shdr:
+                    e = data.find('\0',s.sh_name)
+                    s.name = data[s.sh_name:e] if e>=0 else data[s.sh_name:]
+        return Shdr
     ##
 
     def getsize(self):
@@ -1199,15 +1549,14 @@ class Elf64(object):
     # - offset into section  (idem)
     # - base virtual address (0 for dynamic calls)
     # target can be a virtual address in hex string format or integer,
-    # or a symbol string searched in the functions dictionary.
+    # or a symbol string searched in the functions/variables names.
     def getinfo(self,target):
         addr = None
         if isinstance(target,str):
             try:
                 addr = int(target,16)
             except ValueError:
-                for a,f in self.functions.iteritems():
-                    if f[0]==target: addr = int(a,16); break
+                addr = self.names.get(target,None)
         elif type(target) in [int,long]:
             addr = target
         if addr is None:
@@ -1218,20 +1567,52 @@ class Elf64(object):
         # sections are smaller than segments so we try first with Shdr
         # but this may lead to errors because what really matters are segments
         # loaded by the kernel binfmt_elf.c loader.
-        if self.Shdr:
-            for s in self.Shdr[::-1]:
-                if s.sh_type == SHT_NULL: continue
-                if s.sh_addr <= addr < s.sh_addr+s.sh_size :
-                    return s,addr-s.sh_addr,s.sh_addr
-            ##
-        elif self.Phdr:
-            for s in self.Phdr[::-1]:
-                if s.p_type != PT_LOAD: continue
-                if s.p_vaddr <= addr < s.p_vaddr+s.p_filesz:
-                    return s,addr-s.p_vaddr,s.p_vaddr
+        starts,objs = self.__addrindex()
+        i = bisect_right(starts,addr)-1
+        if i>=0 and objs[i] is not None:
+            s = objs[i]
+            base = s.sh_addr if self.Shdr else s.p_vaddr
+            return s,addr-base,base
         return None,0,0
     ##
 
+    # sorted index of section (or PT_LOAD segment if no section) intervals:
+    def __addrindex(self):
+        if self._addrindex is None:
+            if self.Shdr:
+                L = [(s.sh_addr,s.sh_addr+s.sh_size,s) for s in self.Shdr
+                        if s.sh_type != SHT_NULL]
+            else:
+                L = [(s.p_vaddr,s.p_vaddr+s.p_filesz,s) for s in self.Phdr
+                        if s.p_type == PT_LOAD]
+            self._addrindex = _intervals(L)
+        return self._addrindex
+
+    # names maps function/variable names to their address:
+    @property
+    def names(self):
+        if self._names is None:
+            D = {}
+            for a,x in self.variables.iteritems(): D[x[0]] = a
+            for a,x in self.functions.iteritems():
+                D[x if isinstance(x,str) else x[0]] = a
+            self._names = D
+        return self._names
+
+    # returns (name,offset) of the function/variable located at or just
+    # before address addr, or None if there is no such symbol.
+    def getsymbol(self,addr):
+        if self._symindex is None:
+            D = dict(self.variables)
+            D.update(self.functions)
+            A = sorted(D.iterkeys())
+            self._symindex = (A,[D[a] for a in A])
+        A,X = self._symindex
+        i = bisect_right(A,addr)-1
+        if i<0: return None
+        x = X[i]
+        return (x if isinstance(x,str) else x[0], addr-A[i])
+
     def data(self,target,size):
         return self.readcode(target,size)[0]
 
@@ -1254,25 +1635,26 @@ class Elf64(object):
     def readsegment(self,S):
         if S:
             if S.p_type==PT_LOAD:
-                self.__file.seek(S.p_offset)
-                return self.__file.read(S.p_filesz).ljust(S.p_memsz,'\x00')
+                return self.__file.view(S.p_offset,S.p_filesz,S.p_memsz)
         return None
     ##
     def loadsegment(self,S,pagesize=None):
         if S:
             if S.p_type==PT_LOAD:
-                self.__file.seek( S.p_offset )
                 if S.p_offset != (S.p_vaddr%S.p_align):
                     logger.verbose("wrong p_vaddr/p_align [%08x/%0d]"%(S.p_vaddr,S.p_align))
                 base = S.p_vaddr
-                bytes = self.__file.read( S.p_filesz ).ljust(S.p_memsz,'\x00')
-                if pagesize:
-                    # note: bytes are not truncated, only extended if needed...
-                    bytes = bytes.ljust(pagesize,'\x00')
+                # note: bytes are not truncated, only extended if needed...
+                bytes = self.__file.view(S.p_offset,S.p_filesz,
+                                         max(S.p_memsz,pagesize or 0))
                 return {base:bytes}
         return None
     ##
 
+    # returns a (zero-copy) rawview of the file data of section S:
+    def sectionview(self,S):
+        return self.__file.view(S.sh_offset,S.sh_size)
+
     def readsection(self,sect):
         S = None
         if type(sect)==str:
@@ -1299,18 +1681,19 @@ class Elf64(object):
         if section.sh_type!=SHT_SYMTAB and section.sh_type!=SHT_DYNSYM :
             logger.warning('not a symbol table section')
             return None
-        # read the section:
-        self.__file.seek(section.sh_offset)
-        data = self.__file.read(section.sh_size)
-        # and parse it into Elf64_Sym objects:
-        l = section.sh_entsize
-        if (section.sh_size%l)!=0:
-            raise ElfError('symbol table size mismatch')
-        else:
-            n = section.sh_size/l
-        symtab = []
-        for i in range(n):
-            symtab.append( Elf64_Sym(data[i*l:]) )
+        symtab = self.__tables.get(section,None)
+        if symtab is None:
+            # entries are unpacked directly from the file buffer:
+            data = self.__file.buffer
+            o = section.sh_offset
+            # and parse it into Elf64_Sym objects:
+            l = section.sh_entsize
+            if (section.sh_size%l)!=0:
+                raise ElfError('symbol table size mismatch')
+            else:
+                n = section.sh_size/l
+            symtab = [Elf64_Sym(data,o+i*l) for i in xrange(n)]
+            self.__tables[section] = symtab
         self.symtab = symtab
         return symtab
     ##
@@ -1318,9 +1701,12 @@ class Elf64(object):
     def __read_strtab(self,section):
         if section.sh_type!=SHT_STRTAB:
             raise ElfError('not a string table section')
-        self.__file.seek(section.sh_offset)
-        data = self.__file.read(section.sh_size)
-        strtab = Elf64_Str(data)
+        strtab = self.__tables.get(section,None)
+        if strtab is None:
+            self.__file.seek(section.sh_offset)
+            data = self.__file.read(section.sh_size)
+            strtab = Elf64_Str(data)
+            self.__tables[section] = strtab
         self.strtab = strtab
         return strtab
     ##
@@ -1330,20 +1716,19 @@ class Elf64(object):
         and section.sh_type!=SHT_RELA :
             logger.warning('not a relocation table section')
             return None
-        self.__file.seek(section.sh_offset)
-        data = self.__file.read(section.sh_size)
-        l = section.sh_entsize
-        if (section.sh_size%l)!=0:
-            raise ElfError('relocation table size mismatch')
-        else:
-            n = section.sh_size/l
-        reltab = []
-        if   section.sh_type==SHT_REL:
-            for i in range(n):
-                reltab.append( Elf64_Rel(data[i*l:]) )
-        elif section.sh_type==SHT_RELA:
-            for i in range(n):
-                reltab.append( Elf64_Rela(data[i*l:]) )
+        reltab = self.__tables.get(section,None)
+        if reltab is None:
+            data = self.__file.buffer
+            o = section.sh_offset
+            l = section.sh_entsize
+            if (section.sh_size%l)!=0:
+                raise ElfError('relocation table size mismatch')
+            else:
+                n = section.sh_size/l
+            if section.sh_type==SHT_REL: E = Elf64_Rel
+            else                       : E = Elf64_Rela
+            reltab = [E(data,o+i*l) for i in xrange(n)]
+            self.__tables[section] = reltab
         self.reltab = reltab
         return reltab
 
@@ -1351,18 +1736,19 @@ class Elf64(object):
         if section.sh_type!=SHT_DYNAMIC :
             logger.warning('not a dynamic linking section')
             return None
-        # read the section:
-        self.__file.seek(section.sh_offset)
-        data = self.__file.read(section.sh_size)
-        # and parse it into Elf32_Dyn objects:
-        l = section.sh_entsize
-        if (section.sh_size%l)!=0:
-            raise ElfError('dynamic linking size mismatch')
-        else:
-            n = section.sh_size/l
-        dyntab = []
-        for i in range(n):
-            dyntab.append( Elf64_Dyn(data[i*l:]) )
+        dyntab = self.__tables.get(section,None)
+        if dyntab is None:
+            # entries are unpacked directly from the file buffer:
+            data = self.__file.buffer
+            o = section.sh_offset
+            # and parse it into Elf32_Dyn objects:
+            l = section.sh_entsize
+            if (section.sh_size%l)!=0:
+                raise ElfError('dynamic linking size mismatch')
+            else:
+                n = section.sh_size/l
+            dyntab = [Elf64_Dyn(data,o+i*l) for i in xrange(n)]
+            self.__tables[section] = dyntab
         self.dyntab = dyntab
         return dyntab
     ##
@@ -1420,7 +1806,9 @@ class Elf64(object):
                 or s.sh_type == SHT_RELA :
                     if self.readsection(i):
                         for r in self.reltab:
-                            if r.r_offset:
+                            # relocations without symbol (RELATIVE) are
+                            # not slots, they are left raw (see reloc):
+                            if r.r_offset and r.ELF64_R_SYM():
                                 sym = self.symtab[ r.ELF64_R_SYM() ]
                                 D[r.r_offset] = self.strtab[sym.st_name]
         else:
@@ -1428,6 +1816,30 @@ class Elf64(object):
             pass #TODO
         return D
 
+    def __needed(self):
+        L = []
+        for s in self.Shdr:
+            if s.sh_type==SHT_DYNAMIC:
+                dyntab = self.readsection(s)
+                strtab = self.readsection(s.sh_link)
+                if dyntab and strtab:
+                    for d in dyntab:
+                        if d.d_tag==DT_NEEDED: L.append(strtab[d.d_un])
+        return L
+
+    def __exports(self):
+        D = {}
+        for s in self.Shdr:
+            if s.sh_type==SHT_DYNSYM:
+                symtab = self.readsection(s)
+                strtab = self.readsection(s.sh_link)
+                if symtab and strtab:
+                    for sym in symtab:
+                        if sym.st_shndx!=SHN_UNDEF and sym.st_value and \
+                           sym.ELF64_ST_BIND()!=STB_LOCAL:
+                            D.setdefault(strtab[sym.st_name],sym.st_value)
+        return D
+
     def __str__(self):
         ss = ['ELF header:']
         tmp = self.Ehdr.pfx
@@ -1460,8 +1872,8 @@ class Elf64_Str:
         self.data = data
 
     def __getitem__(self,i):
-        z = self.data[i:].index('\0')
-        return self.data[i:i+z]
+        z = self.data.index('\0',i)
+        return self.data[i:z]
 
     def as_dict(self):
         D = {}
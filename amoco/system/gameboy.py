@@ -103,7 +103,7 @@ class z80GB(object):
 
     def __init__(self,path):
         self.card = Cardridge(path)
-        self.cpu  = cpu
+        self.cpu  = CPUContext(cpu)
         self.mmap = MemoryMap()
         self.load_binary()
 
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+# This code is part of Amoco
+# Copyright (C) 2006-2011 Axel Tillequin (bdcht3@gmail.com)
+# published under GPLv2 license
+
+from amoco.logger import *
+logger = Log(__name__)
+
+import struct
+import mmap
+import gc
+import importlib
+import cPickle
+from cStringIO import StringIO
+from bisect import bisect_right
+
+from amoco.system.core import mo,rawview,ZoneMap,MemoryZone,MemoryMap
+from amoco.system.core import DecodeCache
+
+PAGESIZE = 4096
+
+#------------------------------------------------------------------------------
+# Image file format:
+#   - a header page with MAGIC, VERSION and the (offset,size) of the two
+#     pickles located at the end of the file,
+#   - the raw bytes of every raw obj of the MemoryMap, each one starting on a
+#     page boundary so that they are viewed directly from the mmapped file,
+#   - the info pickle: dict with
+#       'system' : (module,class) of the CoreExec,
+#       'cpu'    : name of its cpu module (or None),
+#       'bin'    : entrypoints, functions, variables and link-time extent
+#                  of the program,
+#       'imagebase' : address of the relocated image (see CoreExec.relocate),
+#   - the zones pickle: (perms,zones) where zones is a list of
+#     (label,[(vaddr,value)]) and value is either ('raw',offset,size,zeros)
+#     or ('exp',expression).
+# Expressions are pickled except ext stubs and registers of the cpu module
+# that are rebuilt (from their names) with the cpu of the loaded CoreExec.
+#------------------------------------------------------------------------------
+MAGIC = 'AMOCOIMG'
+VERSION = 2
+HEADER = '<8sIQQQQ'
+
+#------------------------------------------------------------------------------
+# Image replaces the program (bin) of a loaded CoreExec: it provides the
+# entrypoints and functions/variables dicts of the saved program, and the
+# link-time [lo,hi[ range of its image (see reloc.extent).
+#------------------------------------------------------------------------------
+class Image(object):
+
+    def __init__(self,entrypoints=None,functions=None,variables=None,
+                 extent=None):
+        self.entrypoints = entrypoints or []
+        self.functions = functions or {}
+        self.variables = variables or {}
+        self.extent = extent or (0,0)
+        self._names = None
+        self._symindex = None
+
+    # names maps function/variable names to their address:
+    @property
+    def names(self):
+        if self._names is None:
+            D = {}
+            for a,x in self.variables.iteritems(): D[x[0]] = a
+            for a,x in self.functions.iteritems():
+                D[x if isinstance(x,str) else x[0]] = a
+            self._names = D
+        return self._names
+
+    # returns (name,offset) of the function/variable located at or just
+    # before address addr, or None if there is no such symbol.
+    def getsymbol(self,addr):
+        if self._symindex is None:
+            D = dict(self.variables)
+            D.update(self.functions)
+            A = sorted(D.iterkeys())
+            self._symindex = (A,[D[a] for a in A])
+        A,X = self._symindex
+        i = bisect_right(A,addr)-1
+        if i<0: return None
+        x = X[i]
+        return (x if isinstance(x,str) else x[0], addr-A[i])
+
+def _pad(f):
+    p = f.tell()%PAGESIZE
+    if p: f.write('\0'*(PAGESIZE-p))
+
+def _writeraw(f,v):
+    _pad(f)
+    o = f.tell()
+    if isinstance(v,rawview):
+        src,sta,l,z = v.src,v.o,v.l,v.z
+    else:
+        src,sta,l,z = v,0,len(v),0
+    # large views are copied by chunks:
+    for i in xrange(sta,sta+l,1<<20):
+        f.write(str(src[i:min(i+(1<<20),sta+l)]))
+    return ('raw',o,l,z)
+
+def _dump(f,obj,persistent_id=None):
+    o = f.tell()
+    pickler = cPickle.Pickler(f,cPickle.HIGHEST_PROTOCOL)
+    if persistent_id is not None: pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+    return (o,f.tell()-o)
+
+# writes CoreExec x (its MemoryMap and program info) in image file path:
+def save_image(x,path):
+    from amoco.system.reloc import extent
+    cpu = x.cpu.module if x.cpu is not None else None
+    def persistent_id(obj):
+        if getattr(obj,'_is_ext',False):
+            return ('ext',obj.ref,obj._subrefs)
+        if getattr(obj,'_is_reg',False) and cpu is not None and \
+           getattr(cpu,str(getattr(obj,'ref','')),None) is obj:
+            return ('reg',obj.ref)
+        return None
+    p = x.bin
+    info = {'system': (x.__class__.__module__,x.__class__.__name__),
+            'cpu'   : cpu.__name__ if cpu is not None else None,
+            'bin'   : {'entrypoints': list(getattr(p,'entrypoints',[])),
+                       'functions'  : dict(getattr(p,'functions',{})),
+                       'variables'  : dict(getattr(p,'variables',{})),
+                       'extent'     : extent(p)},
+            'imagebase': getattr(x,'_imagebase',None)}
+    with open(path,'wb') as f:
+        f.write('\0'*PAGESIZE)
+        zones = []
+        for label,z in x.mmap._zones.iteritems():
+            Z = []
+            for m in z._map:
+                v = m.data.val
+                if m.data._is_raw: Z.append((m.vaddr,_writeraw(f,v)))
+                else             : Z.append((m.vaddr,('exp',v)))
+            zones.append((label,Z))
+        _pad(f)
+        i = _dump(f,info)
+        z = _dump(f,(x.mmap.perms,zones),persistent_id)
+        f.seek(0)
+        f.write(struct.pack(HEADER,MAGIC,VERSION,i[0],i[1],z[0],z[1]))
+
+# returns the CoreExec saved in image file path. Raw bytes are not read:
+# objs of the MemoryMap are views of the mmapped file.
+def load_image(path):
+    # lots of objects are created (and none is garbage) so the cyclic gc is
+    # disabled while loading:
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _load_image(path)
+    finally:
+        if enabled: gc.enable()
+
+def _load_image(path):
+    with open(path,'rb') as f:
+        data = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+    magic,version,io,isz,zo,zsz = struct.unpack_from(HEADER,data,0)
+    if magic!=MAGIC or version!=VERSION:
+        logger.error('%s is not an amoco image (version %d)'%(path,VERSION))
+        raise ValueError(path)
+    info = cPickle.loads(data[io:io+isz])
+    # the CoreExec is created without loading any program:
+    module,name = info['system']
+    cls = getattr(importlib.import_module(module),name)
+    x = cls.__new__(cls)
+    x.bin = Image(**info['bin'])
+    if info['imagebase'] is not None: x._imagebase = info['imagebase']
+    x.cpu = None
+    if info['cpu'] is not None:
+        x.cpu = x.newcontext(importlib.import_module(info['cpu']))
+    x.icache = DecodeCache()
+    # ext stubs are shared by all slots of the same symbol:
+    stubs = {}
+    def persistent_load(pid):
+        if pid[0]=='ext':
+            k = (pid[1],tuple(sorted(pid[2].iteritems())))
+            e = stubs.get(k,None)
+            if e is None: e = stubs[k] = x.cpu.ext(pid[1],**pid[2])
+            return e
+        if pid[0]=='reg': return getattr(x.cpu.module,pid[1])
+        raise cPickle.UnpicklingError('invalid persistent id %s'%str(pid))
+    unpickler = cPickle.Unpickler(StringIO(data[zo:zo+zsz]))
+    unpickler.persistent_load = persistent_load
+    perms,zones = unpickler.load()
+    x.mmap = MemoryMap()
+    x.mmap.perms = perms
+    for label,Z in zones:
+        L = []
+        for vaddr,v in Z:
+            if v[0]=='raw': L.append(mo(vaddr,rawview(data,v[1],v[2],v[3])))
+            else          : L.append(mo(vaddr,v[1]))
+        z = MemoryZone(label)
+        z._map = ZoneMap(L)
+        x.mmap._zones[label] = z
+    return x
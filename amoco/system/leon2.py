@@ -34,7 +34,7 @@ class ELF(CoreExec):
     # for now, the external libs are seen through the elf dynamic section:
     def load_shlib(self):
         for k,f in self.bin._Elf32__dynamic(None).iteritems():
-            self.mmap.write(k,cpu.ext(f))
+            self.mmap.write(k,self.cpu.ext(f))
 
     def initenv(self):
         from amoco.cas.mapper import mapper
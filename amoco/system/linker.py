@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+# This code is part of Amoco
+# Copyright (C) 2006-2011 Axel Tillequin (bdcht3@gmail.com)
+# published under GPLv2 license
+
+from amoco.logger import *
+logger = Log(__name__)
+
+import os
+import hashlib
+import cPickle
+
+from amoco.config import conf
+from amoco.system.core import DataIO
+from amoco.system import elf
+from amoco.system import pe
+from amoco.system.reloc import getrelocs
+
+PAGESIZE = 4096
+# version of the imageinfo dicts stored in the library cache:
+VERSION = 2
+# alignment of the bases chosen for the libraries:
+ALIGN = 0x10000
+
+# directories searched (in order) below the sysroot:
+LIBPATH = ('lib','usr/lib',
+           'lib32','usr/lib32','lib/i386-linux-gnu','usr/lib/i386-linux-gnu',
+           'lib64','usr/lib64','lib/x86_64-linux-gnu','usr/lib/x86_64-linux-gnu',
+           'Windows/SysWOW64','Windows/System32')
+
+#------------------------------------------------------------------------------
+# imageinfo returns the dict of all information needed to map and link the
+# parsed ELF or PE program p. Addresses are relative to the image base:
+#  - 'machine'  : (format,machine) used to check libraries compatibility,
+#  - 'base'     : link-time address of the image,
+#  - 'needed'   : list of needed library names,
+#  - 'segments' : list of (rva, file offset, file size, memory size),
+#  - 'size'     : memory size of the whole image,
+#  - 'exports'  : defined symbols (name -> rva, or PE forwarder string),
+#  - 'imports'  : slots to be linked (rva -> name, or 'dll::name' for PE),
+#  - 'relocs'   : Relocs of the image (or None without numpy.)
+#------------------------------------------------------------------------------
+def imageinfo(p):
+    if isinstance(p,pe.PE):
+        base = p.basemap
+        S = [(0,0,p.Opt.SizeOfHeaders,p.Opt.SizeOfHeaders)]
+        for s in p.sections:
+            if s.Characteristics==pe.IMAGE_SCN_LNK_REMOVE: continue
+            S.append((s.RVA,s.PointerToRawData,s.SizeOfRawData,s.VirtualSize))
+        imports = dict(((k-base,v) for k,v in p.functions.iteritems()))
+        dlls = getattr(p,'ImportTable',None)
+        needed = [e.Name for e in dlls.dlls] if dlls else []
+        return {'machine' : ('PE',p.NT.Machine),
+                'base'    : base,
+                'needed'  : needed,
+                'segments': S,
+                'size'    : p.Opt.SizeOfImage,
+                'exports' : dict(p.exports),
+                'imports' : imports,
+                'relocs'  : getrelocs(p)}
+    if isinstance(p,elf.Elf64): fmt = 'ELF64'
+    else                      : fmt = 'ELF32'
+    L = [s for s in p.Phdr if s.p_type==elf.PT_LOAD]
+    base = min([s.p_vaddr for s in L] or [0]) & ~(PAGESIZE-1)
+    S = [(s.p_vaddr-base,s.p_offset,s.p_filesz,s.p_memsz) for s in L]
+    size = max([s[0]+s[3] for s in S] or [0])
+    if fmt=='ELF64': D = p._Elf64__dynamic(None)
+    else           : D = p._Elf32__dynamic(None)
+    imports = dict(((k-base,v) for k,v in D.iteritems() if v))
+    exports = dict(((k,v-base) for k,v in p.exports.iteritems()))
+    return {'machine' : (fmt,p.Ehdr.e_machine),
+            'base'    : base,
+            'needed'  : list(p.needed),
+            'segments': S,
+            'size'    : size,
+            'exports' : exports,
+            'imports' : imports,
+            'relocs'  : getrelocs(p)}
+
+#------------------------------------------------------------------------------
+# LibCache stores the imageinfo of libraries on disk (one pickle file per
+# library path) so that they are parsed only once across runs. An entry is
+# valid as long as the library's mtime and size (and VERSION) are unchanged.
+#------------------------------------------------------------------------------
+class LibCache(object):
+
+    def __init__(self,path=None):
+        self.path = path
+        self.infos = {}
+
+    def __entry(self,filename):
+        return os.path.join(self.path,hashlib.sha1(filename).hexdigest())
+
+    def get(self,filename):
+        st = os.stat(filename)
+        stamp = (VERSION,st.st_mtime,st.st_size)
+        info = self.infos.get(filename,None)
+        if info is not None and info['stamp']==stamp:
+            return info
+        info = None
+        if self.path:
+            try:
+                with open(self.__entry(filename),'rb') as f:
+                    info = cPickle.load(f)
+            except (EnvironmentError,EOFError,cPickle.UnpicklingError):
+                info = None
+        if info is None or info.get('stamp')!=stamp:
+            info = self.parse(filename)
+            info['stamp'] = stamp
+            self.put(filename,info)
+        self.infos[filename] = info
+        return info
+
+    def parse(self,filename):
+        logger.verbose('parsing library %s'%filename)
+        from amoco.system.loader import read_program
+        p = read_program(filename)
+        if not isinstance(p,(elf.Elf32,elf.Elf64,pe.PE)):
+            logger.warning('%s is not an ELF or PE library'%filename)
+            return {'machine':None,'base':0,'needed':[],'segments':[],
+                    'size':0,'exports':{},'imports':{},'relocs':None}
+        return imageinfo(p)
+
+    def put(self,filename,info):
+        if not self.path: return
+        try:
+            if not os.path.isdir(self.path): os.makedirs(self.path)
+            # write then rename so that concurrent workers never see a
+            # partially written entry:
+            name = self.__entry(filename)
+            tmp = '%s.%d'%(name,os.getpid())
+            with open(tmp,'wb') as f:
+                cPickle.dump(info,f,cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp,name)
+        except EnvironmentError,e:
+            logger.warning('library cache not written (%s)'%e)
+
+#------------------------------------------------------------------------------
+# Linker resolves libraries needed by a program from a local sysroot
+# directory. Libraries are mapped (as zero-copy views of their files) into the
+# program's MemoryMap only when one of their symbols is bound. Bases are taken
+# from the bases dict (library name -> address) or chosen from base upward.
+# Relocations of a library mapped out of its link base are applied (if numpy
+# is available) before its symbol slots (GOT/IAT) are linked.
+#------------------------------------------------------------------------------
+class Linker(object):
+
+    def __init__(self,sysroot,cache=None,base=0x40000000,bases=None,
+                 libpath=LIBPATH):
+        self.sysroot = sysroot
+        self.cache = LibCache(cache)
+        self.base = base
+        self.bases = bases or {}
+        self.libpath = libpath
+
+    # returns the path of library name found in sysroot with the given
+    # machine, or None. PE names are matched case-insensitively.
+    def find(self,name,machine=None):
+        nocase = (machine is not None and machine[0]=='PE')
+        for d in self.libpath:
+            d = os.path.join(self.sysroot,d)
+            if nocase and os.path.isdir(d):
+                F = [f for f in os.listdir(d) if f.lower()==name.lower()]
+            else:
+                F = [name]
+            for f in F:
+                f = os.path.realpath(os.path.join(d,f))
+                if not os.path.isfile(f): continue
+                if machine is None or self.cache.get(f)['machine']==machine:
+                    return f
+        return None
+
+    def library(self,filename):
+        return self.cache.get(filename)
+
+    # links the slots (address -> name) of CoreExec x by writing the address
+    # of the resolved symbols (as cst of given size) in x.mmap. Returns the
+    # dict of slots that could not be resolved.
+    def link(self,x,slots,size):
+        return _Process(self,x,imageinfo(x.bin),size).bind(slots)
+
+#------------------------------------------------------------------------------
+# _Process holds the state of a single link: libraries found, their bases and
+# the global lookup scope for ELF programs.
+#------------------------------------------------------------------------------
+class _Process(object):
+
+    def __init__(self,linker,x,info,size):
+        self.linker = linker
+        self.x = x
+        self.machine = info['machine']
+        self.size = size
+        self.nocase = (self.machine[0]=='PE')
+        self.libs = {}
+        self.next = linker.base
+        # ELF lookups follow the breadth-first order of DT_NEEDED entries:
+        self.scope = []
+        if not self.nocase:
+            todo = list(info['needed'])
+            while todo:
+                n = todo.pop(0)
+                if n in self.scope: continue
+                self.scope.append(n)
+                l = self.lib(n)
+                if l[1] is not None: todo.extend(l[1]['needed'])
+
+    # returns [path,info,base] of library name (base is None until mapped):
+    def lib(self,name):
+        k = name.lower() if self.nocase else name
+        l = self.libs.get(k,None)
+        if l is None:
+            path = self.linker.find(name,self.machine)
+            if path is None:
+                logger.info('library %s not found in sysroot'%name)
+                l = [None,None,None]
+            else:
+                l = [path,self.linker.library(path),None]
+            self.libs[k] = l
+        return l
+
+    # maps library name if needed and returns its base:
+    def map(self,name):
+        l = self.lib(name)
+        if l[2] is None:
+            info = l[1]
+            base = self.linker.bases.get(name,None)
+            if base is None:
+                base = self.next
+                self.next = (base+info['size']+ALIGN-1) & ~(ALIGN-1)
+            l[2] = base
+            logger.verbose('mapping %s at %#x'%(l[0],base))
+            data = DataIO(file(l[0],'rb'))
+            for rva,o,filesz,memsz in info['segments']:
+                v = data.view(o,filesz,max(memsz,PAGESIZE))
+                self.x.mmap.write(base+rva,v)
+            if info['relocs'] is not None:
+                info['relocs'].apply(self.x.mmap,base-info['base'])
+            unresolved = self.bind(dict(((base+k,v) for k,v in
+                                    info['imports'].iteritems())))
+            for k,f in unresolved.iteritems():
+                self.x.mmap.write(k,self.x.cpu.ext(f,size=self.size))
+        return l[2]
+
+    # returns the address of symbol (in library dll for PE) or None:
+    def lookup(self,symbol,dll=None,depth=8):
+        for n in ([dll] if dll else self.scope):
+            info = self.lib(n)[1]
+            if info is None: continue
+            r = info['exports'].get(symbol,None)
+            if r is None: continue
+            if isinstance(r,str):
+                # PE forwarder 'DLL.symbol' or 'DLL.#ordinal':
+                if depth==0: return None
+                d,_,s = r.partition('.')
+                return self.lookup(s,d+'.dll',depth-1)
+            return self.map(n)+r
+        return None
+
+    def bind(self,slots):
+        unresolved = {}
+        cst = self.x.cpu.cst
+        for k,f in slots.iteritems():
+            if self.nocase:
+                dll,_,symbol = f.partition('::')
+                addr = self.lookup(symbol,dll)
+            else:
+                addr = self.lookup(f)
+            if addr is None: unresolved[k] = f
+            else: self.x.mmap.write(k,cst(addr,self.size))
+        return unresolved
+
+#------------------------------------------------------------------------------
+# getlinker returns the Linker of CoreExec x if it has one, or a Linker
+# configured by the [linker] section of amoco's conf if a sysroot is set,
+# or None. Parsed libraries are cached on disk only if the cache directory
+# is set in this section.
+#------------------------------------------------------------------------------
+_linkers = {}
+
+def getlinker(x):
+    if x.linker is not None: return x.linker
+    sysroot = conf.get('linker','sysroot')
+    if not sysroot: return None
+    cache = conf.get('linker','cache')
+    if cache: cache = os.path.expanduser(cache)
+    k = (sysroot,cache)
+    if k not in _linkers:
+        _linkers[k] = Linker(sysroot,cache)
+    return _linkers[k]
@@ -5,6 +5,7 @@
 # published under GPLv2 license
 
 from amoco.system.core import *
+from amoco.system.linker import getlinker
 from amoco.code import tag
 
 import amoco.arch.x64.cpu_x64 as cpu
@@ -32,17 +33,21 @@ class ELF(CoreExec):
         self.mmap.newzone(cpu.esp)
 
     # call dynamic linker to populate mmap with shared libs:
-    # for now, the external libs are seen through the elf dynamic section:
+    # without linker, the external libs are seen through the elf dynamic section:
     def load_shlib(self):
-        for k,f in self.bin._Elf64__dynamic(None).iteritems():
-            self.mmap.write(k,cpu.ext(f,size=64))
+        D = self.bin._Elf64__dynamic(None)
+        ld = getlinker(self)
+        if ld is not None:
+            D = ld.link(self,D,64)
+        for k,f in D.iteritems():
+            self.mmap.write(k,self.cpu.ext(f,size=64))
 
     # lookup in bin if v is associated with a function or variable name:
     def check_sym(self,v):
         if v._is_cst:
             x = self.bin.functions.get(v.value,None) or self.bin.variables.get(v.value,None)
             if x is not None:
-                if isinstance(x,str): x=cpu.ext(x,size=64)
+                if isinstance(x,str): x=self.cpu.ext(x,size=64)
                 else: x=cpu.sym(x[0],v.value,v.size)
                 return x
         return None
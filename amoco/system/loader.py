@@ -7,10 +7,32 @@
 from amoco.logger import *
 logger = Log(__name__)
 
+import importlib
+import multiprocessing
+
 from amoco.system.core import DataIO
 from amoco.system import elf
 from amoco.system import pe
 
+#------------------------------------------------------------------------------
+# sniff returns the format of the program ('ELF32', 'ELF64', 'PE' or None)
+# by looking only at its first bytes. filename is either a file path or the
+# program data itself.
+#------------------------------------------------------------------------------
+def sniff(filename):
+    try:
+        f = file(filename,'rb')
+        data = f.read(5)
+        f.close()
+    except (TypeError,IOError):
+        data = str(filename)[:5]
+    if data.startswith('\x7fELF'):
+        if data[4:5]==chr(elf.ELFCLASS64): return 'ELF64'
+        return 'ELF32'
+    if data.startswith('MZ'):
+        return 'PE'
+    return None
+
 #------------------------------------------------------------------------------
 # read_program is responsible of identifying the program header (ELF/PE).
 # It returns an ELF or PE class instance.
@@ -18,20 +40,24 @@ from amoco.system import pe
 # based on information from its header.
 #------------------------------------------------------------------------------
 def read_program(filename):
-    obj = None
+    fmt = sniff(filename)
     try:
-        # open file as a ELF object:
-        p = elf.Elf(filename)
-        logger.info("ELF format detected")
-        return p
+        if fmt=='ELF32':
+            p = elf.Elf32(filename)
+            logger.info("ELF format detected")
+            return p
+        if fmt=='ELF64':
+            p = elf.Elf64(filename)
+            logger.info("ELF format detected")
+            return p
     except elf.ElfError:
         pass
 
     try:
-        # open file as a PE object:
-        p = pe.PE(filename)
-        logger.info("PE format detected")
-        return p
+        if fmt=='PE':
+            p = pe.PE(filename)
+            logger.info("PE format detected")
+            return p
     except pe.PEError:
         pass
 
@@ -45,54 +71,121 @@ def read_program(filename):
 ##
 
 #------------------------------------------------------------------------------
-# load_program is responsible of providing a "program" class instance
-# depending on the detected "system" (Linux/Win32) and "environment" (x86).
+# systems are the (module,class) associated with the machine type found in
+# the program header. ELF systems also require (EI_CLASS,EI_DATA) values
+# (or None if any is supported.)
 #------------------------------------------------------------------------------
-def load_program(file):
+ELF_SYSTEMS = {
+    elf.EM_386    : ('linux_x86','ELF',(elf.ELFCLASS32,elf.ELFDATA2LSB)),
+    elf.EM_X86_64 : ('linux_x64','ELF',(elf.ELFCLASS64,elf.ELFDATA2LSB)),
+    elf.EM_ARM    : ('linux_arm','ELF',None),
+    elf.EM_SPARC  : ('leon2'    ,'ELF',None),
+}
 
-    p = read_program(file)
+PE_SYSTEMS = {
+    pe.IMAGE_FILE_MACHINE_I386  : ('win32','PE'),
+    pe.IMAGE_FILE_MACHINE_AMD64 : ('win64','PE'),
+}
 
+# returns the (module,class) names of the system associated with p:
+def get_system(p):
     if isinstance(p,(elf.Elf32,elf.Elf64)):
-
-        if p.Ehdr.e_machine==elf.EM_386:
-            if p.Ehdr.e_ident['EI_CLASS']==elf.ELFCLASS32 and \
-               p.Ehdr.e_ident['EI_DATA']==elf.ELFDATA2LSB:
-                from amoco.system.linux_x86 import ELF
-                logger.info("linux_x86 program created")
-                return ELF(p)
-        elif p.Ehdr.e_machine==elf.EM_X86_64:
-            if p.Ehdr.e_ident['EI_CLASS']==elf.ELFCLASS64 and \
-               p.Ehdr.e_ident['EI_DATA']==elf.ELFDATA2LSB:
-                from amoco.system.linux_x64 import ELF
-                logger.info("linux_x64 program created")
-                return ELF(p)
-        elif p.Ehdr.e_machine==elf.EM_ARM:
-            from amoco.system.linux_arm import ELF
-            logger.info("linux_arm program created")
-            return ELF(p)
-        elif p.Ehdr.e_machine==elf.EM_SPARC:
-            from amoco.system.leon2 import ELF
-            logger.info("leon2 program created")
-            return ELF(p)
-        else:
+        try:
+            name,cls,ident = ELF_SYSTEMS[p.Ehdr.e_machine]
+        except KeyError:
             logger.error('machine type not supported:\n%s'%p.Ehdr)
             raise ValueError
-
+        if ident is not None and \
+           ident!=(p.Ehdr.e_ident['EI_CLASS'],p.Ehdr.e_ident['EI_DATA']):
+            logger.error('class/data not supported:\n%s'%p.Ehdr)
+            raise ValueError
+        return (name,cls)
     elif isinstance(p,pe.PE):
-
-        if p.NT.Machine==pe.IMAGE_FILE_MACHINE_I386:
-            from amoco.system.win32 import PE
-            logger.info("win32 program created")
-            return PE(p)
-        elif p.NT.Machine==pe.IMAGE_FILE_MACHINE_AMD64:
-            from amoco.system.win64 import PE
-            logger.info("win64 program created")
-            return PE(p)
-        else:
+        try:
+            return PE_SYSTEMS[p.NT.Machine]
+        except KeyError:
             logger.error('machine type not supported')
             raise ValueError
-
     else:
         assert isinstance(p,DataIO)
-        from amoco.system.raw import RawExec
-        return RawExec(p)
+        return ('raw','RawExec')
+
+#------------------------------------------------------------------------------
+# load_program is responsible of providing a "program" class instance
+# depending on the detected "system" (Linux/Win32) and "environment" (x86).
+#------------------------------------------------------------------------------
+def load_program(file):
+    p = read_program(file)
+    name,cls = get_system(p)
+    m = importlib.import_module('amoco.system.%s'%name)
+    if name!='raw': logger.info("%s program created"%name)
+    return getattr(m,cls)(p)
+
+#------------------------------------------------------------------------------
+# ProgramHandle is a lightweight (picklable) description of a program file
+# obtained from its headers only. The program itself is loaded by load().
+# If the headers could not be read, error holds the reason (or None).
+#------------------------------------------------------------------------------
+class ProgramHandle(object):
+
+    def __init__(self,filename,format=None,machine=None,entry=None,system=None,
+                 error=None):
+        self.filename = filename
+        self.format = format
+        self.machine = machine
+        self.entry = entry
+        self.system = system
+        self.error = error
+
+    def load(self):
+        return load_program(self.filename)
+
+    def __repr__(self):
+        if self.error is not None:
+            return '<ProgramHandle %s (error: %s)>'%(self.filename,self.error)
+        e = '%#x'%self.entry if self.entry is not None else None
+        return '<ProgramHandle %s (%s, system=%s, entry=%s)>'%(self.filename,
+                                                      self.format,self.system,e)
+
+# returns the ProgramHandle of filename. Any error (truncated or corrupted
+# headers) is kept in the handle so that a batch is never aborted by a
+# single file:
+def read_handle(filename):
+    h = ProgramHandle(filename)
+    try:
+        _read_handle(h)
+    except Exception,e:
+        logger.warning('%s: %s'%(filename,e))
+        h.error = '%s: %s'%(e.__class__.__name__,e)
+    return h
+
+def _read_handle(h):
+    p = read_program(h.filename)
+    if isinstance(p,(elf.Elf32,elf.Elf64)):
+        h.format = 'ELF'
+        h.machine = p.Ehdr.e_machine
+        h.entry = p.Ehdr.e_entry
+    elif isinstance(p,pe.PE):
+        h.format = 'PE'
+        h.machine = p.NT.Machine
+        h.entry = p.Opt.AddressOfEntryPoint + p.basemap
+    try:
+        h.system = get_system(p)[0]
+    except ValueError:
+        pass
+
+# load_programs returns the ProgramHandle of every file, headers are read by a
+# pool of workers processes:
+def load_programs(filenames,workers=None):
+    if workers is None: workers = multiprocessing.cpu_count()
+    if workers>1 and len(filenames)>1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            chunksize = max(1,len(filenames)/(4*workers))
+            res = pool.map(read_handle,filenames,chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        res = map(read_handle,filenames)
+    return res
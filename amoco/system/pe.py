@@ -6,6 +6,7 @@
 # published under GPLv2 license
 
 import struct
+from bisect import bisect_right
 
 from amoco.system.core import DataIO
 from amoco.logger import *
@@ -197,6 +198,12 @@ IMAGE_DIRECTORY_ENTRY_DELAY_IMPORT=13
 IMAGE_DIRECTORY_ENTRY_COM_DESCRIPTOR=14
 IMAGE_DIRECTORY_ENTRY_RESERVED=15
 
+# unwind info flags (x64 exception table):
+UNW_FLAG_NHANDLER=0
+UNW_FLAG_EHANDLER=1
+UNW_FLAG_UHANDLER=2
+UNW_FLAG_CHAININFO=4
+
 class DataDirectory(PEcore):
     fmt = 'II'
     keys = ('RVA','Size')
@@ -463,7 +470,7 @@ class ExportTable(PEcore):
             'TimeStamp',
             'MajorVersion',
             'MinorVersion',
-            'NameRVA'
+            'NameRVA',
             'OrdinalBase',
             'AddressTableEntries',
             'NumberOfNamePointers',
@@ -476,11 +483,12 @@ class ImportTable(object):
     def __init__(self,data):
         self.dlls = []
         e = None
-        while len(data)>0:
-            e = ImportTableEntry(data)
+        offset = 0
+        while offset<len(data):
+            e = ImportTableEntry(data,offset)
             if e.isNULL(): return
             self.dlls.append(e)
-            data = data[len(e):]
+            offset += len(e)
         logger.warning('NULL Import entry not found')
 
 class ImportTableEntry(PEcore):
@@ -506,13 +514,14 @@ class ImportLookupTable(object):
     def readimports(self,data):
         self.imports = []
         fshift = (self.elsize*8)-1
-        while len(data)>=self.elsize:
-            v = struct.unpack(self.fmt,data[:self.elsize])[0]
+        offset = 0
+        while offset+self.elsize<=len(data):
+            v = struct.unpack(self.fmt,data[offset:offset+self.elsize])[0]
             if v==0: return
             flag = v>>fshift
             if   flag==1: self.imports.append([flag,v&0xffff])
             elif flag==0: self.imports.append([flag,v&0x7fffffff])
-            data = data[self.elsize:]
+            offset += self.elsize
 
 class NameTableEntry(object):
     def __init__(self,data):
@@ -539,11 +548,12 @@ class TLSTable(PEcore):
 
     def readcallbacks(self,data):
         self.callbacks = []
-        while len(data)>=self.elsize:
-            v = struct.unpack(self.fmt[0],data[:self.elsize])[0]
+        offset = 0
+        while offset+self.elsize<=len(data):
+            v = struct.unpack(self.fmt[0],data[offset:offset+self.elsize])[0]
             if v==0: return
             self.callbacks.append(v)
-            data = data[self.elsize:]
+            offset += self.elsize
 #------------------------------------------------------------------------------
 
 class PE(PEcore):
@@ -552,8 +562,6 @@ class PE(PEcore):
     symtab    = None
     strtab    = None
     reltab    = None
-    functions = None
-    variables = None
 
     @property
     def entrypoints(self):
@@ -562,6 +570,40 @@ class PE(PEcore):
             l.extend(self.tls.callbacks)
         return l
 
+    # imports (functions), variables and TLS table are parsed on first access:
+    @property
+    def functions(self):
+        if self._functions is None:
+            self._functions = self.__functions()
+        return self._functions
+
+    @property
+    def variables(self):
+        if self._variables is None:
+            self._variables = self.__variables()
+        return self._variables
+
+    # exported symbols (name or '#ordinal' -> rva, or forwarder string):
+    @property
+    def exports(self):
+        if self._exports is None:
+            self._exports = self.__exports()
+        return self._exports
+
+    # RUNTIME_FUNCTION entries (begin,end,unwind info) rvas of the x64
+    # exception table:
+    @property
+    def pdata(self):
+        if self._pdata is None:
+            self._pdata = self.__pdata()
+        return self._pdata
+
+    @property
+    def tls(self):
+        if self._tls is False:
+            self._tls = self.__tls()
+        return self._tls
+
     def __init__(self,filename):
         try:
             f = open(filename,'rb')
@@ -585,33 +627,78 @@ class PE(PEcore):
             s = SectionHdr(data,offset)
             self.sections.append(s)
             offset += len(s)
-        self.functions = self.__functions()
-        self.variables = self.__variables()
-        self.tls       = self.__tls()
+        # sorted RVAs of mapped sections (see locate) and their data views:
+        S = [s for s in self.sections if s.Characteristics!=IMAGE_SCN_LNK_REMOVE]
+        S.sort(key=lambda s:s.RVA)
+        self.__rvas = [s.RVA for s in S]
+        self.__rvasections = S
+        self.__views = {}
+        self._functions = None
+        self._variables = None
+        self._exports   = None
+        self._pdata     = None
+        self._tls       = False
     ##
 
     #  allows to retreive section that holds target address (rva or absolute)
     def locate(self,addr,absolute=False):
         if absolute: addr = addr-self.basemap
-        # now we have addr so we can see in which section/segment it is...
-        # sections are smaller than segments so we try first with Shdr
-        # but this may lead to errors because what really matters are segments
-        # loaded by the kernel binfmt_elf.c loader.
-        for s in self.sections:
-            if s.Characteristics==IMAGE_SCN_LNK_REMOVE: continue
-            if s.RVA <= addr < s.RVA+s.VirtualSize:
+        # now we have addr so we can see in which section it is (the last
+        # one that starts before addr):
+        i = bisect_right(self.__rvas,addr)-1
+        if i>=0:
+            s = self.__rvasections[i]
+            if addr < s.RVA+s.VirtualSize:
                 return s,addr-s.RVA
         if 0<= addr < self.Opt.SizeOfImage:
             return 0,addr
         logger.info('address not found (was %08x)'%addr)
         return None,0
 
-    def getdata(self,addr,absolute=False):
+    # returns a (zero-copy) rawview of the section data from addr:
+    def getview(self,addr,absolute=False):
         s,offset = self.locate(addr,absolute)
         if s is None:
             logger.error('address not mapped')
             raise ValueError
-        return self.loadsegment(s,raw=True)[offset:]
+        try:
+            v = self.__views[s]
+        except KeyError:
+            v = self.__views[s] = self.loadsegment(s,raw=True)
+        return v.view(offset)
+
+    # returns size bytes located at addr (possibly spanning several sections
+    # and shorter if some address is not mapped), or all bytes up to the end
+    # of addr's section if size is None.
+    def getdata(self,addr,size=None,absolute=False):
+        v = self.getview(addr,absolute)
+        if size is None: return v[:]
+        if absolute: addr = addr-self.basemap
+        data = []
+        while True:
+            b = v[:size]
+            data.append(b)
+            size -= len(b)
+            addr += len(b)
+            if size<=0 or len(b)==0: break
+            if self.locate(addr)[0] is None: break
+            v = self.getview(addr)
+        return ''.join(data)
+
+    # returns the null-terminated string located at addr (without the null.)
+    def getstr(self,addr,absolute=False):
+        v = self.getview(addr,absolute)
+        data = []
+        offset = 0
+        while offset<len(v):
+            b = v[offset:offset+64]
+            i = b.find('\0')
+            if i>=0:
+                data.append(b[:i])
+                break
+            data.append(b)
+            offset += 64
+        return ''.join(data)
 
     def loadsegment(self,S,pagesize=0,raw=False):
         if S and not S.Characteristics==IMAGE_SCN_LNK_REMOVE:
@@ -621,15 +708,13 @@ class PE(PEcore):
             sta = S.PointerToRawData
             if sta%self.Opt.FileAlignment:
                 logger.warning('bad file alignment for section %s'%S.Name)
-            sto = sta+S.SizeOfRawData
-            bytes = self.data[sta:sto].ljust(S.VirtualSize)
-            if pagesize:
-                # note: bytes are not truncated, only extended if needed...
-                bytes = bytes.ljust(pagesize,'\x00')
+            # note: bytes are not truncated, only extended if needed...
+            bytes = self.data.view(sta,S.SizeOfRawData,
+                                   max(S.VirtualSize,pagesize))
             if raw: return bytes
             else  : return {addr: bytes}
         elif S==0:
-            bytes = self.data[0:self.Opt.SizeOfHeaders]
+            bytes = self.data.view(0,self.Opt.SizeOfHeaders)
             if raw: return bytes
             else  : return {self.basemap: bytes}
         return None
@@ -638,29 +723,23 @@ class PE(PEcore):
         D = {}
         imports = self.Opt.DataDirectories.get('ImportTable',None)
         if imports is not None:
-            data = ''
-            while len(data)<imports.Size:
-                try:
-                    nextdata = self.getdata(imports.RVA+len(data))
-                    if len(nextdata)==0: break
-                    data += nextdata
-                except ValueError:
-                    return D
+            try:
+                data = self.getdata(imports.RVA,imports.Size)
+            except ValueError:
+                return D
             if len(data)<imports.Size:
                 logger.warning('ImportTable length mismatch')
-            data = data[:imports.Size]
             self.ImportTable = ImportTable(data)
             for e in self.ImportTable.dlls:
                 try:
-                    dllname = self.getdata(e.NameRVA)
-                    e.Name = dllname.partition('\0')[0]
+                    e.Name = self.getstr(e.NameRVA)
                 except ValueError:
                     logger.warning('invalid dll name RVA in ImportTable')
                 try:
                     if e.ImportLookupTableRVA != 0:
-                        data = self.getdata(e.ImportLookupTableRVA)
+                        data = self.getview(e.ImportLookupTableRVA)
                     else:
-                        data = self.getdata(e.ImportAddressTableRVA)
+                        data = self.getview(e.ImportAddressTableRVA)
                 except ValueError:
                     logger.warning('invalid ImportLookupTable RVA')
                 else:
@@ -669,7 +748,7 @@ class PE(PEcore):
                     vaddr = e.ImportAddressTableRVA + self.basemap
                     for x in e.ImportLookupTable.imports:
                         if x[0]==0:
-                            ref = NameTableEntry(self.getdata(x[1]))
+                            ref = NameTableEntry(self.getdata(x[1],2)+self.getstr(x[1]+2)+'\0')
                         else:
                             ref = '#%s'%str(x[1]) #ordinal case
                         e.ImportAddressTable.append((vaddr,ref))
@@ -681,17 +760,62 @@ class PE(PEcore):
                         D[vaddr] = "%s::%s"%(e.Name,symbol)
         return D
 
+    def __exports(self):
+        D = {}
+        exports = self.Opt.DataDirectories.get('ExportTable',None)
+        if exports is not None and exports.RVA != 0:
+            try:
+                data = self.getdata(exports.RVA,40)
+                t = ExportTable(data)
+                n = t.AddressTableEntries
+                eat = self.getdata(t.ExportAddressTableRVA,4*n)
+                names = self.getdata(t.NamePointerRVA,4*t.NumberOfNamePointers)
+                ords = self.getdata(t.OrdinalTableRVA,2*t.NumberOfNamePointers)
+            except (ValueError,struct.error):
+                logger.warning('invalid ExportTable')
+                return D
+            self.ExportTable = t
+            eat = struct.unpack('%dI'%(len(eat)//4),eat)
+            # an address inside the export directory is a forwarder string:
+            lo,hi = exports.RVA,exports.RVA+exports.Size
+            for i,rva in enumerate(eat):
+                if rva==0: continue
+                if lo<=rva<hi: rva = self.getstr(rva)
+                D['#%d'%(t.OrdinalBase+i)] = rva
+            names = struct.unpack('%dI'%(len(names)//4),names)
+            ords = struct.unpack('%dH'%(len(ords)//2),ords)
+            for nrva,i in zip(names,ords):
+                rva = D.get('#%d'%(t.OrdinalBase+i),None)
+                if rva is not None:
+                    D[self.getstr(nrva)] = rva
+        return D
+
+    def __pdata(self):
+        L = []
+        pdata = self.Opt.DataDirectories.get('ExceptionTable',None)
+        if self.NT.Machine==IMAGE_FILE_MACHINE_AMD64 and \
+           pdata is not None and pdata.RVA != 0:
+            try:
+                data = self.getdata(pdata.RVA,pdata.Size)
+            except ValueError:
+                logger.warning('invalid ExceptionTable RVA')
+                return L
+            n = len(data)//12
+            T = struct.unpack('%dI'%(3*n),data[:12*n])
+            L = [T[i:i+3] for i in xrange(0,3*n,3) if T[i]]
+        return L
+
     def __tls(self):
         tls = self.Opt.DataDirectories.get('TLSTable',None)
         if tls is not None and tls.RVA != 0:
             try:
-                data = self.getdata(tls.RVA)
+                data = self.getview(tls.RVA)
             except ValueError:
                 logger.warning('invalid TLS RVA')
             else:
                 tls = TLSTable(data,self.Opt.Magic)
                 try:
-                    cbtable = self.getdata(tls.AddressOfCallbacks,absolute=True)
+                    cbtable = self.getview(tls.AddressOfCallbacks,absolute=True)
                 except ValueError:
                     tls.callbacks = []
                 else:
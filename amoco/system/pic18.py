@@ -12,7 +12,7 @@ import amoco.arch.pic.cpu_pic18f46k22 as cpu
 class PIC18(CoreExec):
 
     def __init__(self,p):
-        self.cpu = cpu
+        self.cpu = self.newcontext(cpu)
         self.cmap = MemoryMap()
         self.mmap = MemoryMap()
         self.bin = p
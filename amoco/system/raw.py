@@ -7,11 +7,77 @@
 from amoco.logger import Log
 logger = Log(__name__)
 
-from amoco.system.core import CoreExec
+import os
+import mmap
+from collections import OrderedDict
 
+from amoco.system.core import CoreExec,rawview,ZoneMap
+
+# size of the windows used to map raw files (a multiple of the mmap
+# allocation granularity) and maximum number of windows mapped at once:
+WINDOW = 1<<24
+MAXWINDOWS = 64
+
+#------------------------------------------------------------------------------
+# rawfile is the source of rawviews of a (possibly huge) raw file: the file is
+# mmapped lazily by fixed-size windows, only when some of their bytes are read,
+# and the least recently used windows are unmapped when more than maxwindows
+# are mapped. Slices of a rawfile are str (that may span several windows.)
+#------------------------------------------------------------------------------
+class rawfile(object):
+
+    def __init__(self,f,window=WINDOW,maxwindows=MAXWINDOWS):
+        self.f = f
+        self.size = os.fstat(f.fileno()).st_size
+        self.window = window
+        self.maxwindows = maxwindows
+        self.windows = OrderedDict()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self,i):
+        if not isinstance(i,slice): return self[i:i+1]
+        sta,sto,_ = i.indices(self.size)
+        s = []
+        while sta<sto:
+            k = sta//self.window
+            w = self.__window(k)
+            o = sta-k*self.window
+            b = w[o:o+sto-sta]
+            if not b: break
+            s.append(b)
+            sta += len(b)
+        return ''.join(s)
+
+    def __window(self,k):
+        w = self.windows.pop(k,None)
+        if w is None:
+            o = k*self.window
+            l = min(self.window,self.size-o)
+            try:
+                w = mmap.mmap(self.f.fileno(),l,access=mmap.ACCESS_READ,offset=o)
+            except (ValueError,EnvironmentError):
+                self.f.seek(o,0)
+                w = self.f.read(l)
+            if len(self.windows)>=self.maxwindows:
+                self.windows.popitem(last=False)
+        self.windows[k] = w
+        return w
+
+    def __repr__(self):
+        return '<rawfile %d bytes, %d windows mapped>'%(self.size,len(self.windows))
+
+#------------------------------------------------------------------------------
+# RawExec loads a raw program (firmware blob) as a list of regions
+# (offset,vaddr,size) of its file, each region being a single obj of the mmap
+# (size None means up to the end of file). By default the whole file is
+# loaded at address 0. File data is read only when accessed (see rawfile).
+#------------------------------------------------------------------------------
 class RawExec(CoreExec):
 
-    def __init__(self,p,cpu=None):
+    def __init__(self,p,cpu=None,regions=None):
+        self.regions = regions or [(0,0,None)]
         CoreExec.__init__(self,p,cpu)
         if cpu is None: logger.warning('a cpu module must be imported')
 
@@ -19,18 +85,40 @@ class RawExec(CoreExec):
     def load_binary(self):
         p = self.bin
         if p!=None:
-            self.mmap.write(0,p.read())
+            if isinstance(p.f,file): self.src = rawfile(p.f)
+            else                   : self.src = p.buffer
+            R,self.regions = self.regions,[]
+            for r in R: self.add_region(*r)
+
+    # maps size bytes of the file located at offset to address vaddr:
+    def add_region(self,offset,vaddr,size=None):
+        v = rawview(self.src,offset,size)
+        if len(v)==0:
+            logger.warning('region at offset %#x is empty'%offset)
+            return
+        self.regions.append((offset,vaddr,len(v)))
+        self.mmap.write(vaddr,v)
 
     def use_x86(self):
         from amoco.arch.x86 import cpu_x86
-        self.cpu = cpu_x86
+        self.cpu = self.newcontext(cpu_x86)
         self.PC  = lambda :self.cpu.eip
 
+    # move all regions so that the first one is located at vaddr. Only objs
+    # of the mmap are moved (regions are not reloaded) and objs shared with
+    # forks are copied first.
     def relocate(self,vaddr):
         from amoco.cas.mapper import mapper
+        delta = vaddr-(self.regions[0][1] if self.regions else 0)
+        z = self.mmap._zones[None]
+        M = []
+        for m,owned in z._map.owned():
+            if not owned: m = m.copy()
+            m.vaddr += delta
+            M.append(m)
+        z._map = ZoneMap(M)
+        self.regions = [(o,v+delta,l) for o,v,l in self.regions]
         m = mapper()
-        mz = self.mmap._zones[None]
-        for z in mz._map: z.vaddr += vaddr
         pc = self.PC()
         m[pc] = self.cpu.cst(vaddr,pc.size)
         self._initmap = m
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+# This code is part of Amoco
+# Copyright (C) 2006-2011 Axel Tillequin (bdcht3@gmail.com)
+# published under GPLv2 license
+
+from amoco.logger import *
+logger = Log(__name__)
+
+import struct
+import weakref
+
+try:
+    import numpy
+except ImportError:
+    logger.info('numpy package not found => relocations are not applied')
+    numpy = None
+
+from amoco.system.core import ZoneMap
+from amoco.system import elf
+from amoco.system import pe
+from amoco.system.image import Image
+
+PAGESIZE = 4096
+
+# relocation kinds: the relocated word is
+#   RELATIVE : B+A (A is the link-time address),
+#   ABSOLUTE : S+A (S is the link-time value of a defined symbol),
+#   SYMBOL   : S,
+# all of them being shifted by the load delta.
+RELATIVE,ABSOLUTE,SYMBOL = 0,1,2
+
+# supported ELF relocation types: machine -> {type: (width,kind)}
+ELF_RELOCS = {
+    elf.EM_386: {
+        elf.R_386_RELATIVE : (4,RELATIVE),
+        elf.R_386_32       : (4,ABSOLUTE),
+        elf.R_386_GLOB_DAT : (4,SYMBOL),
+        elf.R_386_JMP_SLOT : (4,SYMBOL)},
+    elf.EM_X86_64: {
+        elf.R_X86_64_RELATIVE : (8,RELATIVE),
+        elf.R_X86_64_64       : (8,ABSOLUTE),
+        elf.R_X86_64_GLOB_DAT : (8,SYMBOL),
+        elf.R_X86_64_JUMP_SLOT: (8,SYMBOL)},
+}
+
+# supported PE base relocation types: type -> width
+IMAGE_REL_BASED_ABSOLUTE=0
+IMAGE_REL_BASED_HIGHLOW=3
+IMAGE_REL_BASED_DIR64=10
+PE_RELOCS = {IMAGE_REL_BASED_HIGHLOW:4, IMAGE_REL_BASED_DIR64:8}
+
+#------------------------------------------------------------------------------
+# Relocs holds the relocations of an image as numpy arrays sorted by offset:
+#   offset  : link-time address of the relocated word,
+#   width   : size of the word in bytes (4 or 8),
+#   addend  : constant part of the new value (link-time),
+#   inplace : True if the word already in memory is added to the new value,
+#   relative: True for RELATIVE relocations (B+A).
+# The new value of a word is thus (inplace?word:0)+addend+delta, where delta
+# is the difference between the load base and the link base of the image.
+#------------------------------------------------------------------------------
+class Relocs(object):
+
+    def __init__(self,offset,width,addend,inplace,relative=None,order='<'):
+        i = numpy.argsort(offset,kind='mergesort')
+        self.offset  = offset[i].astype(numpy.uint64)
+        self.width   = width[i].astype(numpy.uint8)
+        self.addend  = addend[i].astype(numpy.uint64)
+        self.inplace = inplace[i].astype(numpy.bool_)
+        if relative is None: relative = numpy.zeros(len(i),dtype=numpy.bool_)
+        self.relative = relative[i].astype(numpy.bool_)
+        self.order   = order
+
+    def __len__(self):
+        return len(self.offset)
+
+    def __repr__(self):
+        return '<Relocs: %d entries>'%len(self)
+
+    # applies relocations to the None zone of mmap for an image loaded with
+    # the given delta. If rebase is not None, the image was already relocated
+    # and then moved by rebase bytes so that all words are just shifted.
+    def apply(self,mmap,delta,rebase=None):
+        z = mmap._zones[None]
+        if len(self)==0 or len(z._map)==0: return 0
+        d = numpy.uint64(delta & 0xffffffffffffffff)
+        target = self.offset+d
+        done = 0
+        for w in (4,8):
+            sel = (self.width==w)
+            if not sel.any(): continue
+            T = target[sel]
+            if rebase is not None:
+                A = numpy.repeat(numpy.uint64(rebase & 0xffffffffffffffff),len(T))
+                I = numpy.ones(len(T),dtype=numpy.bool_)
+            else:
+                A = self.addend[sel]+d
+                I = self.inplace[sel]
+            done += self.__patch(z,T,A,I,w)
+        if done<len(self):
+            logger.verbose('%d relocations not applied'%(len(self)-done))
+        return done
+
+    # returns the number of RELATIVE words (among count of them, evenly
+    # spread) that do not read back from mmap as addend+delta after apply.
+    # Only words that do not depend on their previous value (not inplace) are
+    # checked.
+    def check(self,mmap,delta,count=64):
+        J = numpy.flatnonzero(self.relative & ~self.inplace)
+        if len(J)>count: J = J[numpy.linspace(0,len(J)-1,count).astype(numpy.int64)]
+        bad = 0
+        for j in J:
+            w = int(self.width[j])
+            mask = (1<<(8*w))-1
+            vaddr = (int(self.offset[j])+delta)&0xffffffffffffffff
+            try:
+                v = mmap.read(vaddr,w)
+            except MemoryError:
+                v = None
+            if v is None or len(v)!=1 or not isinstance(v[0],str) or \
+               struct.unpack(self.order+('I' if w==4 else 'Q'),v[0])[0] != \
+               (int(self.addend[j])+delta)&mask:
+                bad += 1
+        return bad
+
+    # patches words of width w at targets T (sorted) in raw objs of zone z:
+    def __patch(self,z,T,A,I,w):
+        shifts = numpy.arange(w,dtype=numpy.uint64)*numpy.uint64(8)
+        if self.order=='>': shifts = shifts[::-1]
+        mask = numpy.uint64((1<<(8*w))-1)
+        todo = []
+        for i,m in enumerate(z._map):
+            if not m.data._is_raw: continue
+            lo,hi = numpy.searchsorted(T,[m.vaddr,max(m.vaddr,m.end-w+1)])
+            if hi>lo: todo.append((i,lo,hi))
+        done = 0
+        for i,lo,hi in todo:
+            m = z._map.mutable(i)
+            v = m.data.val
+            buf = v if isinstance(v,bytearray) else bytearray(v[:])
+            a = numpy.frombuffer(buf,dtype=numpy.uint8)
+            # gather words as uint64, update and scatter them back:
+            o = (T[lo:hi]-numpy.uint64(m.vaddr)).astype(numpy.int64)
+            idx = o[:,None]+numpy.arange(w)
+            words = (a[idx].astype(numpy.uint64)<<shifts).sum(axis=1,dtype=numpy.uint64)
+            words = (words*I[lo:hi]+A[lo:hi])&mask
+            a[idx] = ((words[:,None]>>shifts)&numpy.uint64(0xff)).astype(numpy.uint8)
+            m.data.val = buf
+            done += hi-lo
+        return done
+
+#------------------------------------------------------------------------------
+# getrelocs returns the (memoized) Relocs of a parsed ELF or PE program p,
+# or None if numpy is not available.
+#------------------------------------------------------------------------------
+_relocs = weakref.WeakKeyDictionary()
+
+def getrelocs(p):
+    if numpy is None: return None
+    R = _relocs.get(p,None)
+    if R is None:
+        if isinstance(p,pe.PE): R = pe_relocs(p)
+        else                  : R = elf_relocs(p)
+        _relocs[p] = R
+    return R
+
+def _array(v,dtype):
+    return numpy.frombuffer(v.src,dtype=dtype,count=v.l//dtype.itemsize,offset=v.o)
+
+def elf_relocs(p):
+    order = p.Ehdr.order
+    types = ELF_RELOCS.get(p.Ehdr.e_machine,{})
+    if isinstance(p,elf.Elf64):
+        w = 'u8'; ws = 8; rshift = 32
+        sym = [('st_name',order+'u4'),('st_info','u1'),('st_other','u1'),
+               ('st_shndx',order+'u2'),('st_value',order+'u8'),('st_size',order+'u8')]
+    else:
+        w = 'u4'; ws = 4; rshift = 8
+        sym = [('st_name',order+'u4'),('st_value',order+'u4'),('st_size',order+'u4'),
+               ('st_info','u1'),('st_other','u1'),('st_shndx',order+'u2')]
+    R = [(numpy.zeros(0,numpy.uint64),)*3+(numpy.zeros(0,numpy.bool_),)*2]
+    for s in p.Shdr:
+        if s.sh_type not in (elf.SHT_REL,elf.SHT_RELA,elf.SHT_RELR): continue
+        # only dynamic relocations (of allocated sections) are applied:
+        if not s.sh_flags&elf.SHF_ALLOC: continue
+        if s.sh_type==elf.SHT_RELR:
+            offset = _relr(_array(p.sectionview(s),numpy.dtype(order+w)))
+            n = len(offset)
+            R.append((offset,numpy.repeat(numpy.uint64(ws),n),
+                      numpy.zeros(n,numpy.uint64),numpy.ones(n,numpy.bool_),
+                      numpy.ones(n,numpy.bool_)))
+            continue
+        rela = (s.sh_type==elf.SHT_RELA)
+        fields = [('r_offset',order+w),('r_info',order+w)]
+        if rela: fields.append(('r_addend',order+w.replace('u','i')))
+        t = _array(p.sectionview(s),numpy.dtype(fields))
+        rtype = t['r_info']&((1<<rshift)-1)
+        rsym  = (t['r_info']>>rshift).astype(numpy.int64)
+        if rela: addend = t['r_addend'].astype(numpy.uint64)
+        else   : addend = numpy.zeros(len(t),dtype=numpy.uint64)
+        symtab = None
+        if s.sh_link and s.sh_link<len(p.Shdr):
+            symtab = _array(p.sectionview(p.Shdr[s.sh_link]),numpy.dtype(sym))
+        for typ,(width,kind) in types.iteritems():
+            sel = (rtype==typ)
+            if kind!=RELATIVE:
+                if symtab is None: continue
+                ok = (rsym<len(symtab))
+                sel &= ok
+                S = numpy.zeros(len(t),dtype=numpy.int64)
+                S[sel] = rsym[sel]
+                # symbols must be defined in the image:
+                sel &= (symtab['st_shndx'][S]!=elf.SHN_UNDEF)
+                value = symtab['st_value'][S].astype(numpy.uint64)
+            if not sel.any(): continue
+            n = sel.sum()
+            if kind==RELATIVE:
+                A = addend[sel]
+                I = numpy.repeat(not rela,n)
+            elif kind==ABSOLUTE:
+                A = value[sel]+addend[sel]
+                I = numpy.repeat(not rela,n)
+            else:
+                A = value[sel]
+                I = numpy.zeros(n,dtype=numpy.bool_)
+            R.append((t['r_offset'][sel].astype(numpy.uint64),
+                      numpy.repeat(numpy.uint64(width),n),A,I,
+                      numpy.repeat(kind==RELATIVE,n)))
+    return Relocs(*[numpy.concatenate(x) for x in zip(*R)],order=order)
+
+# decodes packed relative relocations: an even entry is the address of a
+# relocated word, an odd entry is a bitmap of the next 8*w-1 words (w being
+# the word size) that follow the last relocated address.
+def _relr(t):
+    t = t.astype(numpy.uint64)
+    if len(t)==0: return t
+    w = t.dtype.itemsize
+    W = 8*w-1
+    isaddr = (t&numpy.uint64(1))==0
+    addrs = t[isaddr]
+    if len(addrs)==0 or not isaddr[0]:
+        logger.warning('invalid packed relocations')
+        return numpy.zeros(0,numpy.uint64)
+    pos = numpy.arange(len(t))
+    grp = numpy.cumsum(isaddr)-1
+    k = pos-numpy.nonzero(isaddr)[0][grp]-1
+    bm = ~isaddr
+    base = addrs[grp[bm]]+numpy.uint64(w)+k[bm].astype(numpy.uint64)*numpy.uint64(W*w)
+    bits = ((t[bm][:,None]>>numpy.arange(1,W+1,dtype=numpy.uint64))&numpy.uint64(1)).astype(numpy.bool_)
+    offsets = base[:,None]+numpy.arange(W,dtype=numpy.uint64)*numpy.uint64(w)
+    return numpy.concatenate((addrs,offsets[bits]))
+
+def pe_relocs(p):
+    R = [(numpy.zeros(0,numpy.uint64),)*2]
+    relocs = p.Opt.DataDirectories.get('BaseRelocationTable',None)
+    if relocs is not None and relocs.RVA!=0:
+        try:
+            data = p.getdata(relocs.RVA,relocs.Size)
+        except ValueError:
+            logger.warning('invalid BaseRelocationTable')
+            data = ''
+        o = 0
+        while o+8<=len(data):
+            page,size = struct.unpack_from('<II',data,o)
+            if size<8: break
+            n = min(size-8,len(data)-o-8)//2
+            e = numpy.frombuffer(data,dtype='<u2',count=n,offset=o+8)
+            R.append(((e&0xfff).astype(numpy.uint64)+numpy.uint64(page),
+                      (e>>12).astype(numpy.uint64)))
+            o += size
+    offset,types = [numpy.concatenate(x) for x in zip(*R)]
+    width = numpy.zeros(len(types),dtype=numpy.uint64)
+    for typ,w in PE_RELOCS.iteritems(): width[types==typ] = w
+    unknown = ((width==0)&(types!=IMAGE_REL_BASED_ABSOLUTE)).sum()
+    if unknown: logger.verbose('%d unsupported base relocations'%unknown)
+    sel = (width!=0)
+    offset = offset[sel]+numpy.uint64(p.basemap)
+    n = len(offset)
+    return Relocs(offset,width[sel],numpy.zeros(n,numpy.uint64),
+                  numpy.ones(n,numpy.bool_),numpy.ones(n,numpy.bool_))
+
+# returns the link-time [lo,hi[ range of addresses of the loaded image of p:
+def extent(p):
+    if isinstance(p,Image):
+        return p.extent
+    if isinstance(p,pe.PE):
+        return (p.basemap,p.basemap+p.Opt.SizeOfImage)
+    if not isinstance(p,(elf.Elf32,elf.Elf64)): return (0,0)
+    L = [(s.p_vaddr,s.p_vaddr+max(s.p_memsz,PAGESIZE)) for s in p.Phdr
+            if s.p_type==elf.PT_LOAD]
+    if not L: return (0,0)
+    return (min(L)[0]&~(PAGESIZE-1),max([x[1] for x in L]))
+
+#------------------------------------------------------------------------------
+# relocate moves the image of CoreExec x so that its link base is located at
+# vaddr and applies its relocations. Other objs of the None zone (ie. shared
+# libraries) are not moved.
+#------------------------------------------------------------------------------
+def relocate(x,vaddr):
+    p = x.bin
+    if not isinstance(p,(elf.Elf32,elf.Elf64,pe.PE)):
+        logger.error('relocate needs an ELF or PE program (not %s)'%p.__class__.__name__)
+        return
+    R = getrelocs(p)
+    if R is None:
+        logger.warning('relocations need numpy')
+        return
+    lo,hi = extent(p)
+    cur = getattr(x,'_imagebase',None)
+    base = lo if cur is None else cur
+    delta = vaddr-base
+    # move objs of the image (the new map copies objs shared with forks):
+    z = x.mmap._zones[None]
+    M = []
+    for m,owned in z._map.owned():
+        if not owned: m = m.copy()
+        if base<=m.vaddr<base+(hi-lo): m.vaddr += delta
+        M.append(m)
+    M.sort(key=lambda m:m.vaddr)
+    z._map = ZoneMap(M)
+    if cur is None: R.apply(x.mmap,vaddr-lo)
+    else          : R.apply(x.mmap,vaddr-lo,rebase=delta)
+    x._imagebase = vaddr
+    bad = R.check(x.mmap,vaddr-lo)
+    if bad:
+        logger.warning('%d checked relocated words are not raw or wrong'%bad)
@@ -5,6 +5,7 @@
 # published under GPLv2 license
 
 from amoco.system.core import *
+from amoco.system.linker import getlinker
 from amoco.code import tag
 
 import amoco.arch.x86.cpu_x86 as cpu
@@ -33,10 +34,14 @@ class PE(CoreExec):
         self.mmap.newzone(cpu.esp)
 
     # call dynamic linker to populate mmap with shared libs:
-    # for now, the external libs are seen through the elf dynamic section:
+    # without linker, the external libs are seen through the import table:
     def load_shlib(self):
-        for k,f in self.bin.functions.iteritems():
-            self.mmap.write(k,cpu.ext(f,size=32))
+        D = self.bin.functions
+        ld = getlinker(self)
+        if ld is not None:
+            D = ld.link(self,D,32)
+        for k,f in D.iteritems():
+            self.mmap.write(k,self.cpu.ext(f,size=32))
 
     def initenv(self):
         from amoco.cas.mapper import mapper
@@ -59,7 +64,7 @@ class PE(CoreExec):
         if v._is_cst:
             x = self.bin.functions.get(v.value,None) or self.bin.variables.get(v.value,None)
             if x is not None:
-                if isinstance(x,str): x=cpu.ext(x,size=32)
+                if isinstance(x,str): x=self.cpu.ext(x,size=32)
                 else: x=cpu.sym(x[0],v.value,v.size)
                 return x
         return None
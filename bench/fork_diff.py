@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This code is part of Amoco
+# published under GPLv2 license
+
+# differential check of MemoryMap fork/snapshot/restore isolation. A set of
+# maps is derived from a map of raw data (str, rawview of a buffer and small
+# objs) by random forks, snapshots, restores and writes, and every map is
+# compared with its own byte model (a copy of the model of the map it comes
+# from) after each operation: writes to a map must never be seen by others.
+# usage: python bench/fork_diff.py [count] [seed]
+
+import sys
+import random
+
+from amoco.system.core import MemoryMap,rawview,PAGESIZE
+from amoco.cas.expressions import cst
+
+SIZE = 8*PAGESIZE
+
+def fail(msg,*args):
+    print 'MISMATCH: '+msg%args
+    sys.exit(1)
+
+# bytes of map m in [v,v+l[ (None for unmapped or symbolic bytes):
+def content(m,v,l):
+    res = []
+    for x in m.read(v,l):
+        if isinstance(x,(str,bytearray,rawview)):
+            res.extend(str(x))
+        elif x._is_cst:
+            res.extend(('%0*x'%(x.size/4,x.v)).decode('hex')[::-1])
+        else:
+            res.extend([None]*(x.size/8))
+    return res
+
+def randbytes(rnd,n):
+    return ''.join(chr(rnd.randint(0,255)) for _ in xrange(n))
+
+def check(M,models,v=0,l=SIZE+PAGESIZE):
+    for k,(m,model) in enumerate(zip(M,models)):
+        c = content(m,v,l)
+        if c!=model[v:v+l]:
+            i = [a!=b for a,b in zip(c,model[v:v+l])].index(True)
+            fail('map %d differs at %#x',k,v+i)
+
+def main(count=2000,seed=0):
+    rnd = random.Random(seed)
+    m = MemoryMap()
+    model = [None]*(SIZE+PAGESIZE)
+    # a large str obj, a rawview and some small objs:
+    data = randbytes(rnd,SIZE)
+    m.write(0,data[:3*PAGESIZE])
+    m.write(3*PAGESIZE,rawview(data,3*PAGESIZE,3*PAGESIZE))
+    model[0:6*PAGESIZE] = list(data[:6*PAGESIZE])
+    for v in xrange(6*PAGESIZE,SIZE,512):
+        m.write(v,data[v:v+256])
+        model[v:v+256] = list(data[v:v+256])
+    M,models = [m],[model]
+    S = []
+    for n in xrange(count):
+        op = rnd.random()
+        k = rnd.randrange(len(M))
+        if op<0.1 and len(M)<16:
+            M.append(M[k].fork())
+            models.append(list(models[k]))
+        elif op<0.15:
+            S.append((M[k].snapshot(),list(models[k])))
+        elif op<0.2 and S:
+            s,smodel = rnd.choice(S)
+            M[k].restore(s)
+            models[k] = list(smodel)
+        elif op<0.9:
+            v = rnd.randrange(0,SIZE)
+            if rnd.random()<0.8:
+                d = randbytes(rnd,rnd.randint(1,64))
+                M[k].write(v,d)
+                models[k][v:v+len(d)] = list(d)
+            else:
+                n = rnd.choice((1,2,4,8))
+                x = rnd.getrandbits(8*n)
+                M[k].write(v,cst(x,8*n))
+                models[k][v:v+n] = list(('%0*x'%(2*n,x)).decode('hex')[::-1])
+        else:
+            M[k].restruct()
+        v = rnd.randrange(0,SIZE)
+        check(M,models,v,128)
+        # snapshots must not change either:
+        if S:
+            s,smodel = rnd.choice(S)
+            check([s],[smodel],v,128)
+    check(M,models)
+    for s,smodel in S: check([s],[smodel])
+    print 'fork: %d operations ok (%d maps, %d snapshots)'%(count,len(M),len(S))
+
+if __name__=='__main__':
+    main(*map(int,sys.argv[1:]))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This code is part of Amoco
+# published under GPLv2 license
+
+# differential check of the decode cache of CoreExec.read_instruction: random
+# reads (of a small set of hot addresses, with a small cache so that entries
+# are evicted), writes over code, changes of the program decoding state (ARM
+# and Thumb) and modifications of returned instructions are applied to a raw
+# program, and every instruction returned by read_instruction is compared
+# with the instruction decoded without cache from the same bytes.
+# usage: python bench/icache_diff.py [count] [seed]
+
+import sys
+import random
+
+from amoco.system.raw import RawExec
+from amoco.system.core import DataIO,DecodeCache
+
+SIZE = 0x10000
+
+def fail(cpu,a,msg):
+    print 'MISMATCH (%s) at %#x: %s'%(cpu.__name__,a,msg)
+    sys.exit(1)
+
+def sig(i):
+    if i is None: return None
+    if isinstance(i,Exception): return repr(i)
+    misc = sorted(((k,str(v)) for k,v in i.misc.iteritems()))
+    try:
+        s = str(i)
+    except Exception,e:
+        # some random encodings can't be formatted...
+        s = repr(e)
+    return (s,i.length,i.bytes,i.mnemonic,len(i.operands),misc,str(i.address))
+
+def read(p,a,sz):
+    try:
+        return p.read_instruction(p.cpu.cst(a,sz))
+    except Exception,e:
+        return e
+
+def reference(p,a,sz):
+    istr = ''.join((str(x) for x in p.mmap.read(a,p.cpu.disassemble.maxlen)))
+    try:
+        i = p.cpu.disassemble(istr)
+    except Exception,e:
+        return e
+    if i is not None: i.address = p.cpu.cst(a,sz)
+    return i
+
+def check(cpu,count,rnd):
+    p = RawExec(DataIO(''.join(chr(rnd.randint(0,255)) for _ in xrange(SIZE))),cpu)
+    p.icache = DecodeCache(maxsize=64)
+    sz = 64 if cpu.__name__.endswith('x64') else 32
+    hot = [rnd.randrange(0,SIZE-16) for _ in xrange(256)]
+    for _ in xrange(count):
+        a = rnd.choice(hot)
+        op = rnd.random()
+        if op<0.05:
+            p.mmap.write(a,''.join(chr(rnd.randint(0,255)) for _ in xrange(rnd.randint(1,8))))
+        elif op<0.1 and hasattr(p.cpu.decoding,'iset'):
+            p.cpu.decoding.iset = rnd.randint(0,1) if cpu.__name__.endswith('armv7') else 0
+        i = read(p,a,sz)
+        j = reference(p,a,sz)
+        if sig(i)!=sig(j): fail(cpu,a,'%s / %s'%(sig(i),sig(j)))
+        # returned instructions must not share their state with the cache:
+        if i is not None and not isinstance(i,Exception) and op>0.8:
+            i.operands.append(None)
+            i.misc['changed'] = True
+            i.address = None
+            i.bytes = ''
+    c = p.icache
+    print '%-28s %d reads ok (hits=%d misses=%d)'%(cpu.__name__,count,c.hits,c.misses)
+
+def main(count=5000,seed=0):
+    from amoco.arch.x86 import cpu_x86
+    from amoco.arch.x64 import cpu_x64
+    from amoco.arch.arm import cpu_armv7
+    from amoco.arch.sparc import cpu_v8
+    rnd = random.Random(seed)
+    for cpu in (cpu_x86,cpu_x64,cpu_armv7,cpu_v8):
+        check(cpu,count,rnd)
+
+if __name__=='__main__':
+    main(*map(int,sys.argv[1:]))
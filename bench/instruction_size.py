@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This code is part of Amoco
+# published under GPLv2 license
+
+# measures the average memory footprint (in bytes) of instruction objects
+# decoded by the disassembler of each arch. The size of an instruction
+# includes the object itself, its __dict__ (if any), its misc container,
+# its operands list and its bytes string. Operand expressions are shared
+# (registers) or small (cst) and are not accounted.
+# Each instruction is also converted to the previous layout (a regular object
+# with all attributes in its __dict__ and a misc defaultdict allocated by every
+# instruction) that is measured the same way, for comparison.
+# usage: python bench/instruction_size.py [count]
+
+import sys
+import gc
+import random
+from collections import defaultdict
+
+def sizeof(i):
+    n = sys.getsizeof(i)
+    # (avoid i.__dict__ that would allocate a dict for slotted objects)
+    for r in gc.get_referents(i):
+        if type(r) is dict:
+            n += sys.getsizeof(r)
+            m = r.get('misc')
+            if m is not None: n += sys.getsizeof(m)
+        elif isinstance(r,defaultdict):
+            n += sys.getsizeof(r)
+    n += sys.getsizeof(i.operands)
+    n += sys.getsizeof(i.bytes)
+    return n
+
+# previous layout of instruction objects:
+class oldinstruction(object):
+
+    def __init__(self,i):
+        self.bytes = i.bytes
+        self.type = i.type
+        self.spec = i.spec
+        self.mnemonic = i.mnemonic
+        self.operands = list(i.operands)
+        self.misc = defaultdict(lambda: None)
+        if i._misc is not None: self.misc.update(i._misc)
+        self.address = i.address
+        # attributes defined by spec hooks:
+        for r in gc.get_referents(i):
+            if type(r) is dict: self.__dict__.update(r)
+
+def measure(cpu,count,rnd):
+    maxlen = cpu.disassemble.maxlen
+    total = old = 0
+    I = []
+    while len(I)<count:
+        istr = ''.join(chr(rnd.randint(0,255)) for _ in range(maxlen))
+        try:
+            i = cpu.disassemble(istr)
+        except Exception:
+            # some random bytes make spec hooks fail...
+            continue
+        if i is None: continue
+        I.append(i)
+        total += sizeof(i)
+        old += sizeof(oldinstruction(i))
+    return float(old)/count,float(total)/count
+
+def main(count=2000):
+    from amoco.arch.x86 import cpu_x86
+    from amoco.arch.x64 import cpu_x64
+    from amoco.arch.arm import cpu_armv7
+    from amoco.arch.arm import cpu_armv8
+    from amoco.arch.sparc import cpu_v8
+    from amoco.arch.msp430 import cpu as cpu_msp430
+    from amoco.arch.z80 import cpu_z80
+    rnd = random.Random(0)
+    print '%-30s %8s %8s (bytes/instruction)'%('','before','after')
+    for cpu in (cpu_x86,cpu_x64,cpu_armv7,cpu_armv8,cpu_v8,cpu_msp430,cpu_z80):
+        print '%-30s %8.1f %8.1f'%((cpu.__name__,)+measure(cpu,count,rnd))
+
+if __name__=='__main__':
+    main(*map(int,sys.argv[1:]))
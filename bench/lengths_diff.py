@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This code is part of Amoco
+# published under GPLv2 license
+
+# differential check of the x86/x64 length decoders (cpu.lengths) against the
+# full disassemblers: for random byte strings (with random prefixes and
+# opcode escapes), the length, type and mnemonic given by lengths must be
+# those of the instruction decoded by disassemble, and both must agree on
+# invalid encodings. If a file is given, its bytes are also swept linearly.
+# usage: python bench/lengths_diff.py [count] [seed] [file]
+
+import sys
+import random
+
+PREFIXES = '\xf0\xf2\xf3\x26\x2e\x36\x3e\x64\x65\x66\x67'
+
+def fail(cpu,istr,msg):
+    print 'MISMATCH (%s) %s: %s'%(cpu.__name__,istr.encode('hex'),msg)
+    sys.exit(1)
+
+def full(cpu,istr):
+    try:
+        return cpu.disassemble(istr)
+    except Exception:
+        # some encodings make spec hooks fail...
+        return None
+
+def compare(cpu,istr):
+    i = full(cpu,istr)
+    e = cpu.lengths(istr)
+    if i is None:
+        if e is not None: fail(cpu,istr,'lengths %d for an invalid encoding'%e[0])
+        return False
+    if e is None: fail(cpu,istr,'no length for %s'%i)
+    l,t,m,_ = e
+    if (l,t,m)!=(i.length,i.type,i.mnemonic):
+        fail(cpu,istr,'(%d,%d,%s) instead of (%d,%d,%s)'%(l,t,m,i.length,i.type,i.mnemonic))
+    return True
+
+def randistr(cpu,rnd):
+    s = ''
+    for _ in xrange(rnd.choice((0,0,0,1,1,2))):
+        s += rnd.choice(PREFIXES)
+    if cpu.lengths.x64 and rnd.random()<0.3:
+        s += chr(0x40|rnd.randint(0,15))
+    r = rnd.random()
+    if r<0.3: s += '\x0f'
+    elif r<0.4: s += rnd.choice(('\x0f\x38','\x0f\x3a'))
+    while len(s)<cpu.disassemble.maxlen:
+        s += chr(rnd.randint(0,255))
+    return s
+
+def main(count=5000,seed=0,path=None):
+    from amoco.arch.x86 import cpu_x86
+    from amoco.arch.x64 import cpu_x64
+    rnd = random.Random(seed)
+    for cpu in (cpu_x86,cpu_x64):
+        valid = 0
+        for _ in xrange(count):
+            if compare(cpu,randistr(cpu,rnd)): valid += 1
+        print '%-24s %d random encodings ok (%d valid)'%(cpu.__name__,count,valid)
+        if path is None: continue
+        data = open(path,'rb').read()
+        maxlen = cpu.disassemble.maxlen
+        off = n = 0
+        while off<len(data)-maxlen:
+            istr = data[off:off+maxlen]
+            off += cpu.lengths(istr)[0] if compare(cpu,istr) else 1
+            n += 1
+        print '%-24s %d instructions of %s ok'%(cpu.__name__,n,path)
+
+if __name__=='__main__':
+    args = sys.argv[1:]
+    path = args.pop() if len(args)==3 else None
+    main(*map(int,args),path=path)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This code is part of Amoco
+# published under GPLv2 license
+
+# differential check of the treap ZoneMap of MemoryZone against a python list
+# of mo objects (the previous implementation of MemoryZone._map). Random
+# operations are applied to both sequences, and random writes, reads and
+# restructs are applied to a MemoryZone using each of them. Contents, locate
+# and read results and str of zones are compared after every operation.
+# usage: python bench/zonemap_diff.py [count] [seed]
+
+import sys
+import random
+from bisect import bisect_right
+
+from amoco.system.core import ZoneMap,MemoryZone,mo
+from amoco.cas.expressions import cst
+
+# the list implementation (with the ZoneMap interface used by MemoryZone):
+class listmap(list):
+
+    def locate(self,vaddr):
+        i = bisect_right([z.vaddr for z in self],vaddr)
+        return i-1 if i>0 else None
+
+    def mutable(self,i):
+        return self[i]
+
+    def owned(self):
+        for z in self: yield (z,True)
+
+    def fork(self):
+        return listmap((z.copy() for z in self))
+
+def fail(msg,*args):
+    print 'MISMATCH: '+msg%args
+    sys.exit(1)
+
+def part(x):
+    return repr(str(x)) if isinstance(x,(str,bytearray)) else str(x)
+
+# random operations on the sequences (objs are kept ordered by vaddr):
+def check_sequence(count,rnd):
+    Z = ZoneMap()
+    L = listmap()
+    for n in xrange(count):
+        op = rnd.random()
+        V = [z.vaddr for z in L]
+        if op<0.5 or len(L)==0:
+            v = rnd.randrange(0,1<<20)
+            if v in V: continue
+            i = bisect_right(V,v)
+            z = mo(v,'x')
+            Z.insert(i,z)
+            L.insert(i,z)
+        elif op<0.6:
+            v = (V[-1] if V else 0)+rnd.randint(1,16)
+            z = mo(v,'x')
+            Z.append(z)
+            L.append(z)
+        elif op<0.65:
+            i = rnd.randrange(-len(L),len(L))
+            if Z.pop(i) is not L.pop(i): fail('pop %d',i)
+        elif op<0.7:
+            i = rnd.randrange(0,len(L)+1)
+            j = rnd.randrange(i,min(len(L),i+8)+1)
+            del Z[i:j]
+            del L[i:j]
+        elif op<0.75:
+            i = rnd.randrange(-len(L),len(L))
+            del Z[i]
+            del L[i]
+        else:
+            for _ in xrange(8):
+                if V and rnd.random()<0.5: v = rnd.choice(V)+rnd.randint(-1,1)
+                else: v = rnd.randrange(-8,(1<<20)+8)
+                if Z.locate(v)!=L.locate(v): fail('locate %#x',v)
+        if len(Z)!=len(L): fail('len %d/%d',len(Z),len(L))
+        if L and Z[-1] is not L[-1]: fail('last obj')
+        if n%64==0 and any((a is not b for a,b in zip(Z,L))): fail('objs')
+    print 'sequence: %d operations ok (%d objs)'%(count,len(L))
+
+def randdata(rnd):
+    r = rnd.random()
+    n = rnd.randint(1,48)
+    if r<0.6: return ''.join(chr(rnd.randint(0,255)) for _ in xrange(n))
+    if r<0.8: return bytearray(chr(rnd.randint(0,255)) for _ in xrange(n))
+    n = rnd.choice((1,2,4,8))
+    return cst(rnd.getrandbits(8*n),8*n)
+
+# random writes/reads on MemoryZones using each sequence:
+def check_zone(count,rnd):
+    A = MemoryZone()
+    B = MemoryZone()
+    B._map = listmap()
+    for n in xrange(count):
+        op = rnd.random()
+        if op<0.6:
+            v = rnd.randrange(0,0x1000)
+            d = randdata(rnd)
+            A.write(v,d if not isinstance(d,bytearray) else bytearray(d))
+            B.write(v,d)
+        elif op<0.65:
+            A.restruct()
+            B.restruct()
+            B._map = listmap(B._map)
+        else:
+            v = rnd.randrange(0,0x1000)
+            l = rnd.randint(1,64)
+            ra = map(part,A.read(v,l))
+            rb = map(part,B.read(v,l))
+            if ra!=rb: fail('read(%#x,%d): %s / %s',v,l,ra,rb)
+        if n%16==0 and str(A)!=str(B): fail('str after %d operations',n)
+    if str(A)!=str(B): fail('str')
+    print 'zone: %d operations ok (%d objs)'%(count,len(A._map))
+
+def main(count=5000,seed=0):
+    rnd = random.Random(seed)
+    check_sequence(count,rnd)
+    check_zone(count,rnd)
+
+if __name__=='__main__':
+    main(*map(int,sys.argv[1:]))